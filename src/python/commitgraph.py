@@ -0,0 +1,226 @@
+# git's commit-graph file: parents, root trees and generation numbers of every commit
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+from pathlib import Path
+from typing import Dict, Iterable, List, Tuple
+
+GRAPH_SIGNATURE = b"CGPH"
+GRAPH_VERSION = 1
+GRAPH_HASH_VERSION = 1
+GRAPH_HEADER = struct.Struct(">4sBBBB")
+GRAPH_CHUNK = struct.Struct(">4sQ")
+CHUNK_OID_FANOUT = b"OIDF"
+CHUNK_OID_LOOKUP = b"OIDL"
+CHUNK_COMMIT_DATA = b"CDAT"
+CHUNK_EXTRA_EDGES = b"EDGE"
+# tree, first parent, second parent, generation and commit time
+COMMIT_DATA = struct.Struct(">20sIIII")
+PARENT_NONE = 0x70000000
+# set on the second parent when the parents continue in the EDGE chunk, and on the last of them there
+EDGE_FLAG = 0x80000000
+GENERATION_MAX = 0x3FFFFFFF
+
+
+class CommitGraph:
+    """
+    Read-only view of a commit-graph file, mapped into memory.
+
+    Commits are numbered by their position in the sorted list of shas, and each one
+    has a fixed-size record with its root tree, the positions of its parents, its
+    generation number and its commit time. A history walk reads those records
+    instead of inflating and parsing commit objects.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        with open(path, "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        signature, version, hash_version, chunk_count, _ = GRAPH_HEADER.unpack_from(
+            self.data, 0
+        )
+        if (
+            signature != GRAPH_SIGNATURE
+            or version != GRAPH_VERSION
+            or hash_version != GRAPH_HASH_VERSION
+        ):
+            self.close()
+            raise ValueError(f"Commit-graph {path} has an unknown signature or version")
+        with memoryview(self.data) as view:
+            checksum = hashlib.sha1(view[:-20]).digest()
+        if checksum != self.data[-20:]:
+            self.close()
+            raise ValueError(f"Commit-graph {path} is corrupt, checksum mismatch")
+
+        self.chunks: Dict[bytes, int] = {}
+        for i in range(chunk_count):
+            chunk_id, offset = GRAPH_CHUNK.unpack_from(
+                self.data, GRAPH_HEADER.size + i * GRAPH_CHUNK.size
+            )
+            self.chunks[chunk_id] = offset
+        self.fanout = struct.unpack_from(
+            ">256I", self.data, self.chunks[CHUNK_OID_FANOUT]
+        )
+        self.count = self.fanout[255]
+        self.lookup_start = self.chunks[CHUNK_OID_LOOKUP]
+        self.data_start = self.chunks[CHUNK_COMMIT_DATA]
+        self.edges_start = self.chunks.get(CHUNK_EXTRA_EDGES)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __contains__(self, sha: str) -> bool:
+        return self.position(sha) is not None
+
+    def position(self, sha: str) -> int | None:
+        # binary search between the fan-out bounds of the first byte
+        name = bytes.fromhex(sha)
+        lo = self.fanout[name[0] - 1] if name[0] else 0
+        hi = self.fanout[name[0]]
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = self.lookup_start + 20 * mid
+            current = self.data[start : start + 20]
+            if current < name:
+                lo = mid + 1
+            elif current > name:
+                hi = mid
+            else:
+                return mid
+        return None
+
+    def sha_at(self, pos: int) -> str:
+        start = self.lookup_start + 20 * pos
+        return self.data[start : start + 20].hex()
+
+    def commit_at(self, pos: int) -> Tuple[str, List[int], int, int]:
+        """
+        :return: (root tree, parent positions, generation, commit time) of the commit at a position.
+        """
+        tree, first, second, high, low = COMMIT_DATA.unpack_from(
+            self.data, self.data_start + COMMIT_DATA.size * pos
+        )
+        parents: List[int] = []
+        if first != PARENT_NONE:
+            parents.append(first)
+        if second & EDGE_FLAG:
+            edge = self.edges_start + 4 * (second & ~EDGE_FLAG)
+            while True:
+                value = struct.unpack_from(">I", self.data, edge)[0]
+                parents.append(value & ~EDGE_FLAG)
+                if value & EDGE_FLAG:
+                    break
+                edge += 4
+        elif second != PARENT_NONE:
+            parents.append(second)
+        generation = high >> 2
+        commit_time = ((high & 0x3) << 32) | low
+        return tree.hex(), parents, generation, commit_time
+
+    def close(self):
+        self.data.close()
+
+
+def write_commit_graph(
+    path: Path, commits: Dict[str, Tuple[str, List[str], int]]
+) -> int:
+    """
+    Writes a commit-graph file for a set of commits.
+
+    :param commits: sha -> (root tree, parent shas, commit time). The parents of every
+        commit have to be in the set as well.
+    :return: Number of commits written.
+    """
+    order = sorted(commits)
+    positions = {sha: pos for pos, sha in enumerate(order)}
+    generations = compute_generations(
+        {sha: parents for sha, (_, parents, _) in commits.items()}
+    )
+
+    fanout = [0] * 256
+    for sha in order:
+        fanout[int(sha[:2], 16)] += 1
+    for i in range(1, 256):
+        fanout[i] += fanout[i - 1]
+
+    commit_data = bytearray()
+    edges: List[int] = []
+    for sha in order:
+        tree, parents, commit_time = commits[sha]
+        parent_positions = [positions[parent] for parent in parents]
+        first = parent_positions[0] if parent_positions else PARENT_NONE
+        if len(parent_positions) <= 2:
+            second = parent_positions[1] if len(parent_positions) == 2 else PARENT_NONE
+        else:
+            # octopus merges keep their second and later parents in the EDGE chunk
+            second = EDGE_FLAG | len(edges)
+            edges.extend(parent_positions[1:])
+            edges[-1] |= EDGE_FLAG
+        generation = min(generations[sha], GENERATION_MAX)
+        commit_data += COMMIT_DATA.pack(
+            bytes.fromhex(tree),
+            first,
+            second,
+            (generation << 2) | ((commit_time >> 32) & 0x3),
+            commit_time & 0xFFFFFFFF,
+        )
+
+    chunks = [
+        (CHUNK_OID_FANOUT, struct.pack(">256I", *fanout)),
+        (CHUNK_OID_LOOKUP, b"".join(bytes.fromhex(sha) for sha in order)),
+        (CHUNK_COMMIT_DATA, bytes(commit_data)),
+    ]
+    if edges:
+        chunks.append((CHUNK_EXTRA_EDGES, struct.pack(f">{len(edges)}I", *edges)))
+
+    out = bytearray(
+        GRAPH_HEADER.pack(
+            GRAPH_SIGNATURE, GRAPH_VERSION, GRAPH_HASH_VERSION, len(chunks), 0
+        )
+    )
+    offset = GRAPH_HEADER.size + GRAPH_CHUNK.size * (len(chunks) + 1)
+    for chunk_id, payload in chunks:
+        out += GRAPH_CHUNK.pack(chunk_id, offset)
+        offset += len(payload)
+    out += GRAPH_CHUNK.pack(b"\0\0\0\0", offset)
+    for _, payload in chunks:
+        out += payload
+    out += hashlib.sha1(out).digest()
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix="tmp_graph_")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(out)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return len(order)
+
+
+def compute_generations(parents: Dict[str, Iterable[str]]) -> Dict[str, int]:
+    """
+    Generation numbers: 1 for a root commit, one more than the highest parent otherwise.
+
+    Iterative, a linear history of any length doesn't hit the recursion limit.
+    """
+    generations: Dict[str, int] = {}
+    for start in parents:
+        if start in generations:
+            continue
+        stack = [start]
+        while stack:
+            sha = stack[-1]
+            missing = [p for p in parents[sha] if p not in generations]
+            if missing:
+                stack.extend(missing)
+                continue
+            stack.pop()
+            generations[sha] = 1 + max(
+                (generations[p] for p in parents[sha]), default=0
+            )
+    return generations
@@ -0,0 +1,89 @@
+# .pygit/config, in git's config format, for the few settings pygit keeps
+import os
+import re
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple
+
+SECTION = re.compile(r'^\[\s*([A-Za-z0-9.-]+)(?:\s+"((?:[^"\\]|\\.)*)")?\s*\]$')
+
+
+class Config:
+    """
+    Reads and writes the subset of git's config format pygit needs.
+
+    Sections are "[name]" or '[name "subsection"]' followed by "key = value" lines,
+    comments start with "#" or ";". Section and key names are case-insensitive,
+    subsections are not. Every write rewrites the file through a lock file.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        # (section, subsection) -> key -> values, in file order
+        self.sections: Dict[Tuple[str, str | None], Dict[str, List[str]]] = {}
+        self.load()
+
+    def load(self):
+        self.sections = {}
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                lines = f.read().splitlines()
+        except FileNotFoundError:
+            return
+        current: Dict[str, List[str]] | None = None
+        for line in lines:
+            line = line.strip()
+            if not line or line[0] in "#;":
+                continue
+            match = SECTION.match(line)
+            if match:
+                name, subsection = match.groups()
+                if subsection is not None:
+                    subsection = re.sub(r"\\(.)", r"\1", subsection)
+                current = self.sections.setdefault((name.lower(), subsection), {})
+                continue
+            if current is None:
+                raise ValueError(f"Bad config line {line!r} in {self.path}")
+            key, _, value = line.partition("=")
+            current.setdefault(key.strip().lower(), []).append(value.strip())
+
+    def get(self, section: str, subsection: str | None, key: str) -> str | None:
+        # the last value wins, like in git
+        values = self.sections.get((section.lower(), subsection), {}).get(key.lower())
+        return values[-1] if values else None
+
+    def subsections(self, section: str) -> Iterator[str]:
+        for name, subsection in self.sections:
+            if name == section.lower() and subsection is not None:
+                yield subsection
+
+    def set(self, section: str, subsection: str | None, key: str, value: str):
+        values = self.sections.setdefault((section.lower(), subsection), {})
+        values[key.lower()] = [value]
+        self.write()
+
+    def remove_section(self, section: str, subsection: str | None) -> bool:
+        if self.sections.pop((section.lower(), subsection), None) is None:
+            return False
+        self.write()
+        return True
+
+    def write(self):
+        out = []
+        for (name, subsection), values in self.sections.items():
+            if subsection is None:
+                out.append(f"[{name}]")
+            else:
+                escaped = subsection.replace("\\", "\\\\").replace('"', '\\"')
+                out.append(f'[{name} "{escaped}"]')
+            for key, items in values.items():
+                out.extend(f"\t{key} = {value}" for value in items)
+        lock_path = self.path.with_name(self.path.name + ".lock")
+        try:
+            f = open(lock_path, "x", encoding="utf-8")
+        except FileExistsError:
+            raise FileExistsError(
+                f"Unable to create '{lock_path}': another pygit process seems to be running"
+            )
+        with f:
+            f.write("".join(line + "\n" for line in out))
+        os.replace(lock_path, self.path)
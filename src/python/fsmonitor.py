@@ -0,0 +1,356 @@
+# filesystem monitor daemon, tells add and status which paths changed since a token
+import ctypes
+import ctypes.util
+import json
+import os
+import selectors
+import socket
+import struct
+import time
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from ignore import IGNORE_FILE
+
+SOCKET_NAME = "fsmonitor.sock"
+PID_NAME = "fsmonitor.pid"
+# seconds a client waits for the daemon, it answers from memory so this is only hit if it hangs
+CLIENT_TIMEOUT = 5.0
+# seconds start waits for the daemon to watch the whole tree
+START_TIMEOUT = 60.0
+
+# inotify event masks, from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+WATCH_MASK = (
+    IN_MODIFY
+    | IN_ATTRIB
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_ONLYDIR
+)
+# wd, mask, cookie, length of the name that follows
+INOTIFY_EVENT = struct.Struct("iIII")
+INOTIFY_READ_SIZE = 64 * 1024
+
+
+class Inotify:
+    """
+    Minimal inotify binding over ctypes, so the daemon needs nothing outside the standard library.
+    """
+
+    def __init__(self) -> None:
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.libc.inotify_init1.argtypes = [ctypes.c_int]
+        self.libc.inotify_add_watch.argtypes = [
+            ctypes.c_int,
+            ctypes.c_char_p,
+            ctypes.c_uint32,
+        ]
+        self.libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), "inotify_init1")
+
+    def add_watch(self, path: str, mask: int = WATCH_MASK) -> int:
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), path)
+        return wd
+
+    def rm_watch(self, wd: int):
+        # fails if the kernel already dropped the watch, with its directory
+        self.libc.inotify_rm_watch(self.fd, wd)
+
+    def read_events(self) -> List[Tuple[int, int, str]]:
+        """
+        :return: (wd, mask, name) of every queued event, empty if there is none.
+        """
+        try:
+            data = os.read(self.fd, INOTIFY_READ_SIZE)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _cookie, length = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size
+            name = data[offset : offset + length].rstrip(b"\0")
+            offset += length
+            events.append((wd, mask, os.fsdecode(name)))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class FsMonitorDaemon:
+    """
+    Watches every directory of the working tree and remembers which paths changed.
+
+    Every change bumps a sequence number, and a token is the daemon's id plus the
+    sequence number at the time it was handed out. Asked for the changes since a
+    token, the daemon answers with the paths whose last change is newer. A token of
+    another daemon, or one older than a lost event (inotify queue overflow), gets
+    "full" as the answer, and the client walks the whole tree instead.
+    """
+
+    def __init__(self, pygit: Path) -> None:
+        self.pygit = pygit
+        self.inotify = Inotify()
+        # wd -> directory, and back, "" for the root
+        self.watches: Dict[int, str] = {}
+        self.dirs: Dict[str, int] = {}
+        self.seq = 0
+        # path -> sequence number of its last change
+        self.dirty: Dict[str, int] = {}
+        # tokens older than this missed events
+        self.overflow_seq = 0
+        self.id = f"{os.getpid()}-{time.time_ns()}"
+        self.running = False
+
+    def watch_tree(self, directory: str):
+        stack = [directory]
+        while stack:
+            current = stack.pop()
+            try:
+                wd = self.inotify.add_watch(current or ".")
+            except (FileNotFoundError, NotADirectoryError):
+                # gone before the watch was added, its parent reports it
+                continue
+            self.watches[wd] = current
+            self.dirs[current] = wd
+            try:
+                with os.scandir(current or ".") as entries:
+                    for entry in entries:
+                        path = f"{current}/{entry.name}" if current else entry.name
+                        if entry.is_dir(follow_symlinks=False) and not self.is_internal(
+                            path
+                        ):
+                            stack.append(path)
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+
+    def unwatch_tree(self, directory: str):
+        prefix = directory + "/"
+        for path in [d for d in self.dirs if d == directory or d.startswith(prefix)]:
+            wd = self.dirs.pop(path)
+            self.watches.pop(wd, None)
+            self.inotify.rm_watch(wd)
+
+    def is_internal(self, path: str) -> bool:
+        # the object store changes on every command, none of it is working tree
+        return path.split("/", 1)[0] == self.pygit.name
+
+    def mark(self, path: str):
+        self.seq += 1
+        self.dirty[path] = self.seq
+
+    def handle(self, wd: int, mask: int, name: str):
+        if mask & IN_Q_OVERFLOW:
+            self.seq += 1
+            self.overflow_seq = self.seq
+            return
+        directory = self.watches.get(wd)
+        if directory is None:
+            return
+        if mask & IN_IGNORED:
+            # the directory is gone, or the watch was removed
+            del self.watches[wd]
+            if self.dirs.get(directory) == wd:
+                del self.dirs[directory]
+            return
+        if not name:
+            return
+
+        path = f"{directory}/{name}" if directory else name
+        if self.is_internal(path):
+            return
+        if mask & IN_ISDIR:
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                self.watch_tree(path)
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                self.unwatch_tree(path)
+        self.mark(path)
+
+    def drain(self):
+        while events := self.inotify.read_events():
+            for event in events:
+                self.handle(*event)
+
+    def token(self) -> str:
+        return f"{self.id}:{self.seq}"
+
+    def changed_since(self, token: str | None) -> dict:
+        # events already queued by the kernel happened before the question, they count
+        self.drain()
+        daemon_id, _, seq = (token or "").rpartition(":")
+        if daemon_id != self.id or not seq.isdigit() or int(seq) < self.overflow_seq:
+            return {"token": self.token(), "full": True, "paths": []}
+        since = int(seq)
+        return {
+            "token": self.token(),
+            "full": False,
+            "paths": sorted(path for path, at in self.dirty.items() if at > since),
+        }
+
+    def answer(self, request: dict) -> dict:
+        command = request.get("command")
+        if command == "query":
+            return self.changed_since(request.get("token"))
+        if command == "status":
+            return {
+                "pid": os.getpid(),
+                "token": self.token(),
+                "watches": len(self.dirs),
+            }
+        if command == "stop":
+            self.running = False
+            return {"stopped": True}
+        return {"error": f"unknown command {command!r}"}
+
+    def serve(self):
+        """
+        Watches the tree, then answers one JSON request per connection until it is stopped.
+        """
+        self.watch_tree("")
+        socket_path = self.pygit / SOCKET_NAME
+        socket_path.unlink(missing_ok=True)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(str(socket_path))
+        server.listen()
+        with open(self.pygit / PID_NAME, "w") as f:
+            f.write(f"{os.getpid()}\n")
+
+        selector = selectors.DefaultSelector()
+        selector.register(self.inotify.fd, selectors.EVENT_READ, "inotify")
+        selector.register(server, selectors.EVENT_READ, "server")
+        self.running = True
+        try:
+            while self.running:
+                for key, _ in selector.select():
+                    if key.data == "inotify":
+                        self.drain()
+                    else:
+                        conn, _ = server.accept()
+                        with conn:
+                            self.reply(conn)
+        finally:
+            selector.close()
+            server.close()
+            socket_path.unlink(missing_ok=True)
+            (self.pygit / PID_NAME).unlink(missing_ok=True)
+            self.inotify.close()
+
+    def reply(self, conn: socket.socket):
+        conn.settimeout(CLIENT_TIMEOUT)
+        try:
+            with conn.makefile("rb") as f:
+                line = f.readline()
+            response = self.answer(json.loads(line))
+        except (OSError, ValueError) as e:
+            response = {"error": str(e)}
+        try:
+            conn.sendall(json.dumps(response).encode("utf-8") + b"\n")
+        except OSError:
+            pass
+
+
+def request(pygit: Path, command: str, **args) -> dict | None:
+    """
+    Sends one request to the daemon of the repo.
+
+    :return: The answer, or None if no daemon is running.
+    """
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+            conn.settimeout(CLIENT_TIMEOUT)
+            conn.connect(str(pygit / SOCKET_NAME))
+            conn.sendall(
+                json.dumps({"command": command, **args}).encode("utf-8") + b"\n"
+            )
+            with conn.makefile("rb") as f:
+                line = f.readline()
+    except OSError:
+        return None
+    try:
+        return json.loads(line)
+    except ValueError:
+        return None
+
+
+def changed_since(
+    pygit: Path, token: str | None
+) -> Tuple[str | None, List[str] | None]:
+    """
+    Asks the daemon which paths changed since a token.
+
+    :param token: Token saved with the last full scan, None if there is none.
+    :return: (new token, changed paths), the paths are None if the whole tree has to be walked.
+        The new token is None if no daemon is running.
+    """
+    answer = request(pygit, "query", token=token)
+    if answer is None or "token" not in answer:
+        return None, None
+    if answer["full"]:
+        return answer["token"], None
+    paths = answer["paths"]
+    # other ignore rules can make any path of the tree appear or disappear
+    if any(path.rpartition("/")[2] == IGNORE_FILE for path in paths):
+        return answer["token"], None
+    return answer["token"], paths
+
+
+def start(pygit: Path) -> dict | None:
+    """
+    Starts the daemon in the background, detached from the terminal.
+
+    :return: Status of the daemon once it answers, None if it didn't come up.
+    """
+    running = request(pygit, "status")
+    if running is not None:
+        return running
+
+    pid = os.fork()
+    if pid == 0:
+        # the daemon is a grandchild in its own session, so it outlives the command
+        os.setsid()
+        if os.fork() != 0:
+            os._exit(0)
+        devnull = os.open(os.devnull, os.O_RDWR)
+        for fd in (0, 1, 2):
+            os.dup2(devnull, fd)
+        try:
+            FsMonitorDaemon(pygit).serve()
+        finally:
+            os._exit(0)
+    os.waitpid(pid, 0)
+
+    deadline = time.monotonic() + START_TIMEOUT
+    while time.monotonic() < deadline:
+        status = request(pygit, "status")
+        if status is not None:
+            return status
+        time.sleep(0.05)
+    return None
+
+
+def stop(pygit: Path) -> bool:
+    """
+    :return: True if a daemon was running.
+    """
+    return request(pygit, "stop") is not None
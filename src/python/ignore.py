@@ -0,0 +1,200 @@
+# matching of the working tree against .pygitignore files
+import os
+import re
+from typing import Dict, List, Tuple
+
+import tracing
+
+IGNORE_FILE = ".pygitignore"
+
+
+def translate(pattern: str) -> str:
+    """
+    Translates one gitignore glob into a regex for paths relative to the ignore file.
+
+    "*" and "?" don't cross a "/", "[...]" is a character class, "**/" matches any number
+    of directories, a trailing "/**" everything inside and "\\" escapes the next character.
+    """
+    out: List[str] = []
+    i = 0
+    n = len(pattern)
+    while i < n:
+        c = pattern[i]
+        if c == "*":
+            if pattern[i : i + 2] == "**" and (i == 0 or pattern[i - 1] == "/"):
+                if pattern[i + 2 : i + 3] == "/":
+                    out.append("(?:.*/)?")
+                    i += 3
+                    continue
+                if i + 2 == n:
+                    out.append(".*")
+                    i += 2
+                    continue
+            while i < n and pattern[i] == "*":
+                i += 1
+            out.append("[^/]*")
+            continue
+        if c == "?":
+            out.append("[^/]")
+        elif c == "[":
+            start = i + 1
+            if pattern[start : start + 1] in ("!", "^"):
+                start += 1
+            # a "]" right after the "[" or the negation is a member, not the end
+            if pattern[start : start + 1] == "]":
+                start += 1
+            end = pattern.find("]", start)
+            if end == -1 or end == i + 1:
+                out.append(re.escape(c))
+            else:
+                body = pattern[i + 1 : end]
+                negated = body[0] in ("!", "^")
+                if negated:
+                    body = body[1:]
+                members = "".join("\\" + m if m in "\\[]" else m for m in body)
+                out.append(f"(?!/)[{'^' if negated else ''}{members}]")
+                i = end
+        elif c == "\\" and i + 1 < n:
+            out.append(re.escape(pattern[i + 1]))
+            i += 1
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return "".join(out)
+
+
+def compile_patterns(
+    lines: List[str],
+) -> Tuple[re.Pattern | None, re.Pattern | None, Dict[str, bool]]:
+    """
+    Compiles the patterns of one ignore file into two regexes, for directories and for files.
+
+    Each pattern becomes a named alternative, in reverse order, so the alternative that
+    matches is the last matching pattern of the file, the one git lets win.
+
+    :return: (regex for directories, regex for files, group name -> negated).
+    """
+    dir_parts: List[str] = []
+    file_parts: List[str] = []
+    negated: Dict[str, bool] = {}
+
+    for number, line in enumerate(lines):
+        line = line.rstrip("\r\n")
+        # trailing spaces don't count, unless they are escaped
+        while line.endswith(" ") and not line.endswith("\\ "):
+            line = line[:-1]
+        if not line or line.startswith("#"):
+            continue
+
+        negate = line.startswith("!")
+        if negate:
+            line = line[1:]
+        elif line.startswith("\\!") or line.startswith("\\#"):
+            line = line[1:]
+
+        dir_only = line.endswith("/")
+        line = line.rstrip("/")
+        if not line:
+            continue
+
+        # a "/" anywhere but at the end anchors the pattern to the ignore file's directory
+        if "/" in line:
+            regex = translate(line.lstrip("/"))
+        else:
+            regex = "(?:.*/)?" + translate(line)
+
+        group = f"p{number}"
+        negated[group] = negate
+        part = f"(?P<{group}>{regex})"
+        dir_parts.insert(0, part)
+        if not dir_only:
+            file_parts.insert(0, part)
+
+    def build(parts: List[str]) -> re.Pattern | None:
+        return re.compile("|".join(parts), re.DOTALL) if parts else None
+
+    return build(dir_parts), build(file_parts), negated
+
+
+class Ignore:
+    """
+    Decides which paths of the working tree are ignored.
+
+    Every directory can have its own .pygitignore, whose patterns apply to the paths
+    below it and take precedence over those of the parent directories. Each file is
+    compiled once into a single regex, and the verdict of every directory is memoized,
+    so the cost per path doesn't grow with the number of patterns.
+    """
+
+    def __init__(self, root: str = ".", ignore_file: str = IGNORE_FILE) -> None:
+        self.root = root
+        self.ignore_file = ignore_file
+        # directory -> compiled rules of its ignore file, None if it has none
+        self.rules: Dict[
+            str, Tuple[re.Pattern | None, re.Pattern | None, Dict[str, bool]] | None
+        ] = {}
+        # directory -> its ignore files and their own directories, innermost first
+        self.levels: Dict[str, List[Tuple[str, Tuple]]] = {}
+        # directory -> whether it is ignored, itself or through one of its parents
+        self.dir_ignored: Dict[str, bool] = {"": False}
+
+    def load_rules(self, directory: str):
+        if directory not in self.rules:
+            path = os.path.join(self.root, directory, self.ignore_file)
+            try:
+                with open(path, "r") as f:
+                    self.rules[directory] = compile_patterns(f.readlines())
+            except (FileNotFoundError, NotADirectoryError):
+                self.rules[directory] = None
+        return self.rules[directory]
+
+    def levels_for(self, directory: str) -> List[Tuple[str, Tuple]]:
+        levels = self.levels.get(directory)
+        if levels is None:
+            parent = directory.rpartition("/")[0] if directory else None
+            inherited = self.levels_for(parent) if parent is not None else []
+            rules = self.load_rules(directory)
+            levels = [(directory, rules)] + inherited if rules else inherited
+            self.levels[directory] = levels
+        return levels
+
+    def match(self, path: str, is_dir: bool) -> bool:
+        # the innermost ignore file with a matching pattern decides
+        parent = path.rpartition("/")[0]
+        for directory, (dir_regex, file_regex, negated) in self.levels_for(parent):
+            regex = dir_regex if is_dir else file_regex
+            if regex is None:
+                continue
+            relative = path[len(directory) + 1 :] if directory else path
+            found = regex.fullmatch(relative)
+            if found is not None:
+                return not negated[found.lastgroup]
+        return False
+
+    @tracing.timed("ignore-match")
+    def is_ignored(self, path: str, is_dir: bool = False) -> bool:
+        """
+        :param path: Path relative to the root, "/" separated, without a leading "./".
+        :param is_dir: Whether the path is a directory, patterns ending in "/" only match those.
+        :return: True if the path, or one of its parent directories, is ignored.
+        """
+        if path.split("/", 1)[0] == ".pygit":
+            return True
+        parent = path.rpartition("/")[0]
+        if self.is_dir_ignored(parent):
+            return True
+        if is_dir:
+            return self.is_dir_ignored(path)
+        return self.match(path, False)
+
+    def is_dir_ignored(self, directory: str) -> bool:
+        ignored = self.dir_ignored.get(directory)
+        if ignored is None:
+            parent = directory.rpartition("/")[0]
+            ignored = (
+                directory.split("/", 1)[0] == ".pygit"
+                or self.is_dir_ignored(parent)
+                or self.match(directory, True)
+            )
+            self.dir_ignored[directory] = ignored
+        return ignored
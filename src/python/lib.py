@@ -1,18 +1,71 @@
 # here we will write the helper clases
-import fnmatch
 import hashlib
+import heapq
+import itertools
 import json
+import math
+import mmap
 import os
 import stat
+import struct
+import sys
+import tempfile
+import threading
+import time
 import zlib
-from datetime import datetime
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
-from typing import Dict, List, Tuple
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Tuple
+
+import fsmonitor
+import linediff
+import protocol
+import tracing
+from commitgraph import CommitGraph, write_commit_graph
+from config import Config
+from ignore import Ignore
+from pack import (
+    DELTA_DEPTH,
+    DELTA_WINDOW,
+    OBJ_TYPE_NUMBERS,
+    Pack,
+    PackWriter,
+    index_pack,
+    write_pack,
+)
+from refs import ZERO_SHA, Refs, identity
+from walk import Walker
+
+# files are streamed into blob objects in chunks of this size
+BLOB_CHUNK_SIZE = 1 << 20
+# a bulk write of fewer new objects stays loose, a pack of its own wouldn't pay off
+BULK_PACK_MIN = 256
+# inflated objects kept in memory by ObjectDatabase
+OBJECT_CACHE_BYTES = 64 << 20
+# longest +/- bar of diff --stat
+DIFF_STAT_WIDTH = 50
+# hex digits of the shas on the index line of a patch
+DIFF_ABBREV = 7
+# most changes whose blobs are fetched from a promisor remote in one request
+PROMISOR_BATCH = 1024
+# gc --prune keeps unreachable loose objects younger than this, an add or commit
+# running meanwhile may be about to reference them
+PRUNE_EXPIRE = "2.weeks.ago"
+PRUNE_UNITS = {
+    "second": 1,
+    "minute": 60,
+    "hour": 3600,
+    "day": 86400,
+    "week": 7 * 86400,
+}
 
 
 class Add:
 
-    def __init__(self, files, pygit: Path) -> None:
+    def __init__(self, files, pygit: Path, jobs: int | None = None) -> None:
 
         # either the user will give "." for all files or he will give indivisual file names
         if len(files) > 1 or "." not in files:
@@ -22,298 +75,3277 @@ class Add:
 
         self.pygit = pygit
         self.obj_dir = pygit / "objects"
-        self.index_path = pygit / "index.json"
-        self.index_object = Index(index_path=self.index_path, obj_dir=self.obj_dir)
+        self.index_path = pygit / "index"
+        self.store = ObjectStore(self.obj_dir)
+        self.index_object = Index(
+            index_path=self.index_path, obj_dir=self.obj_dir, store=self.store
+        )
+        # number of files hashed and compressed in parallel, one per core by default
+        self.jobs = jobs or os.cpu_count() or 1
 
         pass
 
     #  NOTE: 1. create blob, 2. create sha-1 hash, 3. compress the content, 4. write the index file and blobs objects
-    def compute_hash(self, content: str):
-        header = f"blob {len(content)}\0".encode("utf-8")
-        current_content = content.encode(encoding="utf-8")
-        return hashlib.sha1(header + current_content).hexdigest()
-
-    def write_blobs(self, content: str, obj_dir: Path):
-        hash = self.compute_hash(content)
-        blob_dir = obj_dir / hash[:2]
-        blob_fileName = blob_dir / hash[2:]
-
-        blob_dir.mkdir(exist_ok=True)
-        # if os.path.exists()
-        # it will write the code again and again
-        with open(blob_fileName, "wb") as f:
-            f.write(zlib.compress(content.encode("utf-8")))
+    def hash_file(self, file_path, st: os.stat_result) -> str:
+        # runs on the pool, hashlib and zlib release the GIL on large buffers
+        if stat.S_ISLNK(st.st_mode):
+            # a symlink's blob is its target, like git's
+            return self.store.write_object("blob", os.fsencode(os.readlink(file_path)))
+        return self.store.write_file(file_path, size=st.st_size)
 
-        return hash
+    def walk_files(
+        self,
+        ignore: Ignore,
+        seen: set | None = None,
+        paths: List[str] | None = None,
+    ) -> Iterator[Tuple[str, os.stat_result]]:
+        """
+        Walks the working tree and yields the files that have to be hashed.
 
-    def read_ignored_patterns(self, ignore_file=".pygitignore"):
-        patterns = []
-        if os.path.exists(ignore_file):
-            with open(ignore_file, "r") as f:
-                for line in f:
-                    line = line.strip()
-                    if not line.startswith("#"):
-                        patterns.append(line)
+        :param ignore: Ignore rules of the working tree.
+        :param seen: Filled with the path of every file found, clean or not.
+        :param paths: Files and directories to walk, the ones given to add by default.
+        :return: (path, stat) for every file whose stat data doesn't match the index.
+        """
+        if paths is None:
+            paths = self.files if isinstance(self.files, list) else [self.files]
+            if not isinstance(self.files, list):
+                self.index_object.load_names()
+        # the stat comes from the walk's DirEntry, it is the one the index entry is written with
+        for file_path, st in Walker(ignore=ignore, jobs=self.jobs).walk(paths):
+            if seen is not None:
+                if file_path in seen:
+                    continue
+                seen.add(file_path)
+            # stat data still matches the index entry, so the blob is already stored
+            if self.index_object.is_stat_clean(file_path, st):
+                continue
+            yield file_path, st
 
-        return patterns
+    def in_scope(self, path: str) -> bool:
+        # whether an index path is below one of the paths given to add
+        if not isinstance(self.files, list):
+            return True
+        for file in self.files:
+            file = os.path.normpath(file)
+            if file == "." or path == file or path.startswith(file + "/"):
+                return True
+        return False
 
     def stage_files(self, files):
-        ignore_pattern = self.read_ignored_patterns()
-        self.index_object.delete_index_content()
-        if type(self.files).__name__ == "list":
+        # a path given to add has to be in the working tree or in the index, where its removal is staged
+        if isinstance(self.files, list):
             for file in self.files:
-                # print(file)
-                pass
-        elif type(self.files).__name__ == "str":
-            for root, dirs, files in os.walk(self.files):
-                # print(root)
-                dirs[:] = [
-                    dir
-                    for dir in dirs
-                    if not any(
-                        fnmatch.fnmatch(dir, p.rstrip("/")) for p in ignore_pattern
+                path = os.path.normpath(file)
+                if (
+                    not os.path.lexists(path)
+                    and next(self.index_object.iter_under(path), None) is None
+                ):
+                    raise ValueError(
+                        f"fatal: pathspec '{file}' did not match any files"
                     )
-                ]
-                files[:] = [
-                    file
-                    for file in files
-                    if not any(fnmatch.fnmatch(file, f) for f in ignore_pattern)
-                ]
-                print(files)
-
-                for file in files:
-                    full_file_path = root + "/" + file
-                    with open(full_file_path, "r") as f:
-                        content = f.read()
-                        self.write_blobs(content=content, obj_dir=self.obj_dir)
-                        current_hash = self.compute_hash(content)
-                        self.index_object.write_index_content(
-                            file_path=full_file_path, hash=current_hash
-                        )
+
+        ignore = Ignore()
+        seen = set()
+        # with a running fsmonitor daemon, "add ." only walks the paths changed since the last one
+        token, changed = None, None
+        if not isinstance(self.files, list):
+            token, changed = fsmonitor.changed_since(
+                self.pygit, self.index_object.fsmonitor_token
+            )
+        present = None
+        if changed is not None:
+            present = [path for path in changed if os.path.lexists(path)]
+
+        # every index update of this add is buffered and flushed once, atomically
+        with self.index_object.transaction():
+            # the walk feeds the pool, so hashing starts before the walk is over
+            with tracing.span("walk+hash", jobs=self.jobs):
+                with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+                    staged = [
+                        (file_path, st, pool.submit(self.hash_file, file_path, st))
+                        for file_path, st in self.walk_files(ignore, seen, present)
+                    ]
+            tracing.count("files_stated", len(seen))
+            tracing.count("files_hashed", len(staged))
+
+            # merged in path order, so the result doesn't depend on which worker finished first
+            staged.sort(key=lambda item: item[0])
+            for file_path, st, future in staged:
+                self.index_object.write_index_content(
+                    file_path=file_path, hash=future.result(), st=st
+                )
+
+            if changed is None:
+                # only the entries the walk didn't find can be gone
+                gone = (
+                    path
+                    for path, _ in self.index_object.iter_entries()
+                    if path not in seen and self.in_scope(path)
+                )
+            else:
+                # a removed directory is reported as one path, its entries go with it
+                gone = {
+                    entry_path
+                    for path in changed
+                    if not os.path.lexists(path)
+                    for entry_path, _ in self.index_object.iter_under(path)
+                }
+            self.index_object.delete_index_content(gone)
+
+            # the whole tree is staged as of the token, later changes are reported after it
+            if token is not None:
+                self.index_object.set_fsmonitor_token(token)
+
+        self.store.save()
+
+
+# binary index layout, modeled on git's DIRC index (version 2)
+INDEX_SIGNATURE = b"DIRC"
+INDEX_VERSION = 2
+INDEX_HEADER = struct.Struct(">4sII")
+# ctime_s, ctime_ns, mtime_s, mtime_ns, dev, ino, mode, uid, gid, size, sha-1, flags
+INDEX_ENTRY = struct.Struct(">10I20sH")
+# the stat fields at the start of every entry, up to the sha-1
+INDEX_STAT = struct.Struct(">10I")
+# extension with the entries' end and the offset of every entry, always written last
+INDEX_OFFSETS_EXT = b"POFF"
+# git's cache-tree extension, the tree sha of every directory that didn't change since the last commit
+INDEX_TREE_EXT = b"TREE"
+# git's fsmonitor extension, here just the token of the last full scan
+INDEX_FSMONITOR_EXT = b"FSMN"
+# the index is spliced instead of rewritten while fewer than 1 in this many entries changed
+INDEX_SPLICE_RATIO = 16
+UINT32_MASK = 0xFFFFFFFF
+
+
+class IndexFile:
+    """
+    Read-only view of a binary index file, mapped into memory with mmap.
+
+    The layout is git's DIRC index: a 12 byte header, the entries sorted by path
+    (62 fixed-width bytes of stat data, binary sha-1 and flags, followed by the
+    NUL padded name), the extensions and a trailing sha-1 of everything before it.
+    The last extension holds the offset of every entry, so a single path is found
+    by binary search without decoding the rest of the file.
+    """
+
+    def __init__(self, path: Path) -> None:
+        with open(path, "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self.data) < INDEX_HEADER.size + 20:
+            self.close()
+            raise ValueError(f"Index file {path} is too small to be valid")
+
+        signature, version, self.count = INDEX_HEADER.unpack_from(self.data, 0)
+        if signature != INDEX_SIGNATURE or version != INDEX_VERSION:
+            self.close()
+            raise ValueError(f"Index file {path} has an unknown signature or version")
+
+        with memoryview(self.data) as view:
+            checksum = hashlib.sha1(view[:-20]).digest()
+        if checksum != self.data[-20:]:
+            self.close()
+            raise ValueError(f"Index file {path} is corrupt, checksum mismatch")
+
+        # the offsets extension sits right before the checksum: sig, size, end, offsets
+        ext_start = len(self.data) - 20 - 12 - 4 * self.count
+        ext_sig, ext_size, self.entries_end = struct.unpack_from(
+            ">4sII", self.data, ext_start
+        )
+        if ext_sig != INDEX_OFFSETS_EXT or ext_size != 4 * (self.count + 1):
+            self.close()
+            raise ValueError(f"Index file {path} has no entry offsets")
+        self.offsets_start = ext_start + 12
+        self.extensions = self.read_extensions(ext_start)
+        # path -> offset of every entry, only filled by load_names
+        self.by_name: Dict[str, int] | None = None
+
+    def read_extensions(self, ext_end: int) -> Dict[bytes, bytes]:
+        extensions: Dict[bytes, bytes] = {}
+        offset = self.entries_end
+        while offset < ext_end:
+            sig, size = struct.unpack_from(">4sI", self.data, offset)
+            extensions[sig] = self.data[offset + 8 : offset + 8 + size]
+            offset += 8 + size
+        return extensions
+
+    def __len__(self) -> int:
+        return self.count
+
+    def offset_of(self, i: int) -> int:
+        return struct.unpack_from(">I", self.data, self.offsets_start + 4 * i)[0]
+
+    def name_at(self, offset: int) -> bytes:
+        start = offset + INDEX_ENTRY.size
+        name_len = struct.unpack_from(">H", self.data, start - 2)[0] & 0xFFF
+        if name_len == 0xFFF:
+            # names of 4095 bytes or more don't fit the flags, they end at the first NUL
+            return self.data[start : self.data.find(b"\0", start)]
+        return self.data[start : start + name_len]
+
+    def entry_at(self, offset: int) -> dict:
+        (
+            ctime_s,
+            ctime_ns,
+            mtime_s,
+            mtime_ns,
+            _dev,
+            ino,
+            mode,
+            _uid,
+            _gid,
+            size,
+            sha,
+            _flags,
+        ) = INDEX_ENTRY.unpack_from(self.data, offset)
+        return {
+            "hash": sha.hex(),
+            "mode": f"{mode:o}",
+            "mtime": mtime_s + mtime_ns / 1e9,
+            "size": size,
+            "mtime_ns": mtime_s * 10**9 + mtime_ns,
+            "ctime_ns": ctime_s * 10**9 + ctime_ns,
+            "ino": ino,
+        }
+
+    def load_names(self):
+        """
+        Decodes every path once, so the lookups of a full walk are dict lookups instead
+        of binary searches that decode a name at every step.
+        """
+        if self.by_name is None:
+            offsets = struct.unpack_from(
+                f">{self.count}I", self.data, self.offsets_start
+            )
+            self.by_name = {
+                self.name_at(offset).decode("utf-8"): offset for offset in offsets
+            }
+
+    def find(self, path: str) -> int | None:
+        """
+        Binary search for a single path.
+
+        :return: Offset of the entry, or None if the path isn't in the index.
+        """
+        if self.by_name is not None:
+            return self.by_name.get(path)
+        i, found = self.position(path)
+        return self.offset_of(i) if found else None
+
+    def position(self, path: str) -> Tuple[int, bool]:
+        """
+        :return: (number of the entry, or where it would go, whether it is in the index).
+        """
+        name = path.encode("utf-8")
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            current = self.name_at(self.offset_of(mid))
+            if current < name:
+                lo = mid + 1
+            elif current > name:
+                hi = mid
+            else:
+                return mid, True
+        return lo, False
+
+    def lookup(self, path: str) -> dict | None:
+        """
+        :return: The entry dict, or None if the path isn't in the index.
+        """
+        offset = self.find(path)
+        return None if offset is None else self.entry_at(offset)
+
+    def stat_matches(self, path: str, stat_data: bytes) -> bool | None:
+        """
+        Compares the stat data of an entry as raw bytes, without decoding the entry.
+
+        :param stat_data: Stat fields of a file, as built by IndexFile.stat_data.
+        :return: Whether they are the same, None if the path isn't in the index.
+        """
+        offset = self.find(path)
+        if offset is None:
+            return None
+        return self.data[offset : offset + INDEX_STAT.size] == stat_data
+
+    @staticmethod
+    def stat_data(st: os.stat_result, mode: str) -> bytes:
+        # the stat fields of an entry, in the layout serialize writes them
+        return INDEX_STAT.pack(
+            (st.st_ctime_ns // 10**9) & UINT32_MASK,
+            st.st_ctime_ns % 10**9,
+            (st.st_mtime_ns // 10**9) & UINT32_MASK,
+            st.st_mtime_ns % 10**9,
+            0,
+            st.st_ino & UINT32_MASK,
+            int(mode, 8),
+            0,
+            0,
+            st.st_size & UINT32_MASK,
+        )
+
+    def __iter__(self) -> Iterator[Tuple[str, dict]]:
+        for i in range(self.count):
+            offset = self.offset_of(i)
+            yield self.name_at(offset).decode("utf-8"), self.entry_at(offset)
+
+    def close(self):
+        self.data.close()
+
+    @staticmethod
+    def serialize(
+        entries: Iterable[Tuple[str, dict]],
+        extensions: Dict[bytes, bytes] | None = None,
+    ) -> bytearray:
+        """
+        Builds the bytes of an index file.
+
+        :param entries: (path, entry) pairs, already sorted by path.
+        :param extensions: Optional extensions as signature -> payload.
+        """
+        out = bytearray(INDEX_HEADER.size)
+        offsets: List[int] = []
+        for path, entry in entries:
+            offsets.append(len(out))
+            IndexFile.pack_entry(out, path, entry)
+        return IndexFile.finish(out, offsets, extensions)
+
+    def splice(
+        self,
+        staged: List[Tuple[str, dict | None]],
+        extensions: Dict[bytes, bytes] | None = None,
+    ) -> bytearray:
+        """
+        Builds the bytes of this index with some entries added, replaced or removed.
+
+        The unchanged entries between two staged ones are copied as one run of raw
+        bytes, so only the staged entries are encoded, not the whole index.
+
+        :param staged: (path, entry) pairs sorted by path, an entry of None removes the path.
+        """
+        base_offsets = struct.unpack_from(
+            f">{self.count}I", self.data, self.offsets_start
+        )
+        out = bytearray(INDEX_HEADER.size)
+        offsets: List[int] = []
+
+        def copy(start: int, end: int):
+            if start >= end:
+                return
+            shift = len(out) - base_offsets[start]
+            offsets.extend(offset + shift for offset in base_offsets[start:end])
+            stop = base_offsets[end] if end < self.count else self.entries_end
+            out.extend(self.data[base_offsets[start] : stop])
+
+        i = 0
+        for path, entry in staged:
+            position, found = self.position(path)
+            copy(i, position)
+            if entry is not None:
+                offsets.append(len(out))
+                IndexFile.pack_entry(out, path, entry)
+            i = position + 1 if found else position
+        copy(i, self.count)
+        return IndexFile.finish(out, offsets, extensions)
+
+    @staticmethod
+    def pack_entry(out: bytearray, path: str, entry: dict):
+        name = path.encode("utf-8")
+        mtime_ns = entry.get("mtime_ns", 0)
+        ctime_ns = entry.get("ctime_ns", 0)
+        # dev, uid and gid aren't used for change detection, they stay zero
+        out += INDEX_ENTRY.pack(
+            (ctime_ns // 10**9) & UINT32_MASK,
+            ctime_ns % 10**9,
+            (mtime_ns // 10**9) & UINT32_MASK,
+            mtime_ns % 10**9,
+            0,
+            entry.get("ino", 0) & UINT32_MASK,
+            int(entry["mode"], 8),
+            0,
+            0,
+            entry["size"] & UINT32_MASK,
+            bytes.fromhex(entry["hash"]),
+            min(len(name), 0xFFF),
+        )
+        out += name
+        # pad with 1 to 8 NULs, so every entry is a multiple of 8 bytes long
+        out += b"\0" * (8 - (INDEX_ENTRY.size + len(name)) % 8)
+
+    @staticmethod
+    def finish(
+        out: bytearray, offsets: List[int], extensions: Dict[bytes, bytes] | None
+    ) -> bytearray:
+        # header count, extensions, the offsets extension last and the checksum
+        INDEX_HEADER.pack_into(out, 0, INDEX_SIGNATURE, INDEX_VERSION, len(offsets))
+        entries_end = len(out)
+        for sig, payload in (extensions or {}).items():
+            out += struct.pack(">4sI", sig, len(payload)) + payload
+        out += struct.pack(
+            ">4sII", INDEX_OFFSETS_EXT, 4 * (len(offsets) + 1), entries_end
+        )
+        out += struct.pack(f">{len(offsets)}I", *offsets)
+        out += hashlib.sha1(out).digest()
+        return out
 
 
 class Index:
-    def __init__(self, index_path: Path, obj_dir: Path) -> None:
-        if index_path.exists():
-            self.index_path = index_path
-            self.entries = self.load_index()
-            self.obj_dir = obj_dir
+    def __init__(
+        self, index_path: Path, obj_dir: Path, store: "ObjectStore | None" = None
+    ) -> None:
+        self.index_path = index_path
+        self.obj_dir = obj_dir
+        self.store = store or ObjectStore(obj_dir)
+        # set while a transaction is open, updates are then only kept in memory
+        self.lock_fd: int | None = None
+        self.dirty = False
+        # the index on disk, plus the staged updates on top of it (None marks a removed path)
+        self.base: IndexFile | None = None
+        self.changes: Dict[str, dict | None] = {}
+        # cache-tree: directory -> (entry count, tree sha), a count of -1 marks a tree to rebuild
+        self.cache_tree: Dict[str, Tuple[int, str | None]] = {}
+        # entries modified at or after this moment are "racily clean", their stat data can't be trusted
+        self.timestamp_ns = 0
+        # fsmonitor token of the last full scan, every path it doesn't report changed is clean
+        self.fsmonitor_token: str | None = None
+        self.load_index()
 
     def load_index(self):
+        if self.base is not None:
+            self.base.close()
+            self.base = None
+        self.changes = {}
+        self.cache_tree = {}
+        self.fsmonitor_token = None
+
         if self.index_path.exists():
-            with open(self.index_path) as f:
-                return json.load(f)
-        return {}
-
-    def write_index_content(self, file_path, hash):
-
-        blob_dir = hash[:2]
-        blob_obj = hash[2:]
-        blob_full_path = self.obj_dir / blob_dir / blob_obj
-
-        if os.path.exists(blob_full_path):
-            mode = self.file_mode(file_path)
-            mtime = os.path.getmtime(file_path)
-            size = os.path.getsize(file_path)
-            self.entries[file_path] = {
-                "hash": hash,
-                "mode": mode,
-                "mtime": mtime,
-                "size": size,
+            self.base = IndexFile(self.index_path)
+            self.timestamp_ns = os.stat(self.index_path).st_mtime_ns
+            if INDEX_TREE_EXT in self.base.extensions:
+                self.parse_cache_tree(self.base.extensions[INDEX_TREE_EXT], 0, None)
+            if INDEX_FSMONITOR_EXT in self.base.extensions:
+                token = self.base.extensions[INDEX_FSMONITOR_EXT]
+                self.fsmonitor_token = token.decode("utf-8")
+        elif self.legacy_path().exists():
+            # index.json from before the binary index, it gets converted on the next write
+            with open(self.legacy_path()) as f:
+                legacy = json.load(f)
+            self.changes = {
+                os.path.normpath(path): entry for path, entry in legacy.items()
             }
-            with open(self.index_path, "w") as f:
-                json.dump(self.entries, f, indent=2)
+            self.dirty = True
+
+    def legacy_path(self) -> Path:
+        return self.index_path.with_name("index.json")
+
+    def load_names(self):
+        # for callers about to look up most of the paths, see IndexFile.load_names
+        if self.base is not None:
+            self.base.load_names()
+
+    def __len__(self) -> int:
+        if not self.changes:
+            return len(self.base) if self.base is not None else 0
+        return sum(1 for _ in self.iter_entries())
+
+    def get_entry(self, file_path) -> dict | None:
+        if file_path in self.changes:
+            return self.changes[file_path]
+        if self.base is not None:
+            return self.base.lookup(file_path)
+        return None
+
+    def iter_entries(self) -> Iterator[Tuple[str, dict]]:
+        """
+        Yields every (path, entry) of the index sorted by path, with the staged updates merged in.
+        """
+        staged = sorted(self.changes.items())
+        i = 0
+        for path, entry in self.base if self.base is not None else ():
+            while i < len(staged) and staged[i][0] < path:
+                if staged[i][1] is not None:
+                    yield staged[i]
+                i += 1
+            if i < len(staged) and staged[i][0] == path:
+                if staged[i][1] is not None:
+                    yield staged[i]
+                i += 1
+                continue
+            yield path, entry
+
+        for path, entry in staged[i:]:
+            if entry is not None:
+                yield path, entry
+
+    def set_entry(self, file_path, entry: dict):
+        current = self.get_entry(file_path)
+        if (
+            current is None
+            or current["hash"] != entry["hash"]
+            or current["mode"] != entry["mode"]
+        ):
+            self.invalidate_tree(file_path)
+        self.changes[file_path] = entry
+        self.write_index()
+
+    def remove_entry(self, file_path):
+        self.invalidate_tree(file_path)
+        self.changes[file_path] = None
+        self.write_index()
+
+    def set_fsmonitor_token(self, token: str):
+        if token != self.fsmonitor_token:
+            self.fsmonitor_token = token
+            self.write_index()
+
+    def iter_under(self, path: str) -> Iterator[Tuple[str, dict]]:
+        # the entry of a path, or the entries below it if it is a directory
+        entry = self.get_entry(path)
+        if entry is not None:
+            yield path, entry
+            return
+        prefix = path + "/"
+        for entry_path, entry in self.iter_entries():
+            if entry_path.startswith(prefix):
+                yield entry_path, entry
+
+    def invalidate_tree(self, file_path):
+        # every directory above a changed path gets a new tree
+        directory = file_path
+        while directory:
+            directory = directory.rpartition("/")[0]
+            if directory in self.cache_tree:
+                self.cache_tree[directory] = (-1, None)
+
+    def cached_tree(self, directory: str) -> Tuple[int, str] | None:
+        """
+        :param directory: Directory path, "" for the root.
+        :return: (entry count, tree sha) from the cache-tree, or None if the tree has to be rebuilt.
+        """
+        count, sha = self.cache_tree.get(directory, (-1, None))
+        if count < 0 or sha is None or not self.store.has(sha):
+            return None
+        return count, sha
+
+    def update_cache_tree(self, directory: str, entry_count: int, sha: str):
+        if self.cache_tree.get(directory) != (entry_count, sha):
+            self.cache_tree[directory] = (entry_count, sha)
+            self.write_index()
+
+    def prune_cache_tree(self):
+        # after a full build every existing directory is valid, the invalid ones are gone from the tree
+        stale = [d for d, (count, _) in self.cache_tree.items() if count < 0]
+        for directory in stale:
+            del self.cache_tree[directory]
+        if stale:
+            self.write_index()
+
+    def parse_cache_tree(self, data: bytes, pos: int, parent: str | None) -> int:
+        """
+        Reads one node of git's TREE extension and its subtrees, in pre-order.
+
+        A node is "<name>\0<entry count> <subtree count>\n" followed by the binary
+        tree sha when the entry count isn't -1.
+
+        :return: Position right after the node and its subtrees.
+        """
+        nul = data.index(b"\0", pos)
+        name = data[pos:nul].decode("utf-8")
+        newline = data.index(b"\n", nul)
+        count, subtrees = (int(n) for n in data[nul + 1 : newline].split())
+        pos = newline + 1
+        directory = name if not parent else f"{parent}/{name}"
+
+        sha = None
+        if count >= 0:
+            sha = data[pos : pos + 20].hex()
+            pos += 20
+        self.cache_tree[directory] = (count, sha)
+
+        for _ in range(subtrees):
+            pos = self.parse_cache_tree(data, pos, directory)
+        return pos
+
+    def serialize_cache_tree(self) -> bytes:
+        children: Dict[str, List[str]] = {}
+        for directory in list(self.cache_tree):
+            # every ancestor has to be a node, even if its tree isn't known
+            while directory:
+                parent, _, name = directory.rpartition("/")
+                siblings = children.setdefault(parent, [])
+                if name in siblings:
+                    break
+                siblings.append(name)
+                directory = parent
+
+        out = bytearray()
+
+        def write_node(directory: str, name: str):
+            count, sha = self.cache_tree.get(directory, (-1, None))
+            subdirs = sorted(children.get(directory, []))
+            out.extend(f"{name}\0{count} {len(subdirs)}\n".encode("utf-8"))
+            if count >= 0 and sha is not None:
+                out.extend(bytes.fromhex(sha))
+            for subdir in subdirs:
+                write_node(f"{directory}/{subdir}" if directory else subdir, subdir)
+
+        write_node("", "")
+        return bytes(out)
+
+    def begin(self):
+        """
+        Starts an index transaction by taking the index lock.
+
+        Until commit() is called, every update only changes the in-memory entries.
+        The lock is an exclusively created "<index>.lock" file, like git's index.lock.
+        """
+        if self.lock_fd is not None:
+            raise RuntimeError("An index transaction is already open")
+
+        lock_path = self.lock_path()
+        try:
+            self.lock_fd = os.open(
+                lock_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644
+            )
+        except FileExistsError:
+            raise FileExistsError(
+                f"Unable to create '{lock_path}': another pygit process seems to be running"
+            )
+
+    def commit(self):
+        """
+        Flushes the buffered entries into the lock file and renames it over the index.
+        """
+        if self.lock_fd is None:
+            raise RuntimeError("No index transaction is open")
+
+        fd, self.lock_fd = self.lock_fd, None
+        if not self.dirty:
+            os.close(fd)
+            os.unlink(self.lock_path())
+            return
+
+        extensions = {}
+        if self.cache_tree:
+            extensions[INDEX_TREE_EXT] = self.serialize_cache_tree()
+        if self.fsmonitor_token is not None:
+            extensions[INDEX_FSMONITOR_EXT] = self.fsmonitor_token.encode("utf-8")
+        with os.fdopen(fd, "wb") as f:
+            f.write(self.serialize(extensions))
+            f.flush()
+            # racily clean staged entries, modified in the tick the index is written in,
+            # are smudged and the index written again, see smudge
+            if self.smudge(os.fstat(f.fileno()).st_mtime_ns):
+                f.seek(0)
+                f.truncate()
+                f.write(self.serialize(extensions))
+                f.flush()
+            os.fsync(f.fileno())
+        # the rename is atomic, so a crash leaves either the old or the new index, never a truncated one
+        os.replace(self.lock_path(), self.index_path)
+        self.dirty = False
+        self.load_index()
+        self.legacy_path().unlink(missing_ok=True)
+
+    def serialize(self, extensions: Dict[bytes, bytes]) -> bytearray:
+        if self.base is not None and len(self.changes) * INDEX_SPLICE_RATIO < len(
+            self.base
+        ):
+            # few staged entries in a big index are spliced into the bytes on disk
+            return self.base.splice(sorted(self.changes.items()), extensions)
+        return IndexFile.serialize(self.smudged_entries(), extensions)
+
+    def smudge(self, timestamp_ns: int) -> bool:
+        """
+        Sets the size of the staged entries that are racily clean for an index written
+        at timestamp_ns to 0, like git's ce_smudge_racily_clean_entry.
+
+        Once a later write moves the index timestamp forward, such an entry would pass
+        the stat check for good, even if its file changed in that same tick. With a size
+        of 0 it never matches the file, so it is rehashed until it is staged again. The
+        entries carried over from the index on disk were smudged when it was written.
+
+        :return: True if an entry was smudged.
+        """
+        racy = [
+            path
+            for path, entry in self.changes.items()
+            if entry is not None
+            and entry["size"]
+            and entry.get("mtime_ns", 0) >= timestamp_ns
+        ]
+        for path in racy:
+            self.changes[path] = {**self.changes[path], "size": 0}
+        return bool(racy)
+
+    def smudged_entries(self) -> Iterator[Tuple[str, dict]]:
+        # a full rewrite also smudges the racy entries of an index written before smudging
+        for path, entry in self.iter_entries():
+            if (
+                path not in self.changes
+                and entry.get("mtime_ns", 0) >= self.timestamp_ns
+                and entry["size"]
+            ):
+                entry = {**entry, "size": 0}
+            yield path, entry
+
+    def rollback(self):
+        """
+        Drops the lock file, the index on disk stays untouched.
+        """
+        if self.lock_fd is None:
+            return
+        os.close(self.lock_fd)
+        self.lock_fd = None
+        os.unlink(self.lock_path())
+        self.dirty = False
+        self.load_index()
+
+    @contextmanager
+    def transaction(self):
+        self.begin()
+        try:
+            yield self
+        except BaseException:
+            self.rollback()
+            raise
+        with tracing.span("index-flush", changes=len(self.changes)):
+            self.commit()
+
+    def lock_path(self) -> Path:
+        return self.index_path.with_name(self.index_path.name + ".lock")
+
+    def write_index(self):
+        if self.lock_fd is not None:
+            self.dirty = True
+            return
+        # outside of a transaction every update is flushed right away
+        with self.transaction():
+            self.dirty = True
+
+    def is_stat_clean(
+        self, file_path, st: os.stat_result, entry: dict | None = None
+    ) -> bool:
+        """
+        Checks the cached stat data of an index entry against a fresh stat of the file.
+
+        :param file_path: Path of the file, as it is stored in the index.
+        :param st: Result of os.stat on the file.
+        :param entry: Index entry of the file, if the caller already looked it up.
+        :return: True if the file can't have changed since it was staged.
+        """
+        if entry is None:
+            if file_path not in self.changes and self.base is not None:
+                # entry on disk, compared without decoding it. If it matches its mtime is the
+                # file's, so the racy check below comes down to the same comparison
+                if st.st_mtime_ns >= self.timestamp_ns:
+                    return False
+                stat_data = IndexFile.stat_data(st, self.file_mode(file_path, st))
+                return self.base.stat_matches(file_path, stat_data) is True
+            entry = self.get_entry(file_path)
+        # entries written before the stat cache existed have no ns timestamps
+        if entry is None or "mtime_ns" not in entry:
+            return False
 
-    def delete_index_content(self):
+        if (
+            entry["mtime_ns"] != st.st_mtime_ns
+            or entry["ctime_ns"] != st.st_ctime_ns
+            or entry["ino"] != st.st_ino & UINT32_MASK
+            or entry["size"] != st.st_size & UINT32_MASK
+            or entry["mode"] != self.file_mode(file_path, st)
+        ):
+            return False
+
+        # racily clean: the file was touched in the same tick the index was written,
+        # so a later change of the same size would keep the same mtime. Rehash it.
+        if entry["mtime_ns"] >= self.timestamp_ns:
+            return False
+
+        return True
+
+    def write_index_content(self, file_path, hash, st: os.stat_result | None = None):
+
+        if self.store.has(hash):
+            if st is None:
+                st = os.lstat(file_path)
+            mode = self.file_mode(file_path, st)
+            # ino and size are kept to 32 bits, as in the binary index
+            self.set_entry(
+                file_path,
+                {
+                    "hash": hash,
+                    "mode": mode,
+                    "mtime": st.st_mtime,
+                    "size": st.st_size & UINT32_MASK,
+                    "mtime_ns": st.st_mtime_ns,
+                    "ctime_ns": st.st_ctime_ns,
+                    "ino": st.st_ino & UINT32_MASK,
+                },
+            )
+
+    def delete_index_content(self, paths: Iterable[str] | None = None):
         # for files listed in index but not exists anymore in working directory
-        #  NOTE: I have to write the code to remove the blob files also, other wise the db will be bloated with the code of the files that already got deleted
-        index_keys = self.entries.keys()
+        # paths narrows the check down to the given index paths, all of them by default
+        # the blobs stay, commits may still point to them, gc --prune drops the ones nothing reaches
         keys_to_remove = []
-        for index_file_path in index_keys:
-            if not os.path.exists(index_file_path):
-                try:
-                    hash: str = self.entries[index_file_path]["hash"]
-                    complete_blob_path = self.obj_dir / hash[:2] / hash[2:]
-                    #  FIX: file is not delted, may be becoz, the path is relative
-                    #  here it is right according to os.path.exists, but it shows in the yazi, i have tried unlink, but it still creating it. That has 2 options- 1. It is not getting deleted , 2. The blob is getting created again
-                    print(
-                        f"\n Currently {index_file_path} exists at:{os.path.exists(complete_blob_path)} "
+        if paths is None:
+            candidates = self.iter_entries()
+        else:
+            candidates = [(path, self.get_entry(path)) for path in list(paths)]
+        for index_file_path, entry in candidates:
+            if entry is not None and not os.path.lexists(index_file_path):
+                keys_to_remove.append(index_file_path)
+
+        for item in keys_to_remove:
+            self.remove_entry(item)
+        tracing.count("entries_removed", len(keys_to_remove))
+
+    def file_mode(self, file_path, st: os.stat_result | None = None):
+        if st is None:
+            st = os.lstat(file_path)
+        if stat.S_ISLNK(st.st_mode):
+            return "120000"
+        # git only keeps the executable bit, any other permission change would alter the tree hashes
+        if st.st_mode & 0o111:
+            return "100755"
+        return "100644"
+
+
+class ObjectStore:
+    """
+    Object storage under .pygit/objects, loose or packed, with a cheap existence check.
+
+    Every write first checks whether the object is already there, so unchanged
+    content costs no compression and no write. Presence is kept as a set of names per
+    fan-out directory, loaded on the first query for that prefix. The sets are also
+    persisted in objects/info/presence.json together with each directory's mtime,
+    so a new process only lists the fan-out directories that changed since.
+    Objects in objects/pack/ are found through the pack indexes, transparently.
+
+    In a partial clone, an object that isn't there is fetched from the promisor
+    remote when it is read. Callers that know which objects they are about to read
+    fetch them all at once with fetch_missing.
+
+    Callers that write a lot of small objects at once, like the trees of a commit,
+    do it inside bulk, which streams them into a single pack.
+    """
+
+    def __init__(self, obj_dir: Path) -> None:
+        self.obj_dir = obj_dir
+        self.presence_path = obj_dir / "info" / "presence.json"
+        # prefix -> names of the loose objects in objects/<prefix>/
+        self.fanout: Dict[str, set] = {}
+        # persisted sets, loaded on the first fan-out lookup
+        self.presence: Dict[str, list] | None = None
+        self.presence_dirty = False
+        self.pack_dir = obj_dir / "pack"
+        self.packs: List[Pack] | None = None
+        self.lock = threading.Lock()
+        # the remote of a partial clone, looked up on the first missing object
+        self.promisor: Promisor | None = None
+        self.promisor_loaded = False
+        self.fetch_lock = threading.Lock()
+        # objects written inside bulk: held back while they are few, then in a pack
+        self.bulking = False
+        self.bulk_loose: Dict[str, bytes] = {}
+        self.bulk_pack: PackWriter | None = None
+        self.bulk_names: set = set()
+
+    def load_packs(self) -> List[Pack]:
+        if self.packs is None:
+            with self.lock:
+                if self.packs is None:
+                    self.packs = (
+                        [Pack(idx) for idx in sorted(self.pack_dir.glob("pack-*.idx"))]
+                        if self.pack_dir.exists()
+                        else []
                     )
+        return self.packs
 
-                    if complete_blob_path.exists():
-                        complete_blob_path.unlink(missing_ok=True)
-                    blob_dir = self.obj_dir / hash[:2]
-                    if blob_dir.exists():
-                        blob_dir.rmdir()
+    def close_packs(self):
+        for pack in self.packs or []:
+            pack.close()
+        self.packs = None
+
+    def add_pack(self, idx_path: Path):
+        packs = self.load_packs()
+        # a new list, readers going through the old one aren't disturbed
+        with self.lock:
+            self.packs = packs + [Pack(idx_path)]
+
+    def load_promisor(self) -> "Promisor | None":
+        if not self.promisor_loaded:
+            self.promisor = Promisor.of(self.obj_dir.parent)
+            self.promisor_loaded = True
+        return self.promisor
+
+    def fetch_missing(self, hashes: Iterable[str]) -> int:
+        """
+        Fetches the objects a partial clone left out, in a single request to its promisor remote.
 
-                    print(
-                        f"\n Currently {index_file_path} shouldn't exist and it should show false : {os.path.exists(complete_blob_path)} "
+        :return: Number of objects fetched, 0 without a promisor remote or if none is missing.
+        """
+        if self.load_promisor() is None:
+            return 0
+        missing = {hash for hash in hashes if not self.has(hash)}
+        if not missing:
+            return 0
+        with self.fetch_lock:
+            # another thread may have fetched some of them meanwhile
+            missing = sorted(hash for hash in missing if not self.has(hash))
+            if missing:
+                self.add_pack(self.promisor.fetch(self.pack_dir, missing))
+                lacking = [hash for hash in missing if not self.has(hash)]
+                if lacking:
+                    raise ValueError(
+                        f"The promisor remote {self.promisor.name} didn't send {lacking[0]}"
                     )
-                    # it may leave an empyt folder behind
-                    keys_to_remove.append(index_file_path)
-                except Exception as e:
-                    print(f"Here the error is: {e}")
-                    raise e
+        return len(missing)
 
-        for item in keys_to_remove:
-            self.entries.pop(item)
+    def load_presence(self) -> Dict[str, list]:
+        if self.presence is None:
+            self.presence = {}
+            if self.presence_path.exists():
+                with open(self.presence_path) as f:
+                    saved = json.load(f)
+                # a directory changed in the same tick the cache was written may have missed names
+                written_ns = saved.get("written_ns", 0)
+                self.presence = {
+                    prefix: value
+                    for prefix, value in saved.get("fanout", {}).items()
+                    if value[0] < written_ns
+                }
+        return self.presence
 
-        with open(self.index_path, "w") as f:
-            json.dump(self.entries, f, indent=2)
+    def names(self, prefix: str) -> set:
+        names = self.fanout.get(prefix)
+        if names is not None:
+            return names
 
-    def file_mode(self, file_path):
-        mode = stat.S_IMODE(os.stat(file_path).st_mode)
-        mode_str = oct(mode)[2:]
-        return f"100{mode_str}"
+        with self.lock:
+            if prefix in self.fanout:
+                return self.fanout[prefix]
+            fan_dir = self.obj_dir / prefix
+            try:
+                mtime_ns = os.stat(fan_dir).st_mtime_ns
+            except FileNotFoundError:
+                names = set()
+            else:
+                cached = self.load_presence().get(prefix)
+                if cached is not None and cached[0] == mtime_ns:
+                    names = set(cached[1])
+                else:
+                    names = set(os.listdir(fan_dir))
+                    self.presence[prefix] = [mtime_ns, sorted(names)]
+                    self.presence_dirty = True
+            self.fanout[prefix] = names
+        return names
 
+    def has(self, hash: str) -> bool:
+        if hash[2:] in self.names(hash[:2]) or hash in self.bulk_names:
+            return True
+        return any(hash in pack for pack in self.load_packs())
 
-class Commit:
-    def __init__(self, pygit: Path):
-        self.index_path = pygit / "index.json"
-        self.obj_dir = pygit / "objects"
-        self.index = Index(index_path=self.index_path, obj_dir=self.obj_dir)
-        self.list_of_tuples: List[Tuple[str, str, str]] = [
-            (item, self.index.entries[item]["hash"], self.index.entries[item]["mode"])
-            for item in self.index.entries
-        ]
-        pass
+    def read(self, hash: str) -> Tuple[str, bytes]:
+        """
+        Reads an object, from its loose file or from a pack.
 
-    def create_tree_from_index(self, repo_root: str = ".") -> str:
+        :return: (type, content) of the object, without the header.
         """
-        Loads index.json and creates the root tree object.
+        if hash in self.bulk_names:
+            self.flush_bulk()
+        if hash[2:] in self.names(hash[:2]):
+            return self.read_loose(hash)
+        for pack in self.load_packs():
+            obj = pack.read(hash)
+            if obj is not None:
+                return obj
+        if self.fetch_missing([hash]):
+            return self.read(hash)
+        raise FileNotFoundError(f"Object {hash} not found")
 
-        :return: Hex SHA-1 of the root tree.
+    def read_loose(self, hash: str) -> Tuple[str, bytes]:
+        with open(self.obj_dir / hash[:2] / hash[2:], "rb") as f:
+            full_content = zlib.decompress(f.read())
+        header, _, content = full_content.partition(b"\0")
+        obj_type, size = self.parse_header(hash, header)
+        if size != len(content):
+            raise ValueError(
+                f"Object {hash} is corrupt, its size doesn't match the header"
+            )
+        return obj_type, content
+
+    def read_header(self, hash: str) -> Tuple[str, int]:
         """
-        root_tree_sha = self.build_tree(
-            repo_root=repo_root, prefix="", entries=self.list_of_tuples
-        )
-        return root_tree_sha
-        pass
+        :return: (type, size) of an object, without reading all of it.
+        """
+        if hash in self.bulk_names:
+            self.flush_bulk()
+        if hash[2:] in self.names(hash[:2]):
+            return self.read_loose_header(hash)
+        for pack in self.load_packs():
+            header = pack.read_header(hash)
+            if header is not None:
+                return header
+        if self.fetch_missing([hash]):
+            return self.read_header(hash)
+        raise FileNotFoundError(f"Object {hash} not found")
 
-    def write_tree_objects(self, content: bytes, hash: str, repo_root: str = "."):
-        obj_dir = Path(".") / ".pygit" / "objects" / hash[:2]
-        obj_dir.mkdir(exist_ok=True, parents=True)
-        obj_file_path = obj_dir / hash[2:]
-        compressed_file = zlib.compress(content)
-        with open(obj_file_path, "wb") as f:
-            f.write(compressed_file)
+    def read_loose_header(self, hash: str) -> Tuple[str, int]:
+        # only inflates the first bytes of the object
+        with open(self.obj_dir / hash[:2] / hash[2:], "rb") as f:
+            start = zlib.decompressobj().decompress(f.read(256), 64)
+        return self.parse_header(hash, start.partition(b"\0")[0])
 
-    def build_tree(
-        self,
-        entries: List[Tuple[str, str, str]],
-        repo_root: str = ".",
-        prefix: str = "",
-    ) -> str:
+    def parse_header(self, hash: str, header: bytes) -> Tuple[str, int]:
+        obj_type, _, size = header.partition(b" ")
+        if (
+            obj_type.decode("utf-8", "replace") not in OBJ_TYPE_NUMBERS
+            or not size.isdigit()
+        ):
+            raise ValueError(f"Object {hash} has no valid header")
+        return obj_type.decode("utf-8"), int(size)
+
+    def iter_loose(self) -> Iterator[str]:
         """
-        Builds a Git tree object recursively.
+        Yields the hash of every loose object.
+        """
+        if not self.obj_dir.exists():
+            return
+        for prefix in sorted(os.listdir(self.obj_dir)):
+            if len(prefix) != 2 or not all(c in "0123456789abcdef" for c in prefix):
+                continue
+            for name in sorted(self.names(prefix)):
+                yield prefix + name
+
+    def add_name(self, hash: str):
+        names = self.names(hash[:2])
+        with self.lock:
+            names.add(hash[2:])
+            # the directory mtime changed, the persisted set has to be rebuilt
+            if self.load_presence().pop(hash[:2], None) is not None:
+                self.presence_dirty = True
 
-        :param entries: List of (full_path, mode, sha) for all staged files under this prefix.
-        :param prefix: Current directory prefix (e.g., 'doc/' for recursion).
-        :return: Hex SHA-1 of the created tree object.
+    def save(self):
         """
+        Persists the presence sets, so the next process can skip listing unchanged directories.
+        """
+        if not self.presence_dirty:
+            return
+        self.presence_path.parent.mkdir(exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(
+            dir=self.presence_path.parent, prefix="tmp_presence_"
+        )
+        with os.fdopen(fd, "w") as f:
+            json.dump({"written_ns": time.time_ns(), "fanout": self.presence}, f)
+        os.replace(tmp_path, self.presence_path)
+        self.presence_dirty = False
 
-        # we will store the tree information in a tree object, which is a text like file with
-        # it's own sha-1 hash for unique identification and is stored as a compressed zlib file
-        # in objects dir
-        if not entries:
-            raise ValueError("No entries to build tree from")
+    @tracing.timed("object-write")
+    def store(self, hash: str, chunks: Iterable[bytes]):
+        """
+        Compresses chunks of an object into a temp file and renames it into objects/xx/.
+        """
+        compressor = zlib.compressobj()
+        fd, tmp_path = tempfile.mkstemp(dir=self.obj_dir, prefix="tmp_obj_")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                for chunk in chunks:
+                    out.write(deflate(compressor, chunk))
+                out.write(deflate(compressor))
+            obj_dir = self.obj_dir / hash[:2]
+            obj_dir.mkdir(exist_ok=True)
+            try:
+                os.replace(tmp_path, obj_dir / hash[2:])
+            except FileNotFoundError:
+                # a gc --prune removed the emptied directory in between
+                obj_dir.mkdir(exist_ok=True)
+                os.replace(tmp_path, obj_dir / hash[2:])
+        except BaseException:
+            Path(tmp_path).unlink(missing_ok=True)
+            raise
+        self.add_name(hash)
+        tracing.count("objects_written")
+
+    @contextmanager
+    def bulk(self):
+        """
+        Collects the new objects written by write_object and write_raw into one pack.
 
-        subdirs: Dict[str, List[Tuple[str, str, str]]] = {}
-        files: List[Tuple[str, str, str]] = []
+        A loose object costs a temp file, a rename and a directory entry, which adds
+        up to most of the time of a cold commit of a large tree. In a pack, the same
+        objects are one file. A bulk write of fewer than BULK_PACK_MIN new objects is
+        still written loose at the end, so small commits don't leave tiny packs behind.
+        The objects count as present as soon as they are written, reading one finishes
+        the pending pack first. Nested blocks join the outer one.
+        """
+        if self.bulking:
+            yield
+            return
+        self.bulking = True
+        try:
+            yield
+            self.flush_bulk()
+        finally:
+            if self.bulk_pack is not None:
+                self.bulk_pack.abort()
+            self.bulking = False
+            self.bulk_loose = {}
+            self.bulk_pack = None
+            self.bulk_names = set()
 
-        for full_path, hash, mode in entries:
-            # Remove './' prefix and current prefix for relative path
-            rel_path = full_path.lstrip("./")
-            if prefix:
-                if not rel_path.startswith(prefix):
-                    continue  # Skip entries not under this prefix
-                rel_path = rel_path[len(prefix) :].lstrip("/")
+    def add_bulk(self, hash: str, full_content: bytes):
+        with self.lock:
+            if hash in self.bulk_names:
+                return
+            self.bulk_names.add(hash)
+            if self.bulk_pack is None:
+                self.bulk_loose[hash] = full_content
+                if len(self.bulk_loose) < BULK_PACK_MIN:
+                    return
+                self.bulk_pack = PackWriter(self.pack_dir)
+                pending, self.bulk_loose = self.bulk_loose, {}
             else:
-                rel_path = rel_path.lstrip("/")
+                pending = {hash: full_content}
+            for name, content in pending.items():
+                header, _, body = content.partition(b"\0")
+                self.bulk_pack.add(name, header.split(b" ", 1)[0].decode("utf-8"), body)
+        tracing.count("objects_packed", len(pending))
 
-            parts = rel_path.split("/", 1)
-            name = parts[0]
+    def flush_bulk(self):
+        """
+        Writes out the objects held back by bulk: the pending pack, or loose objects if they are few.
+        """
+        with self.lock:
+            writer, self.bulk_pack = self.bulk_pack, None
+            loose, self.bulk_loose = self.bulk_loose, {}
+            names = set(self.bulk_names)
+        if writer is not None:
+            self.add_pack(writer.finish())
+        for hash, full_content in loose.items():
+            self.store(hash, [full_content])
+        # they are only dropped from the pending names once they can be read
+        with self.lock:
+            self.bulk_names -= names
 
-            if len(parts) == 1:
-                # It's a file in this dir
-                files.append((name, hash, mode))
-            else:
-                # It's in a subdir
-                subdir_name = name
-                if subdir_name not in subdirs:
-                    subdirs[subdir_name] = []
-                subdirs[subdir_name].append((full_path, hash, mode))
-
-        # now building the tree structure
-        subtree_entries: List[Tuple[str, str, str]] = []
-        for subdir_name, subdir_val in subdirs.items():
-            sub_prefix = f"{prefix}{subdir_name}/"
-            subtree_sha = self.build_tree(
-                entries=subdir_val, prefix=sub_prefix, repo_root=repo_root
-            )
-            subtree_entries.append((subdir_name, subtree_sha, "040000"))
+    def freshen(self, hash: str):
+        # a reused loose object gets a new mtime, or a gc --prune running meanwhile
+        # could drop it as old and unreachable, like git's freshen_loose_object
+        try:
+            os.utime(self.obj_dir / hash[:2] / hash[2:])
+        except FileNotFoundError:
+            # packed, packs aren't pruned
+            pass
 
-        all_entries = files + subtree_entries
-        all_entries.sort(key=lambda e: e[0])  # Sort alphabetically by name
+    def write_object(self, obj_type: str, content: bytes) -> str:
+        """
+        Stores an in-memory object, unless it already exists.
 
-        # Serialize to Git tree format
-        tree_content = b""
-        for name, mode, sha in all_entries:
-            entry = f"{mode} {name}\0".encode("utf-8") + bytes.fromhex(sha)
-            tree_content += entry
+        :return: Hex SHA-1 of the object.
+        """
+        full_content = f"{obj_type} {len(content)}\0".encode("utf-8") + content
+        hash = hashlib.sha1(full_content).hexdigest()
+        self.write_raw(hash, full_content)
+        return hash
 
-        # Add header
-        header = f"tree {len(tree_content)}\0".encode("utf-8")
-        full_content = header + tree_content
+    def write_raw(self, hash: str, full_content: bytes):
+        """
+        Stores an object whose header is already in place and whose hash is already known.
+        """
+        if self.has(hash):
+            self.freshen(hash)
+            tracing.count("objects_skipped")
+        elif self.bulking:
+            self.add_bulk(hash, full_content)
+        else:
+            self.store(hash, [full_content])
 
-        # Compute SHA-1
-        tree_sha = hashlib.sha1(full_content).hexdigest()
+    def write_file(self, file_path, size: int) -> str:
+        """
+        Writes a file as a blob object, reading it in fixed-size chunks.
 
-        # Store the object
-        self.write_tree_objects(
-            hash=tree_sha, content=full_content, repo_root=repo_root
-        )
+        The file is hashed before anything gets compressed, so a blob that is already
+        stored costs one read and nothing else. A small file is read once and kept in
+        memory, a larger one is streamed through an incremental sha-1 and read again
+        through a zlib stream only if the blob is missing. Memory use doesn't depend on
+        the file size, and the file is read as bytes, so binary files work too.
 
-        print(f"Tree hash is calculated for : {subtree_entries}")
+        :param file_path: File to store.
+        :param size: Size of the file in bytes, from the stat of the walk.
+        :return: Hex SHA-1 of the blob.
+        """
+        hash, header, content = self.hash_file(file_path, size)
+        if self.has(hash):
+            self.freshen(hash)
+            tracing.count("objects_skipped")
+            return hash
 
-        return tree_sha
+        if content is not None:
+            self.store(hash, [header, content])
+        else:
+            self.store(hash, self.read_chunks(file_path, header, hash))
+        return hash
 
-        pass
+    @tracing.timed("hash")
+    def hash_file(self, file_path, size: int) -> Tuple[str, bytes, bytes | None]:
+        """
+        :return: (hex SHA-1 of the file as a blob, blob header, content of a file
+            small enough to be kept in memory, None for a larger one).
+        """
+        header = f"blob {size}\0".encode("utf-8")
+        sha = hashlib.sha1(header)
+        with open(file_path, "rb") as f:
+            content = f.read(BLOB_CHUNK_SIZE)
+            read = len(content)
+            sha.update(content)
+            if read == BLOB_CHUNK_SIZE:
+                content = None
+                while chunk := f.read(BLOB_CHUNK_SIZE):
+                    read += len(chunk)
+                    sha.update(chunk)
 
-        pass
+        if read != size:
+            raise ValueError(f"{file_path} changed while it was being added")
+        tracing.count("bytes_hashed", read)
+        return sha.hexdigest(), header, content
 
-    def commit(self, message: str):
-        root_tree_hash = self.create_tree_from_index()
-        time = datetime.now()
-        final_data = f"\n{root_tree_hash},time:{time},message:{message}"
-        git_dir = Path(".") / ".pygit"
-        commit_file_path = git_dir / "commit.txt"
-        with open(commit_file_path, "w") as f:
-            f.write(final_data)
+    def read_chunks(self, file_path, header: bytes, hash: str) -> Iterator[bytes]:
+        # second read of a large file, hashed again so a file changed in between isn't stored under the old hash
+        sha = hashlib.sha1(header)
+        yield header
+        with open(file_path, "rb") as f:
+            while chunk := f.read(BLOB_CHUNK_SIZE):
+                sha.update(chunk)
+                yield chunk
+        if sha.hexdigest() != hash:
+            raise ValueError(f"{file_path} changed while it was being added")
 
-        # where to save the hash data
 
+@tracing.timed("compress")
+def deflate(compressor, chunk: bytes | None = None) -> bytes:
+    # one more chunk through the zlib stream, or its end without a chunk
+    if chunk is None:
+        return compressor.flush()
+    return compressor.compress(chunk)
 
-class Push:
+
+def parse_tree(content: bytes) -> List[Tuple[str, str, str]]:
     """
-    we have to facilitate to add the functionalities to execute the below functions
+    Parses the content of a tree object.
 
-    git remote add origin git@github.com:Ashutsoh1729/test-git.git
-    git branch -M main
-    git push -u origin main
+    :return: (mode, name, sha) of every entry, in the stored order.
+    """
+    entries: List[Tuple[str, str, str]] = []
+    pos = 0
+    while pos < len(content):
+        space = content.index(b" ", pos)
+        nul = content.index(b"\0", space)
+        mode = content[pos:space].decode("ascii")
+        name = content[space + 1 : nul].decode("utf-8")
+        entries.append((mode, name, content[nul + 1 : nul + 21].hex()))
+        pos = nul + 21
+    return entries
 
-    it will first check the following things:
-        1. remote repo info exists or not
 
+def parse_commit(content: bytes) -> dict:
     """
+    Parses the content of a commit object.
 
-    def __init__(self) -> None:
-        pass
+    :return: dict with the tree, the parents, author, committer and the message.
+    """
+    headers, _, message = content.partition(b"\n\n")
+    commit = {"tree": None, "parents": [], "author": "", "committer": "", "message": ""}
+    for line in headers.decode("utf-8").split("\n"):
+        key, _, value = line.partition(" ")
+        if key == "parent":
+            commit["parents"].append(value)
+        elif key in ("tree", "author", "committer"):
+            commit[key] = value
+    commit["message"] = message.decode("utf-8")
+    return commit
 
-    def push(self):
-        pass
 
+class ObjectDatabase:
+    """
+    Read side of the object store, for blobs, trees and commits.
 
-class remote:
-    def __init__(self):
-        pass
+    Inflated objects are kept in an LRU cache bounded by their total size in bytes,
+    so repeated reads of the same trees and blobs don't inflate them again.
+    """
+
+    def __init__(
+        self,
+        obj_dir: Path,
+        store: ObjectStore | None = None,
+        cache_bytes: int = OBJECT_CACHE_BYTES,
+    ) -> None:
+        self.store = store or ObjectStore(obj_dir)
+        self.cache_bytes = cache_bytes
+        self.cache: OrderedDict[str, Tuple[str, bytes]] = OrderedDict()
+        self.cached_bytes = 0
+        self.lock = threading.Lock()
+
+    def exists(self, hash: str) -> bool:
+        return hash in self.cache or self.store.has(hash)
+
+    def read(self, hash: str) -> Tuple[str, bytes]:
+        """
+        :return: (type, content) of the object.
+        """
+        with self.lock:
+            obj = self.cache.get(hash)
+            if obj is not None:
+                self.cache.move_to_end(hash)
+                return obj
+
+        obj = self.store.read(hash)
+        # a single object bigger than the whole cache would only evict everything else
+        if len(obj[1]) <= self.cache_bytes:
+            with self.lock:
+                if hash not in self.cache:
+                    self.cache[hash] = obj
+                    self.cached_bytes += len(obj[1])
+                while self.cached_bytes > self.cache_bytes:
+                    _, (_, evicted) = self.cache.popitem(last=False)
+                    self.cached_bytes -= len(evicted)
+        return obj
+
+    def read_header(self, hash: str) -> Tuple[str, int]:
+        obj = self.cache.get(hash)
+        if obj is not None:
+            return obj[0], len(obj[1])
+        return self.store.read_header(hash)
+
+    def read_typed(self, hash: str, expected: str) -> bytes:
+        obj_type, content = self.read(hash)
+        if obj_type != expected:
+            raise ValueError(f"Object {hash} is a {obj_type}, not a {expected}")
+        return content
+
+    def read_blob(self, hash: str) -> bytes:
+        return self.read_typed(hash, "blob")
+
+    def read_tree(self, hash: str) -> List[Tuple[str, str, str]]:
+        return parse_tree(self.read_typed(hash, "tree"))
+
+    def read_commit(self, hash: str) -> dict:
+        return parse_commit(self.read_typed(hash, "commit"))
+
+
+class History:
+    """
+    Walks the commit history.
+
+    Parents, root trees, generation numbers and commit times come from the
+    commit-graph file, commits made since it was written are inflated from the
+    object database instead. Generation numbers bound the ancestry checks: a commit
+    can't be an ancestor of one with a lower or equal generation, so those parts of
+    the history are never visited.
+    """
+
+    def __init__(self, pygit: Path, db: ObjectDatabase | None = None) -> None:
+        self.pygit = pygit
+        self.db = db or ObjectDatabase(pygit / "objects")
+        self.graph_path = pygit / "objects" / "info" / "commit-graph"
+        self.graph: CommitGraph | None = None
+        if self.graph_path.exists():
+            self.graph = CommitGraph(self.graph_path)
+        # sha -> (tree, parents, generation, commit time) of the commits outside the graph
+        self.extra: Dict[str, Tuple[str, List[str], int, int]] = {}
+
+    def info(self, sha: str) -> Tuple[str, List[str], int, int]:
+        """
+        :return: (root tree, parent shas, generation, commit time) of a commit.
+        """
+        if self.graph is not None:
+            pos = self.graph.position(sha)
+            if pos is not None:
+                tree, parents, generation, commit_time = self.graph.commit_at(pos)
+                return (
+                    tree,
+                    [self.graph.sha_at(p) for p in parents],
+                    generation,
+                    commit_time,
+                )
+        if sha not in self.extra:
+            self.load_extra(sha)
+        return self.extra[sha]
+
+    def load_extra(self, start: str):
+        # inflates the commits down to where the graph takes over, the generation needs all parents
+        pending: Dict[str, Tuple[str, List[str], int]] = {}
+        stack = [start]
+        while stack:
+            sha = stack[-1]
+            if sha not in pending:
+                commit = self.db.read_commit(sha)
+                pending[sha] = (
+                    commit["tree"],
+                    commit["parents"],
+                    commit_time(commit["committer"]),
+                )
+            missing = [
+                parent
+                for parent in pending[sha][1]
+                if parent not in self.extra
+                and not (self.graph is not None and parent in self.graph)
+            ]
+            if missing:
+                stack.extend(missing)
+                continue
+            stack.pop()
+            tree, parents, time_s = pending[sha]
+            generation = 1 + max(
+                (self.info(parent)[2] for parent in parents), default=0
+            )
+            self.extra[sha] = (tree, parents, generation, time_s)
+
+    def tree(self, sha: str) -> str:
+        return self.info(sha)[0]
+
+    def parents(self, sha: str) -> List[str]:
+        return self.info(sha)[1]
+
+    def generation(self, sha: str) -> int:
+        return self.info(sha)[2]
+
+    def walk(self, starts: Iterable[str]) -> Iterator[str]:
+        """
+        :return: Every commit reachable from the starts, newest commit time first, like git log.
+        """
+        heap = []
+        seen = set()
+        for sha in starts:
+            if sha not in seen:
+                seen.add(sha)
+                heapq.heappush(heap, (-self.info(sha)[3], sha))
+        while heap:
+            _, sha = heapq.heappop(heap)
+            yield sha
+            for parent in self.parents(sha):
+                if parent not in seen:
+                    seen.add(parent)
+                    heapq.heappush(heap, (-self.info(parent)[3], parent))
+
+    def is_ancestor(self, ancestor: str, descendant: str) -> bool:
+        """
+        :return: True if ancestor is reachable from descendant, a commit counts as its own ancestor.
+        """
+        floor = self.generation(ancestor)
+        stack = [descendant]
+        seen = {descendant}
+        while stack:
+            sha = stack.pop()
+            if sha == ancestor:
+                return True
+            for parent in self.parents(sha):
+                # a parent at or below the ancestor's generation can only be the ancestor itself
+                if parent not in seen and (
+                    parent == ancestor or self.generation(parent) > floor
+                ):
+                    seen.add(parent)
+                    stack.append(parent)
+        return False
+
+    def merge_bases(self, one: str, two: str) -> List[str]:
+        """
+        Best common ancestors of two commits, like git merge-base --all.
+
+        Both sides are painted down, highest generation first, until every commit
+        left to visit is below a common ancestor already found.
+        """
+        if one == two:
+            return [one]
+        ONE, TWO, STALE = 1, 2, 4
+        flags = {one: ONE, two: TWO}
+        heap = [(-self.generation(one), one), (-self.generation(two), two)]
+        heapq.heapify(heap)
+        found: List[str] = []
+        while any(not flags[sha] & STALE for _, sha in heap):
+            _, sha = heapq.heappop(heap)
+            current = flags[sha]
+            if current & (ONE | TWO) == ONE | TWO and not current & STALE:
+                found.append(sha)
+                current |= STALE
+                flags[sha] = current
+            for parent in self.parents(sha):
+                if flags.get(parent, 0) & current == current:
+                    continue
+                flags[parent] = flags.get(parent, 0) | current
+                heapq.heappush(heap, (-self.generation(parent), parent))
+
+        # with criss-cross merges a common ancestor can be an ancestor of another one
+        return [
+            sha
+            for sha in found
+            if not any(other != sha and self.is_ancestor(sha, other) for other in found)
+        ]
+
+    def write_graph(self, refs: "Refs") -> int:
+        """
+        Writes a new commit-graph with every commit reachable from the refs and HEAD.
+
+        :return: Number of commits in it.
+        """
+        starts = [sha for _, sha in refs.iter_refs()]
+        head = refs.resolve("HEAD")
+        if head is not None:
+            starts.append(head)
+        commits = {}
+        for sha in self.walk(starts):
+            tree, parents, _, time_s = self.info(sha)
+            commits[sha] = (tree, parents, time_s)
+
+        if self.graph is not None:
+            self.graph.close()
+            self.graph = None
+        count = write_commit_graph(self.graph_path, commits)
+        self.graph = CommitGraph(self.graph_path)
+        self.extra = {}
+        return count
+
+
+def commit_time(signature: str) -> int:
+    # "Name <email> <unix time> <utc offset>"
+    parts = signature.rsplit(" ", 2)
+    try:
+        return int(parts[-2])
+    except (IndexError, ValueError):
+        return 0
+
+
+class Log:
+    """
+    Prints the history from a commit, newest first.
+    """
+
+    def __init__(self, pygit: Path) -> None:
+        self.refs = Refs(pygit)
+        self.db = ObjectDatabase(pygit / "objects")
+        self.history = History(pygit, db=self.db)
+
+    def show(self, rev: str = "HEAD", count: int | None = None, oneline: bool = False):
+        start = self.refs.resolve(rev)
+        if start is None:
+            print(f"{rev} has no commits yet")
+            return
+        # only the printed commits are inflated, the walk itself reads the commit-graph
+        for shown, sha in enumerate(self.history.walk([start])):
+            if count is not None and shown >= count:
+                break
+            commit = self.db.read_commit(sha)
+            if oneline:
+                title = commit["message"].split("\n", 1)[0]
+                print(f"{sha[:7]} {title}")
+                continue
+            print(f"commit {sha}")
+            if len(commit["parents"]) > 1:
+                print("Merge: " + " ".join(p[:7] for p in commit["parents"]))
+            name, _, rest = commit["author"].partition(" <")
+            email, _, date = rest.partition("> ")
+            print(f"Author: {name} <{email}>")
+            print(f"Date:   {format_date(date)}")
+            print()
+            for line in commit["message"].rstrip("\n").split("\n"):
+                print(f"    {line}")
+            print()
+
+
+def format_date(date: str) -> str:
+    # "<unix time> <utc offset>" in git's default log format
+    try:
+        seconds, offset = date.split(" ")
+        sign = -1 if offset.startswith("-") else 1
+        delta = sign * (int(offset[1:3]) * 3600 + int(offset[3:5]) * 60)
+        moment = datetime.fromtimestamp(
+            int(seconds), timezone(timedelta(seconds=delta))
+        )
+    except ValueError:
+        return date
+    return moment.strftime("%a %b %-d %H:%M:%S %Y ") + offset
+
+
+class CatFile:
+    """
+    Prints objects from the database, one at a time or as a long-running batch.
+    """
+
+    def __init__(self, pygit: Path) -> None:
+        self.db = ObjectDatabase(pygit / "objects")
+        self.refs = Refs(pygit)
+
+    def show(self, name: str, option: str):
+        """
+        :param name: Full sha, or a ref or branch name for the commit it points to.
+        :param option: "-t" for the type, "-s" for the size, "-p" for the pretty-printed content.
+        """
+        hash = self.refs.resolve(name)
+        try:
+            if hash is None:
+                raise FileNotFoundError(name)
+            if option == "-t":
+                print(self.db.read_header(hash)[0])
+                return
+            if option == "-s":
+                print(self.db.read_header(hash)[1])
+                return
+            obj_type, content = self.db.read(hash)
+        except (FileNotFoundError, ValueError):
+            raise ValueError(f"fatal: Not a valid object name {name}")
+        if obj_type == "tree":
+            for mode, name, sha in parse_tree(content):
+                kind = "tree" if mode in ("40000", "040000") else "blob"
+                print(f"{int(mode):06d} {kind} {sha}\t{name}")
+        else:
+            sys.stdout.buffer.write(content)
+            sys.stdout.buffer.flush()
+
+    def batch(self, inp: BinaryIO, out: BinaryIO, contents: bool = True):
+        """
+        Answers one object per input line until the input ends, like git's cat-file --batch.
+
+        Each answer is "<sha> <type> <size>" followed, with contents, by the content and
+        a newline. Unknown objects are answered with "<name> missing". The output is
+        flushed after every answer, so a client can ask and read in lockstep.
+        """
+        for line in inp:
+            name = line.strip().decode("utf-8", "replace")
+            if not name:
+                continue
+            hash = self.refs.resolve(name)
+            try:
+                if hash is None:
+                    raise FileNotFoundError(name)
+                # an object a partial clone lacks is fetched as it is read
+                if contents:
+                    obj_type, content = self.db.read(hash)
+                    size = len(content)
+                else:
+                    obj_type, size = self.db.read_header(hash)
+            except (FileNotFoundError, ValueError):
+                out.write(f"{name} missing\n".encode("utf-8"))
+                out.flush()
+                continue
+
+            out.write(f"{hash} {obj_type} {size}\n".encode("utf-8"))
+            if contents:
+                out.write(content)
+                out.write(b"\n")
+            out.flush()
+
+
+def parse_expiry(spec: str) -> float:
+    """
+    :param spec: "now", "<n>.<unit>.ago" with a unit from seconds to weeks, or a
+        "YYYY-MM-DD[THH:MM:SS]" date, like git's --prune.
+    :return: Timestamp before which an unreachable object may go.
+    """
+    if spec == "now":
+        # a second ahead, objects written during this very second go too
+        return time.time() + 1
+    parts = spec.split(".")
+    if len(parts) == 3 and parts[0].isdigit() and parts[2] == "ago":
+        unit = PRUNE_UNITS.get(parts[1].removesuffix("s"))
+        if unit is not None:
+            return time.time() - int(parts[0]) * unit
+    try:
+        return datetime.fromisoformat(spec).timestamp()
+    except ValueError:
+        raise ValueError(f"Invalid expiry date '{spec}'")
+
+
+class Gc:
+    """
+    Consolidates the loose objects and the existing packs into a single pack, and
+    rewrites the commit-graph.
+
+    With prune, it first drops the loose objects nothing reaches anymore: every
+    object reachable from the refs, their reflogs and the index is marked, then the
+    fan-out directories are swept in parallel for unmarked objects older than the
+    expiry date.
+    """
+
+    def __init__(self, pygit: Path, jobs: int | None = None) -> None:
+        self.pygit = pygit
+        self.obj_dir = pygit / "objects"
+        self.store = ObjectStore(self.obj_dir)
+        self.index = Index(
+            index_path=pygit / "index", obj_dir=self.obj_dir, store=self.store
+        )
+        # fan-out directories swept in parallel, one per core by default
+        self.jobs = jobs or os.cpu_count() or 1
+
+    def reachable(self) -> set:
+        """
+        Marks every object reachable from the refs, HEAD, the reflogs, the index
+        entries and the cache-tree.
+
+        Commits and trees are read to follow what they point to, blobs are only marked.
+        An object left out of a partial clone is marked without being fetched, all it
+        points to is at the promisor remote as well.
+
+        :return: Hashes of the reachable objects.
+        """
+        refs = Refs(self.pygit)
+        # (sha, type if it is known without reading the object)
+        pending: List[Tuple[str, str | None]] = [
+            (sha, None) for _, sha in refs.iter_refs()
+        ]
+        head = refs.resolve("HEAD")
+        if head is not None:
+            pending.append((head, None))
+        for ref in refs.iter_reflogs():
+            for old, new, _ in refs.read_reflog(ref):
+                # an entry whose commit is long gone doesn't keep anything
+                pending.extend(
+                    (sha, None)
+                    for sha in (old, new)
+                    if sha != ZERO_SHA and self.store.has(sha)
+                )
+        pending.extend(
+            (entry["hash"], "blob") for _, entry in self.index.iter_entries()
+        )
+        pending.extend(
+            (sha, "tree")
+            for count, sha in self.index.cache_tree.values()
+            if count >= 0 and sha is not None
+        )
+
+        partial = self.store.load_promisor() is not None
+        marked = set()
+        while pending:
+            sha, kind = pending.pop()
+            if sha in marked:
+                continue
+            marked.add(sha)
+            if kind == "blob":
+                continue
+            if not self.store.has(sha):
+                if partial:
+                    continue
+                raise ValueError(f"Unable to prune, object {sha} is missing")
+            kind, content = self.store.read(sha)
+            if kind == "commit":
+                commit = parse_commit(content)
+                pending.append((commit["tree"], "tree"))
+                pending.extend((parent, "commit") for parent in commit["parents"])
+            elif kind == "tree":
+                for mode, _, entry_sha in parse_tree(content):
+                    # gitlinks point into another repository
+                    if mode != "160000":
+                        pending.append(
+                            (
+                                entry_sha,
+                                "tree" if mode in ("40000", "040000") else "blob",
+                            )
+                        )
+            elif kind == "tag":
+                # an annotated tag keeps the object it points to, whatever its type
+                header = content.split(b"\n", 1)[0]
+                if header.startswith(b"object "):
+                    pending.append((header[len(b"object ") :].decode("ascii"), None))
+        tracing.count("objects_reachable", len(marked))
+        return marked
+
+    def prune(self, expire: float) -> set:
+        """
+        Deletes the loose objects that aren't reachable and were written before expire,
+        and temp files of interrupted writes older than that.
+
+        :param expire: Timestamp, see parse_expiry.
+        :return: Hashes of the reachable objects.
+        """
+        with tracing.span("mark"):
+            reachable = self.reachable()
+        prefixes = [
+            prefix
+            for prefix in os.listdir(self.obj_dir)
+            if len(prefix) == 2 and all(c in "0123456789abcdef" for c in prefix)
+        ]
+        with tracing.span("sweep", directories=len(prefixes), jobs=self.jobs):
+            with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+                swept = list(
+                    pool.map(lambda p: self.sweep(p, reachable, expire), prefixes)
+                )
+            for directory in (self.obj_dir, self.store.pack_dir):
+                self.sweep_temp(directory, expire)
+        count = sum(removed for removed, _ in swept)
+        size = sum(freed for _, freed in swept)
+        tracing.count("objects_pruned", count)
+        if count:
+            self.store.presence_path.unlink(missing_ok=True)
+        print(f"Pruned {count} unreachable objects ({size} bytes)")
+        return reachable
+
+    def sweep(self, prefix: str, reachable: set, expire: float) -> Tuple[int, int]:
+        """
+        :return: (number of objects removed from the fan-out directory, their size in bytes).
+        """
+        directory = self.obj_dir / prefix
+        removed, freed = 0, 0
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if len(entry.name) != 38 or prefix + entry.name in reachable:
+                    continue
+                st = entry.stat(follow_symlinks=False)
+                if st.st_mtime >= expire:
+                    continue
+                os.unlink(entry.path)
+                removed += 1
+                freed += st.st_size
+        if removed:
+            # a store racing with this recreates the directory, see ObjectStore.store
+            try:
+                directory.rmdir()
+            except OSError:
+                pass
+        return removed, freed
+
+    def sweep_temp(self, directory: Path, expire: float):
+        # leftovers of writes that died before their rename
+        if not directory.exists():
+            return
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.name.startswith(("tmp_obj_", "tmp_pack")):
+                    if entry.stat(follow_symlinks=False).st_mtime < expire:
+                        os.unlink(entry.path)
+
+    def repack(
+        self,
+        window: int = DELTA_WINDOW,
+        depth: int = DELTA_DEPTH,
+        reachable: set | None = None,
+    ):
+        """
+        :param reachable: Hashes from a prune, unreachable loose objects then stay loose
+            so a later prune still drops them once they expire.
+        """
+        objects: Dict[str, Tuple[str, str, int]] = {}
+        loose: List[str] = []
+        for hash in self.store.iter_loose():
+            if reachable is not None and hash not in reachable:
+                continue
+            try:
+                obj_type, size = self.store.read_loose_header(hash)
+            except (ValueError, zlib.error):
+                # objects written before blobs had headers can't be packed, they stay loose
+                print(f"Skipping {hash}: not a valid object")
+                continue
+            loose.append(hash)
+            objects[hash] = (hash, obj_type, size)
+
+        old_packs = self.store.load_packs()
+        for pack in old_packs:
+            for hash in pack.names():
+                if hash not in objects:
+                    objects[hash] = (hash, *pack.read_header(hash))
+        if not loose and len(old_packs) <= 1:
+            print("Nothing to pack")
+            return
+
+        # paths only steer the delta search, blobs of the same file end up side by side
+        names = {entry["hash"]: path for path, entry in self.index.iter_entries()}
+        idx_path = write_pack(
+            self.store.pack_dir,
+            list(objects.values()),
+            load=self.store.read,
+            names=names,
+            window=window,
+            depth=depth,
+        )
+        print(
+            f"Packed {len(objects)} objects into {idx_path.with_suffix('.pack').name}"
+        )
+
+        # the old copies are only dropped once the new pack is in place
+        self.store.close_packs()
+        for pack in old_packs:
+            if pack.idx_path != idx_path:
+                pack.idx_path.unlink(missing_ok=True)
+                pack.pack_path.unlink(missing_ok=True)
+        for hash in loose:
+            (self.obj_dir / hash[:2] / hash[2:]).unlink(missing_ok=True)
+        for prefix in {hash[:2] for hash in loose}:
+            if not any((self.obj_dir / prefix).iterdir()):
+                (self.obj_dir / prefix).rmdir()
+        self.store.presence_path.unlink(missing_ok=True)
+
+    def write_commit_graph(self):
+        count = History(self.pygit).write_graph(Refs(self.pygit))
+        print(f"Wrote a commit-graph of {count} commits")
+
+
+class Commit:
+    def __init__(self, pygit: Path, store: ObjectStore | None = None):
+        self.pygit = pygit
+        self.index_path = pygit / "index"
+        self.obj_dir = pygit / "objects"
+        # a caller that reads the trees back passes its store, so it sees the new objects
+        self.store = store or ObjectStore(self.obj_dir)
+        self.index = Index(
+            index_path=self.index_path, obj_dir=self.obj_dir, store=self.store
+        )
+        self.list_of_tuples: List[Tuple[str, str, str]] = [
+            (path, entry["hash"], entry["mode"])
+            for path, entry in self.index.iter_entries()
+        ]
+        pass
+
+    def create_tree_from_index(self, repo_root: str = ".") -> str:
+        """
+        Loads the index and creates the root tree object.
+
+        Trees of directories that are still valid in the cache-tree are reused, only
+        the directories on the path of a staged change are rebuilt.
+
+        :return: Hex SHA-1 of the root tree.
+        """
+        # the rebuilt trees go back into the index cache-tree in one write, the new
+        # ones go into a pack that is in place before the cache-tree names them
+        with self.index.transaction():
+            with tracing.span(
+                "tree-build", entries=len(self.list_of_tuples)
+            ), self.store.bulk():
+                root_tree_sha = self.build_tree(
+                    repo_root=repo_root, entries=self.list_of_tuples
+                )
+            self.index.prune_cache_tree()
+        return root_tree_sha
+        pass
+
+    def write_tree_objects(self, content: bytes, hash: str, repo_root: str = "."):
+        # unchanged trees are already stored, they are neither compressed nor written again
+        self.store.write_raw(hash, content)
+
+    def build_tree(
+        self,
+        entries: List[Tuple[str, str, str]],
+        repo_root: str = ".",
+    ) -> str:
+        """
+        Builds every Git tree object of the index in a single pass.
+
+        The entries are in index order, sorted by full path, which is exactly git's tree
+        order where a directory compares as "name/". So the entries of a directory are
+        contiguous, and the trees can be built with a stack of open directories: a
+        directory is opened when the first path below it shows up and closed, hashed and
+        added to its parent as soon as a path outside of it shows up. A directory that is
+        still valid in the cache-tree is added from there and its entries are skipped.
+
+        :param entries: List of (full_path, sha, mode) of all staged files, sorted by path.
+        :return: Hex SHA-1 of the root tree.
+        """
+
+        # we will store the tree information in a tree object, which is a text like file with
+        # it's own sha-1 hash for unique identification and is stored as a compressed zlib file
+        # in objects dir
+        if not entries:
+            raise ValueError("No entries to build tree from")
+
+        count = len(entries)
+        cached = self.index.cached_tree("")
+        if cached is not None and cached[0] == count:
+            return cached[1]
+
+        # open directories: (path, path with a trailing "/", tree content, index of its first entry)
+        stack: List[Tuple[str, str, bytearray, int]] = [("", "", bytearray(), 0)]
+        i = 0
+        while i < count:
+            full_path, sha, mode = entries[i]
+            directory, _, name = full_path.rpartition("/")
+
+            # close the open directories this path isn't in
+            while not full_path.startswith(stack[-1][1]):
+                self.close_tree(stack, i)
+
+            # open the directories between the innermost open one and the path's own directory
+            skipped = False
+            while stack[-1][0] != directory:
+                parent = stack[-1][1]
+                child = directory[len(parent) :].split("/", 1)[0]
+                child_dir = parent + child
+                cached = self.index.cached_tree(child_dir)
+                if cached is not None and self.covers(entries, i, cached[0], child_dir):
+                    stack[-1][2].extend(
+                        b"40000 "
+                        + child.encode("utf-8")
+                        + b"\0"
+                        + bytes.fromhex(cached[1])
+                    )
+                    i += cached[0]
+                    skipped = True
+                    break
+                stack.append((child_dir, child_dir + "/", bytearray(), i))
+            if skipped:
+                continue
+
+            stack[-1][2].extend(f"{mode} {name}\0".encode("utf-8") + bytes.fromhex(sha))
+            i += 1
+
+        while len(stack) > 1:
+            self.close_tree(stack, count)
+        return self.write_tree(stack[0][2], "", count)
+
+    def covers(
+        self,
+        entries: List[Tuple[str, str, str]],
+        start: int,
+        length: int,
+        directory: str,
+    ) -> bool:
+        # a cached tree is only valid if exactly entries[start:start + length] are below its directory
+        prefix = directory + "/"
+        end = start + length
+        if end > len(entries) or not entries[end - 1][0].startswith(prefix):
+            return False
+        return end == len(entries) or not entries[end][0].startswith(prefix)
+
+    def close_tree(self, stack: List[Tuple[str, str, bytearray, int]], end: int):
+        directory, _, content, start = stack.pop()
+        tree_sha = self.write_tree(content, directory, end - start)
+        name = directory.rpartition("/")[2]
+        stack[-1][2].extend(
+            b"40000 " + name.encode("utf-8") + b"\0" + bytes.fromhex(tree_sha)
+        )
+
+    def write_tree(self, content: bytearray, directory: str, entry_count: int) -> str:
+        # Add header
+        full_content = f"tree {len(content)}\0".encode("utf-8") + content
+
+        # Compute SHA-1
+        tree_sha = hashlib.sha1(full_content).hexdigest()
+
+        # Store the object
+        self.write_tree_objects(hash=tree_sha, content=full_content)
+        self.index.update_cache_tree(directory, entry_count, tree_sha)
+        return tree_sha
+
+    def commit(self, message: str):
+        root_tree_hash = self.create_tree_from_index()
+        refs = Refs(self.pygit)
+        parent = refs.resolve("HEAD")
+        if parent is not None:
+            history = History(self.pygit, db=ObjectDatabase(self.obj_dir, self.store))
+            if history.tree(parent) == root_tree_hash:
+                print("nothing to commit, the index matches HEAD")
+                return None
+
+        if not message.endswith("\n"):
+            message += "\n"
+        content = f"tree {root_tree_hash}\n"
+        if parent is not None:
+            content += f"parent {parent}\n"
+        content += f"author {identity('AUTHOR')}\ncommitter {identity()}\n\n{message}"
+        commit_hash = self.store.write_object("commit", content.encode("utf-8"))
+        self.store.save()
+
+        # the branch only moves if nobody else moved it since HEAD was read
+        title = message.split("\n", 1)[0]
+        kind = "commit" if parent is not None else "commit (initial)"
+        refs.update_head(commit_hash, f"{kind}: {title}", old=parent or ZERO_SHA)
+        print(f"[{refs.current_branch() or 'detached HEAD'} {commit_hash[:7]}] {title}")
+        return commit_hash
+
+
+class Status:
+    """
+    Compares HEAD, the index and the working tree, like git status.
+
+    The index is compared against HEAD tree by tree: a directory whose cache-tree
+    sha equals the sha of the same directory in HEAD has nothing staged and isn't
+    read at all, so a clean index after a commit costs a single comparison. The
+    working tree is compared against the index through the stat data, a file is
+    only hashed when its stat changed but its size didn't.
+    """
+
+    def __init__(self, pygit: Path, jobs: int | None = None) -> None:
+        self.pygit = pygit
+        self.obj_dir = pygit / "objects"
+        self.store = ObjectStore(self.obj_dir)
+        self.db = ObjectDatabase(self.obj_dir, store=self.store)
+        self.index = Index(
+            index_path=pygit / "index", obj_dir=self.obj_dir, store=self.store
+        )
+        self.jobs = jobs
+
+    def head_tree(self) -> str | None:
+        # root tree of the last commit, None before the first one
+        head = Refs(self.pygit).resolve("HEAD")
+        if head is None:
+            return None
+        return History(self.pygit, db=self.db).tree(head)
+
+    def staged(self, head_tree: str | None) -> List[Tuple[str, str]]:
+        """
+        :param head_tree: Root tree of HEAD, None if there is no commit yet.
+        :return: Sorted (status, path) of the changes between HEAD and the index, status is "A", "M" or "D".
+        """
+        if head_tree is not None:
+            root = self.index.cached_tree("")
+            if root is not None and root[1] == head_tree:
+                return []
+
+        head: Dict[str, Tuple[str, str]] = {}
+        # directories whose tree is the same in HEAD and in the index
+        same: set = set()
+        if head_tree is not None:
+            self.flatten(head_tree, "", head, same)
+
+        changes = []
+        for path, entry in self.index.iter_entries():
+            if same and self.in_same_tree(path, same):
+                continue
+            old = head.pop(path, None)
+            if old is None:
+                changes.append(("A", path))
+            elif old != (entry["mode"], entry["hash"]):
+                changes.append(("M", path))
+        changes.extend(("D", path) for path in head)
+        changes.sort(key=lambda change: change[1])
+        return changes
+
+    def flatten(
+        self,
+        tree: str,
+        prefix: str,
+        head: Dict[str, Tuple[str, str]],
+        same: set,
+    ):
+        # files of a HEAD tree by path, subtrees the index still has are left out
+        for mode, name, sha in self.db.read_tree(tree):
+            path = prefix + name
+            if mode in ("40000", "040000"):
+                cached = self.index.cached_tree(path)
+                if cached is not None and cached[1] == sha:
+                    same.add(path)
+                else:
+                    self.flatten(sha, path + "/", head, same)
+            else:
+                head[path] = (mode, sha)
+
+    def in_same_tree(self, path: str, same: set) -> bool:
+        directory = path
+        while directory:
+            directory = directory.rpartition("/")[0]
+            if directory in same:
+                return True
+        return False
+
+    def unstaged(self) -> Tuple[List[Tuple[str, str]], List[str]]:
+        """
+        With a running fsmonitor daemon only the paths changed since the last "add ." are
+        looked at, otherwise the whole tree is walked.
+
+        :return: (sorted (status, path) of the changes between the index and the working tree, sorted untracked paths).
+        """
+        changes = []
+        untracked = []
+        seen = set()
+        _, changed = fsmonitor.changed_since(self.pygit, self.index.fsmonitor_token)
+        if changed is None:
+            paths = ["."]
+            self.index.load_names()
+        else:
+            paths = [path for path in changed if os.path.lexists(path)]
+
+        for path, st in Walker(ignore=Ignore(), jobs=self.jobs).walk(paths):
+            if path in seen:
+                continue
+            seen.add(path)
+            if self.index.is_stat_clean(path, st):
+                continue
+            entry = self.index.get_entry(path)
+            if entry is None:
+                untracked.append(path)
+            elif self.is_modified(path, entry, st):
+                changes.append(("M", path))
+
+        if changed is not None:
+            for path in changed:
+                if not os.path.lexists(path):
+                    changes.extend(
+                        ("D", entry_path)
+                        for entry_path, _ in self.index.iter_under(path)
+                        if not os.path.lexists(entry_path)
+                    )
+        # every tracked file was found, so nothing was deleted
+        elif len(seen) - len(untracked) != len(self.index):
+            for path, entry in self.index.iter_entries():
+                if path in seen:
+                    continue
+                try:
+                    st = os.lstat(path)
+                except FileNotFoundError:
+                    changes.append(("D", path))
+                    continue
+                # tracked, but ignored by the walk
+                if self.is_modified(path, entry, st):
+                    changes.append(("M", path))
+
+        changes = sorted(set(changes), key=lambda change: change[1])
+        untracked.sort()
+        return changes, untracked
+
+    def is_modified(self, path: str, entry: dict, st: os.stat_result) -> bool:
+        if self.index.is_stat_clean(path, st, entry):
+            return False
+        if entry["mode"] != self.index.file_mode(path, st):
+            return True
+        # a size of 0 is a smudged racy entry, only the content can tell
+        if entry["size"] not in (0, st.st_size & UINT32_MASK):
+            return True
+        # same size, only the content can tell
+        return self.hash_file(path, st.st_size) != entry["hash"]
+
+    def hash_file(self, file_path, size: int) -> str:
+        if os.path.islink(file_path):
+            target = os.fsencode(os.readlink(file_path))
+            return hashlib.sha1(
+                f"blob {len(target)}\0".encode("utf-8") + target
+            ).hexdigest()
+        sha = hashlib.sha1(f"blob {size}\0".encode("utf-8"))
+        with open(file_path, "rb") as f:
+            while chunk := f.read(BLOB_CHUNK_SIZE):
+                sha.update(chunk)
+        return sha.hexdigest()
+
+    def show(self, short: bool = False):
+        with tracing.span("staged"):
+            staged = self.staged(self.head_tree())
+        with tracing.span("unstaged"):
+            unstaged, untracked = self.unstaged()
+
+        if short:
+            # one line per path, the staged status first and the unstaged one second
+            codes: Dict[str, List[str]] = {}
+            for status, path in staged:
+                codes.setdefault(path, [" ", " "])[0] = status
+            for status, path in unstaged:
+                codes.setdefault(path, [" ", " "])[1] = status
+            for path in sorted(codes):
+                print(f"{''.join(codes[path])} {path}")
+            for path in untracked:
+                print(f"?? {path}")
+            return
+
+        names = {"A": "new file", "M": "modified", "D": "deleted"}
+        sections = [
+            ("Changes to be committed:", staged),
+            ("Changes not staged for commit:", unstaged),
+            ("Untracked files:", [(None, path) for path in untracked]),
+        ]
+        printed = False
+        for title, changes in sections:
+            if not changes:
+                continue
+            print(title)
+            for status, path in changes:
+                if status is None:
+                    print(f"\t{path}")
+                else:
+                    print(f"\t{names[status] + ':':<12}{path}")
+            print()
+            printed = True
+        if not printed:
+            print("nothing to commit, working tree clean")
+
+
+class Diff:
+    """
+    Compares two of a commit, the index and the working tree, like git diff.
+
+    Commits and the index are compared as trees: the index is written out as tree
+    objects the way commit does it, reusing the cache-tree, and two trees are walked
+    side by side, skipping every subtree with the same sha on both sides. The cost
+    of a diff follows the number of changed directories, not the size of the tree.
+    The working tree is compared through the stat data, like status does.
+
+    Changes are streamed as (status, path, old, new), status is "A", "D" or "M" and
+    old and new are (mode, sha), None for a missing side, or a sha of None for a file
+    that is only in the working tree. The lines of a changed file are compared by
+    linediff, with Myers or the histogram algorithm.
+    """
+
+    def __init__(
+        self,
+        pygit: Path,
+        jobs: int | None = None,
+        algorithm: str = "myers",
+        context: int = 3,
+    ) -> None:
+        self.pygit = pygit
+        self.jobs = jobs
+        self.algorithm = algorithm
+        self.context = context
+        self.store = ObjectStore(pygit / "objects")
+        self.db = ObjectDatabase(pygit / "objects", store=self.store)
+        self.refs = Refs(pygit)
+
+    def commit_tree(self, rev: str) -> str:
+        sha = self.refs.resolve(rev)
+        if sha is None:
+            raise ValueError(f"Not a valid commit: {rev}")
+        return History(self.pygit, db=self.db).tree(sha)
+
+    def index_tree(self) -> str:
+        index = Index(
+            index_path=self.pygit / "index",
+            obj_dir=self.pygit / "objects",
+            store=self.store,
+        )
+        # nothing staged since the last tree was written, the cache-tree has the root
+        root = index.cached_tree("")
+        if root is not None:
+            return root[1]
+        # only the directories the cache-tree doesn't have are hashed and written
+        return Commit(pygit=self.pygit, store=self.store).create_tree_from_index()
+
+    def tree_entries(self, tree: str | None) -> Dict[str, Tuple[str, str, str]]:
+        # subtrees get a trailing "/", so the keys sort in git's tree order
+        entries = {}
+        if tree is not None:
+            for mode, name, sha in self.db.read_tree(tree):
+                key = name + "/" if mode in ("40000", "040000") else name
+                entries[key] = (name, mode, sha)
+        return entries
+
+    def diff_trees(
+        self, old: str | None, new: str | None, prefix: str = ""
+    ) -> Iterator[Tuple[str, str, Tuple | None, Tuple | None]]:
+        """
+        :param old: Old tree sha, None for an empty tree.
+        :param new: New tree sha, None for an empty tree.
+        :return: The changed files, in path order.
+        """
+        if old == new:
+            return
+        old_entries = self.tree_entries(old)
+        new_entries = self.tree_entries(new)
+        for key in sorted(old_entries.keys() | new_entries.keys()):
+            before = old_entries.get(key)
+            after = new_entries.get(key)
+            if before is not None and after is not None and before[1:] == after[1:]:
+                continue
+            name = (before or after)[0]
+            if key.endswith("/"):
+                yield from self.diff_trees(
+                    before[2] if before else None,
+                    after[2] if after else None,
+                    prefix + name + "/",
+                )
+                continue
+            old_side = (before[1], before[2]) if before else None
+            new_side = (after[1], after[2]) if after else None
+            status = "A" if before is None else "D" if after is None else "M"
+            yield status, prefix + name, old_side, new_side
+
+    def diff_worktree(
+        self, tree: str | None = None
+    ) -> Iterator[Tuple[str, str, Tuple | None, Tuple | None]]:
+        """
+        :param tree: Tree to compare the working tree with, the index if None.
+        :return: The changed files, in path order. Untracked files aren't part of it.
+        """
+        status = Status(self.pygit, jobs=self.jobs)
+        index = status.index
+        unstaged = {path: change for change, path in status.unstaged()[0]}
+        staged = {}
+        if tree is not None:
+            staged = {
+                path: (old, new)
+                for _, path, old, new in self.diff_trees(tree, self.index_tree())
+            }
+            index.load_index()
+
+        for path in sorted(unstaged.keys() | staged.keys()):
+            entry = index.get_entry(path)
+            indexed = (entry["mode"], entry["hash"]) if entry is not None else None
+            if tree is None:
+                old = indexed
+            else:
+                old = staged[path][0] if path in staged else indexed
+            if unstaged.get(path) == "D":
+                new = None
+            elif path in unstaged:
+                new = (index.file_mode(path), None)
+            else:
+                new = indexed
+
+            if old is None and new is None:
+                continue
+            if old is not None and new is not None:
+                if new[1] is None:
+                    st = os.lstat(path)
+                    if (
+                        new[0] == old[0]
+                        and status.hash_file(path, st.st_size) == old[1]
+                    ):
+                        continue
+                elif new == old:
+                    continue
+            change = "A" if old is None else "D" if new is None else "M"
+            yield change, path, old, new
+
+    def content(self, path: str, side: Tuple | None) -> bytes:
+        if side is None:
+            return b""
+        if side[1] is None:
+            if side[0] == "120000":
+                return os.fsencode(os.readlink(path))
+            with open(path, "rb") as f:
+                return f.read()
+        return self.db.read_blob(side[1])
+
+    def changes(
+        self, revs: List[str], cached: bool = False
+    ) -> Iterator[Tuple[str, str, Tuple | None, Tuple | None]]:
+        """
+        :param revs: No commit for index to working tree (or HEAD to index with cached),
+            one for that commit to the working tree (or to the index with cached), two for
+            one commit to the other.
+        """
+        if len(revs) == 2:
+            return self.diff_trees(self.commit_tree(revs[0]), self.commit_tree(revs[1]))
+        if cached:
+            rev = revs[0] if revs else "HEAD"
+            old = self.commit_tree(rev) if self.refs.resolve(rev) else None
+            return self.diff_trees(old, self.index_tree())
+        if revs:
+            return self.diff_worktree(self.commit_tree(revs[0]))
+        return self.diff_worktree()
+
+    def show(
+        self,
+        revs: List[str],
+        cached: bool = False,
+        name_status: bool = False,
+        stat: bool = False,
+    ):
+        changes = self.changes(revs, cached=cached)
+        if name_status:
+            for change, path, _, _ in changes:
+                print(f"{change}\t{path}")
+            return
+        # printed as they come, a huge diff is never held in memory
+        changes = self.with_blobs(changes)
+        if stat:
+            self.show_stat(changes)
+            return
+        out = sys.stdout.buffer
+        for change in changes:
+            out.writelines(self.patch(*change))
+        out.flush()
+
+    def with_blobs(
+        self, changes: Iterable[Tuple[str, str, Tuple | None, Tuple | None]]
+    ) -> Iterator[Tuple[str, str, Tuple | None, Tuple | None]]:
+        """
+        Passes the changes through, a batch at a time, once the blobs of the batch that
+        a partial clone lacks are fetched in one request.
+        """
+        changes = iter(changes)
+        while batch := list(itertools.islice(changes, PROMISOR_BATCH)):
+            self.store.fetch_missing(
+                side[1]
+                for _, _, old, new in batch
+                for side in (old, new)
+                if side is not None and side[1] is not None and side[0] != "160000"
+            )
+            yield from batch
+
+    def patch(
+        self, change: str, path: str, old: Tuple | None, new: Tuple | None
+    ) -> Iterator[bytes]:
+        """
+        :return: The lines of the patch of one file, headers included, like git diff prints them.
+        """
+        before = self.content(path, old)
+        after = self.content(path, new)
+        old_sha = old[1] if old is not None else ZERO_SHA
+        new_sha = new[1] if new is not None else ZERO_SHA
+        if new is not None and new_sha is None:
+            # the blob the working tree file would be, without writing it
+            header = f"blob {len(after)}\0".encode("utf-8")
+            new_sha = hashlib.sha1(header + after).hexdigest()
+
+        header = [f"diff --git a/{path} b/{path}"]
+        if change == "A":
+            header.append(f"new file mode {new[0]}")
+        elif change == "D":
+            header.append(f"deleted file mode {old[0]}")
+        elif old[0] != new[0]:
+            header += [f"old mode {old[0]}", f"new mode {new[0]}"]
+        if old_sha != new_sha:
+            line = f"index {old_sha[:DIFF_ABBREV]}..{new_sha[:DIFF_ABBREV]}"
+            if change == "M" and old[0] == new[0]:
+                line += f" {old[0]}"
+            header.append(line)
+        yield from (f"{line}\n".encode("utf-8") for line in header)
+        if old_sha == new_sha:
+            return
+
+        old_name = f"a/{path}" if old is not None else "/dev/null"
+        new_name = f"b/{path}" if new is not None else "/dev/null"
+        if is_binary(before) or is_binary(after):
+            yield f"Binary files {old_name} and {new_name} differ\n".encode("utf-8")
+            return
+        a, b, blocks = linediff.diff_bytes(before, after, algorithm=self.algorithm)
+        if not blocks:
+            # an empty file added or deleted
+            return
+        yield f"--- {old_name}\n".encode("utf-8")
+        yield f"+++ {new_name}\n".encode("utf-8")
+        yield from linediff.unified_hunks(a, b, blocks, context=self.context)
+
+    def show_stat(self, changes: Iterable[Tuple[str, str, Tuple | None, Tuple | None]]):
+        rows = []
+        for _, path, old, new in changes:
+            before = self.content(path, old)
+            after = self.content(path, new)
+            if is_binary(before) or is_binary(after):
+                rows.append((path, None, (len(before), len(after))))
+            else:
+                blocks = linediff.diff_bytes(before, after, algorithm=self.algorithm)[2]
+                rows.append((path, linediff.count_changes(blocks), None))
+        if not rows:
+            return
+
+        width = max(len(path) for path, _, _ in rows)
+        most = max((sum(counts) for _, counts, _ in rows if counts), default=0)
+        digits = len(str(most))
+        if any(counts is None for _, counts, _ in rows):
+            # the counts line up with "Bin"
+            digits = max(digits, 3)
+        # the bars are scaled down when the biggest change doesn't fit
+        scale = min(1.0, DIFF_STAT_WIDTH / most) if most else 1.0
+        inserted = deleted = 0
+        for path, counts, sizes in rows:
+            if counts is None:
+                print(f" {path:<{width}} | Bin {sizes[0]} -> {sizes[1]} bytes")
+                continue
+            added, removed = counts
+            inserted += added
+            deleted += removed
+            plus = math.ceil(added * scale) if added else 0
+            minus = math.ceil(removed * scale) if removed else 0
+            bar = "+" * plus + "-" * minus
+            print(f" {path:<{width}} | {added + removed:>{digits}} {bar}".rstrip())
+        summary = f" {len(rows)} file{'s' if len(rows) != 1 else ''} changed"
+        if inserted:
+            summary += f", {inserted} insertion{'s' if inserted != 1 else ''}(+)"
+        if deleted:
+            summary += f", {deleted} deletion{'s' if deleted != 1 else ''}(-)"
+        print(summary)
+
+
+def is_binary(content: bytes) -> bool:
+    # git's heuristic, a NUL in the first 8000 bytes
+    return b"\0" in content[:8000]
+
+
+class Checkout:
+    """
+    Switches the working tree, the index and HEAD to another commit, like git checkout.
+
+    Only what differs is touched: the tree of HEAD is diffed against the target tree,
+    skipping every subtree with the same sha on both sides, and only the paths in
+    that diff are written, deleted or chmod'ed. Blobs are inflated and written on a
+    thread pool, and the index gets all the new entries, with their fresh stat data,
+    in a single write at the end. The cache-tree of a directory whose index content
+    was HEAD's is moved to the target's tree, so status and commit don't rebuild it.
+
+    Staged and unstaged changes of other paths are carried over. A path with local
+    changes that the checkout would overwrite stops it before anything is written.
+    """
+
+    def __init__(self, pygit: Path, jobs: int | None = None) -> None:
+        self.pygit = pygit
+        # number of files written in parallel, one per core by default
+        self.jobs = jobs or os.cpu_count() or 1
+        self.status = Status(pygit, jobs=jobs)
+        self.index = self.status.index
+        self.db = self.status.db
+        self.diff = Diff(pygit, jobs=jobs)
+        self.refs = Refs(pygit)
+        self.umask = os.umask(0)
+        os.umask(self.umask)
+
+    def checkout(self, rev: str):
+        """
+        :param rev: Branch to switch to, or any commit to detach HEAD at. A branch that
+            only exists on one remote is created from its remote-tracking branch, like git.
+        """
+        sha = self.refs.resolve(rev)
+        upstream = None
+        if sha is None:
+            tracking = self.refs.tracking_refs(rev)
+            if len(tracking) > 1:
+                raise ValueError(
+                    f"'{rev}' matched multiple remote-tracking branches: "
+                    + ", ".join(tracking)
+                )
+            if tracking:
+                upstream = tracking[0]
+                sha = self.refs.read_ref(upstream)
+        if sha is None:
+            raise ValueError(f"Not a valid commit: {rev}")
+        branch = (
+            f"refs/heads/{rev}"
+            if upstream is not None or self.refs.read_ref(f"refs/heads/{rev}")
+            else None
+        )
+        history = History(self.pygit, db=self.db)
+        target_tree = history.tree(sha)
+        head = self.refs.resolve("HEAD")
+        head_tree = history.tree(head) if head is not None else None
+
+        with tracing.span("tree-diff"):
+            changes = list(self.diff.diff_trees(head_tree, target_tree))
+        needed = {
+            new[1]
+            for _, _, old, new in changes
+            if new is not None and (old is None or old[1] != new[1])
+        }
+        # a partial clone fetches what it lacks in one go, before anything is written
+        self.db.store.fetch_missing(needed)
+        # checked up front, a blob missing halfway would leave a half switched working tree
+        missing = sorted(sha for sha in needed if not self.db.exists(sha))
+        if missing:
+            raise ValueError(
+                f"Unable to check out {rev}, objects are missing: {', '.join(missing)}"
+            )
+        conflicts = self.conflicts(changes)
+        if conflicts:
+            raise ValueError(
+                "Your local changes to the following files would be overwritten by checkout:\n"
+                + "".join(f"\t{path}\n" for path in conflicts)
+                + "Commit them or undo them before you switch."
+            )
+
+        with self.index.transaction():
+            valid = self.valid_trees(changes, head_tree)
+            with tracing.span("worktree-update", changes=len(changes)):
+                self.update_worktree(changes)
+            for directory, count in valid.items():
+                tree = self.tree_at(target_tree, directory)
+                if tree is not None:
+                    self.index.update_cache_tree(directory, count, tree)
+
+        previous = self.refs.current_branch() or head or ""
+        if upstream is not None:
+            shown = upstream[len("refs/remotes/") :]
+            self.refs.update_ref(
+                branch, sha, f"branch: Created from {shown}", old=ZERO_SHA
+            )
+            print(f"branch '{rev}' set up to track '{shown}'.")
+        if branch is not None:
+            name = branch[len("refs/heads/") :]
+            if branch == self.refs.read_head():
+                print(f"Already on '{name}'")
+                return
+            self.refs.set_head(
+                branch, message=f"checkout: moving from {previous} to {name}"
+            )
+            print(f"Switched to branch '{name}'")
+        else:
+            self.refs.set_head(
+                sha, message=f"checkout: moving from {previous} to {sha}"
+            )
+            title = self.db.read_commit(sha)["message"].splitlines()
+            print(f"HEAD is now at {sha[:7]} {title[0] if title else ''}")
+
+    def conflicts(
+        self, changes: List[Tuple[str, str, Tuple | None, Tuple | None]]
+    ) -> List[str]:
+        """
+        :return: Paths of the diff whose index entry isn't HEAD's, or whose working tree
+            file isn't the index's, or untracked files in the way of a new one.
+        """
+        conflicts = []
+        for _, path, old, new in changes:
+            entry = self.index.get_entry(path)
+            indexed = (entry["mode"], entry["hash"]) if entry is not None else None
+            if indexed != old:
+                conflicts.append(path)
+                continue
+            try:
+                st = os.lstat(path)
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            if stat.S_ISDIR(st.st_mode):
+                # only in the way if something is left in it once the deletions are done
+                continue
+            if entry is None:
+                if new is None or self.status.hash_file(path, st.st_size) != new[1]:
+                    conflicts.append(path)
+            elif not self.index.is_stat_clean(path, st, entry) and (
+                self.status.hash_file(path, st.st_size) != entry["hash"]
+            ):
+                conflicts.append(path)
+        return conflicts
+
+    def valid_trees(
+        self,
+        changes: List[Tuple[str, str, Tuple | None, Tuple | None]],
+        head_tree: str | None,
+    ) -> Dict[str, int]:
+        """
+        :return: directory -> entry count after the checkout, of the directories above a
+            change whose cache-tree is HEAD's tree, their new tree is the target's.
+        """
+        counts: Dict[str, int] = {}
+        for _, path, old, new in changes:
+            step = (new is not None) - (old is not None)
+            directory = path
+            while directory:
+                directory = directory.rpartition("/")[0]
+                counts[directory] = counts.get(directory, 0) + step
+        valid = {}
+        for directory, step in counts.items():
+            cached = self.index.cached_tree(directory)
+            if cached is not None and cached[1] == self.tree_at(head_tree, directory):
+                valid[directory] = cached[0] + step
+        return valid
+
+    def tree_at(self, tree: str | None, directory: str) -> str | None:
+        # tree sha of a directory below a root tree, None if it isn't there
+        for name in directory.split("/") if directory else ():
+            if tree is None:
+                return None
+            tree = next(
+                (
+                    sha
+                    for mode, entry, sha in self.db.read_tree(tree)
+                    if entry == name and mode in ("40000", "040000")
+                ),
+                None,
+            )
+        return tree
+
+    def update_worktree(
+        self, changes: List[Tuple[str, str, Tuple | None, Tuple | None]]
+    ):
+        removed = [path for _, path, _, new in changes if new is None]
+        chmods = [
+            (path, new)
+            for _, path, old, new in changes
+            if old is not None and new is not None and old[1] == new[1]
+        ]
+        writes = [
+            (path, new)
+            for _, path, old, new in changes
+            if new is not None and (old is None or old[1] != new[1])
+        ]
+
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            # deletions first, a file may have to make room for a directory and the other way round
+            list(pool.map(self.remove_file, removed))
+            self.remove_empty_dirs(removed)
+            chmoded = list(pool.map(lambda change: self.chmod_file(*change), chmods))
+            written = list(pool.map(lambda change: self.write_file(*change), writes))
+
+        for path in removed:
+            self.index.remove_entry(path)
+        for (path, new), st in zip(chmods + writes, chmoded + written):
+            self.index.set_entry(
+                path,
+                {
+                    "hash": new[1],
+                    "mode": new[0],
+                    "mtime": st.st_mtime,
+                    "size": st.st_size & UINT32_MASK,
+                    "mtime_ns": st.st_mtime_ns,
+                    "ctime_ns": st.st_ctime_ns,
+                    "ino": st.st_ino & UINT32_MASK,
+                },
+            )
+
+    def remove_file(self, path: str):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+    def remove_empty_dirs(self, removed: List[str]):
+        # deepest first, so a directory emptied by its subdirectories goes as well
+        directories = set()
+        for path in removed:
+            directory = path.rpartition("/")[0]
+            while directory and directory not in directories:
+                directories.add(directory)
+                directory = directory.rpartition("/")[0]
+        for directory in sorted(directories, key=lambda d: d.count("/"), reverse=True):
+            try:
+                os.rmdir(directory)
+            except OSError:
+                # still has untracked or other tracked files
+                pass
+
+    def write_file(self, path: str, side: Tuple[str, str]) -> os.stat_result:
+        # runs on the pool, zlib and the file writes release the GIL
+        content = self.db.read_blob(side[1])
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # a new file instead of rewriting the old one, whoever still reads that keeps its content
+        self.remove_file(path)
+        if side[0] == "120000":
+            os.symlink(os.fsdecode(content), path)
+            return os.lstat(path)
+        mode = 0o777 if side[0] == "100755" else 0o666
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, mode)
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        return os.lstat(path)
+
+    def chmod_file(self, path: str, side: Tuple[str, str]) -> os.stat_result:
+        if not os.path.lexists(path):
+            return self.write_file(path, side)
+        mode = 0o777 if side[0] == "100755" else 0o666
+        os.chmod(path, mode & ~self.umask)
+        return os.lstat(path)
+
+
+class Remote:
+    """
+    Remotes are other pygit repositories, kept in the config as [remote "<name>"]
+    sections. Their url is the path of the repository on the local disk, or the
+    pygit://host:port or unix:/path/of/socket of a 'pygit serve'.
+    """
+
+    def __init__(self, pygit: Path) -> None:
+        self.pygit = pygit
+        self.config = Config(pygit / "config")
+
+    def add(self, name: str, url: str):
+        if self.config.get("remote", name, "url") is not None:
+            raise ValueError(f"remote {name} already exists.")
+        self.config.set("remote", name, "url", url)
+        self.config.set("remote", name, "fetch", f"+refs/heads/*:refs/remotes/{name}/*")
+
+    def remove(self, name: str):
+        if not self.config.remove_section("remote", name):
+            raise ValueError(f"No such remote: '{name}'")
+
+    def names(self) -> List[str]:
+        return list(self.config.subsections("remote"))
+
+    def url(self, name: str) -> str:
+        url = self.config.get("remote", name, "url")
+        if url is None:
+            raise ValueError(f"'{name}' does not appear to be a pygit repository")
+        return url
+
+    def path(self, name: str) -> Path:
+        """
+        :return: The .pygit directory of the remote, its url may name the directory above it.
+        """
+        url = Path(self.url(name))
+        for candidate in (url / ".pygit", url):
+            if (candidate / "objects").is_dir() and (candidate / "refs").is_dir():
+                return candidate
+        raise ValueError(f"'{url}' does not appear to be a pygit repository")
+
+
+def parse_filter(spec: str) -> int:
+    """
+    :param spec: "blob:none" or "blob:limit=<n>[kmg]", like git's --filter.
+    :return: Size from which blobs are left out, 0 to leave out every blob.
+    """
+    if spec == "blob:none":
+        return 0
+    if spec.startswith("blob:limit="):
+        value = spec[len("blob:limit=") :].lower()
+        unit = {"k": 1 << 10, "m": 1 << 20, "g": 1 << 30}.get(value[-1:], 1)
+        digits = value[:-1] if unit > 1 else value
+        if digits.isdigit():
+            return int(digits) * unit
+    raise ValueError(f"Invalid filter-spec '{spec}'")
+
+
+class PackTransfer:
+    """
+    Packs the commits one side is missing, with their trees and blobs, into a single pack.
+
+    Negotiation follows the commit ancestry, newest commit time first like git's
+    revision walk: the wanted commits are new, the commits the other side has, or
+    that it named as haves, are old, and old marks every parent as old too. The walk
+    stops as soon as nothing new is left to visit, so it covers the new history and
+    the few old commits of the same time. With the receiving repository at hand, its
+    object store says which commits it has; over the network the haves do.
+
+    The trees of the new commits are compared with the trees of their parents, a
+    subtree or blob the same as in a parent, or one the receiver has, isn't looked
+    at any further. So the work and the size of the pack follow the new history,
+    not the size of the repository. With a blob limit, blobs of that size or bigger
+    are left out, for a partial clone to fetch them later.
+    """
+
+    def __init__(self, source: Path, target: Path | None = None) -> None:
+        self.source = ObjectStore(source / "objects")
+        self.source_db = ObjectDatabase(source / "objects", store=self.source)
+        self.target = ObjectStore(target / "objects") if target is not None else None
+
+    def target_has(self, sha: str) -> bool:
+        return self.target is not None and self.target.has(sha)
+
+    def common(self, haves: Iterable[str]) -> List[str]:
+        # the haves this side knows, the others can't help
+        return sorted({sha for sha in haves if self.source.has(sha)})
+
+    def missing_commits(
+        self, wants: Iterable[str], haves: Iterable[str] = ()
+    ) -> List[dict]:
+        """
+        :param haves: Commits the receiver has, those this side doesn't know are ignored.
+        :return: The parsed commits reachable from the wants and not from the haves, newest first.
+        """
+        # sha -> True once it is known to be on the receiving side
+        old: Dict[str, bool] = {}
+        commits: Dict[str, dict] = {}
+        heap: List[Tuple[int, str]] = []
+
+        def visit(sha: str, is_old: bool):
+            if sha in old:
+                if is_old and not old[sha]:
+                    mark_old(sha)
+                return
+            old[sha] = is_old or self.target_has(sha)
+            commit = self.source_db.read_commit(sha)
+            commit["sha"] = sha
+            commits[sha] = commit
+            heapq.heappush(heap, (-commit_time(commit["committer"]), sha))
+
+        def mark_old(start: str):
+            # an old commit was already walked as new, its walked ancestors are old as well
+            stack = [start]
+            while stack:
+                sha = stack.pop()
+                if old.get(sha) is False:
+                    old[sha] = True
+                    stack.extend(p for p in commits[sha]["parents"] if p in old)
+
+        for sha in self.common(haves):
+            visit(sha, True)
+        for sha in wants:
+            visit(sha, False)
+        walked = set()
+        while heap and any(not old[sha] for _, sha in heap):
+            _, sha = heapq.heappop(heap)
+            if sha in walked:
+                continue
+            walked.add(sha)
+            for parent in commits[sha]["parents"]:
+                visit(parent, old[sha])
+        return sorted(
+            (commits[sha] for sha in walked if not old[sha]),
+            key=lambda commit: -commit_time(commit["committer"]),
+        )
+
+    def missing_objects(
+        self, commits: List[dict], blob_limit: int | None = None
+    ) -> Tuple[List[str], Dict[str, str]]:
+        """
+        :param blob_limit: Size from which blobs are left out, None to send them all.
+        :return: (shas of the commits, trees and blobs the target lacks, path of every blob).
+        """
+        objects = [commit["sha"] for commit in commits]
+        names: Dict[str, str] = {}
+        seen = set()
+        for commit in commits:
+            bases = [
+                self.source_db.read_commit(parent)["tree"]
+                for parent in commit["parents"]
+            ]
+            stack = [(commit["tree"], bases, "")]
+            while stack:
+                tree, bases, prefix = stack.pop()
+                if tree in seen or tree in bases or self.target_has(tree):
+                    continue
+                seen.add(tree)
+                objects.append(tree)
+                # name -> sha of the entry in every parent, equal entries are skipped
+                base_entries: Dict[str, List[str]] = {}
+                for base in bases:
+                    for _, name, sha in self.source_db.read_tree(base):
+                        base_entries.setdefault(name, []).append(sha)
+                for mode, name, sha in self.source_db.read_tree(tree):
+                    in_bases = base_entries.get(name, [])
+                    if sha in in_bases or mode == "160000":
+                        continue
+                    if mode in ("40000", "040000"):
+                        stack.append((sha, in_bases, prefix + name + "/"))
+                    elif sha not in seen and not self.target_has(sha):
+                        seen.add(sha)
+                        if (
+                            blob_limit is not None
+                            and self.source.read_header(sha)[1] >= blob_limit
+                        ):
+                            continue
+                        objects.append(sha)
+                        names[sha] = prefix + name
+        return objects, names
+
+    def write(
+        self,
+        pack_dir: Path,
+        wants: Iterable[str],
+        haves: Iterable[str] = (),
+        blob_limit: int | None = None,
+    ) -> Tuple[Path | None, int]:
+        """
+        :return: (.idx of the written pack, None if nothing is missing, number of objects).
+        """
+        objects, names = self.missing_objects(
+            self.missing_commits(wants, haves), blob_limit
+        )
+        if not objects:
+            return None, 0
+        idx_path = write_pack(
+            pack_dir,
+            [(sha, *self.source.read_header(sha)) for sha in objects],
+            load=self.source.read,
+            names=names,
+        )
+        return idx_path, len(objects)
+
+    def write_objects(self, pack_dir: Path, hashes: List[str]) -> Path:
+        """
+        Packs the given objects alone, for a partial clone that found them missing.
+
+        :return: The .idx of the written pack.
+        """
+        # this side may be a partial clone too
+        self.source.fetch_missing(hashes)
+        for sha in hashes:
+            if not self.source.has(sha):
+                raise ValueError(f"Object {sha} not found")
+        return write_pack(
+            pack_dir,
+            [(sha, *self.source.read_header(sha)) for sha in hashes],
+            load=self.source.read,
+        )
+
+    def send(
+        self, wants: Iterable[str], blob_limit: int | None = None
+    ) -> Tuple[int, int]:
+        """
+        Writes the objects the target is missing into one pack of the target.
+
+        :return: (number of objects, pack size in bytes).
+        """
+        idx_path, count = self.write(self.target.pack_dir, wants, blob_limit=blob_limit)
+        if idx_path is None:
+            return 0, 0
+        # the target's saved presence sets don't know the pack yet
+        self.target.presence_path.unlink(missing_ok=True)
+        return count, idx_path.with_suffix(".pack").stat().st_size
+
+
+class Promisor:
+    """
+    The remote a partial clone was fetched from, which promises the objects left out.
+
+    Like in git, extensions.partialclone names it in the config, and the filter goes
+    in remote.<name>.partialclonefilter for the next fetches. Missing objects are
+    fetched from it by hash, each batch into one pack.
+    """
+
+    def __init__(self, pygit: Path, name: str) -> None:
+        self.pygit = pygit
+        self.name = name
+
+    @staticmethod
+    def of(pygit: Path) -> "Promisor | None":
+        name = Config(pygit / "config").get("extensions", None, "partialclone")
+        return Promisor(pygit, name) if name else None
+
+    @staticmethod
+    def record(pygit: Path, name: str, filter: str):
+        config = Config(pygit / "config")
+        current = config.get("extensions", None, "partialclone")
+        if current not in (None, name):
+            raise ValueError(
+                f"Objects are already promised by '{current}', only one remote can leave some out"
+            )
+        for section, subsection, key, value in (
+            ("remote", name, "promisor", "true"),
+            ("remote", name, "partialclonefilter", filter),
+            ("extensions", None, "partialclone", name),
+        ):
+            if config.get(section, subsection, key) != value:
+                config.set(section, subsection, key, value)
+
+    def fetch(self, pack_dir: Path, hashes: List[str]) -> Path:
+        """
+        :return: The .idx of the pack holding the objects.
+        """
+        remote = Remote(self.pygit)
+        url = remote.url(self.name)
+        if not protocol.is_url(url):
+            return PackTransfer(remote.path(self.name)).write_objects(pack_dir, hashes)
+        with protocol.Connection(url) as conn:
+            pack_path, _ = conn.fetch_objects(hashes, pack_dir)
+        try:
+            return index_pack(pack_path)[0]
+        except BaseException:
+            pack_path.unlink(missing_ok=True)
+            raise
+
+
+class Fetch:
+    """
+    Brings the branches and tags of a remote over, as refs/remotes/<remote>/<branch>.
+
+    A remote on the local disk is read directly, one with a pygit:// or unix: url
+    is asked through 'pygit serve'. With a filter the fetch is partial: big blobs,
+    or all of them, stay on the remote, which becomes the promisor of the repository.
+    """
+
+    def __init__(self, pygit: Path) -> None:
+        self.pygit = pygit
+        self.refs = Refs(pygit)
+
+    def fetch(self, name: str = "origin", filter: str | None = None):
+        """
+        :param filter: "blob:none" or "blob:limit=<n>[kmg]", the remote's own filter by
+            default if it is the promisor remote.
+        """
+        remote = Remote(self.pygit)
+        url = remote.url(name)
+        if filter is None:
+            filter = remote.config.get("remote", name, "partialclonefilter")
+        blob_limit = parse_filter(filter) if filter is not None else None
+        if filter is not None:
+            # recorded first, objects are missing as soon as the pack is in
+            Promisor.record(self.pygit, name, filter)
+        if protocol.is_url(url):
+            remote_refs, count, size = self.fetch_url(url, filter)
+        else:
+            remote_path = remote.path(name)
+            remote_refs = dict(Refs(remote_path).iter_refs())
+            count, size = PackTransfer(remote_path, self.pygit).send(
+                remote_refs.values(), blob_limit
+            )
+        if count:
+            print(f"Received {count} objects, {size} bytes")
+
+        updates = []
+        for ref, sha in remote_refs.items():
+            if ref.startswith("refs/heads/"):
+                branch = ref[len("refs/heads/") :]
+                local = f"refs/remotes/{name}/{branch}"
+                shown = branch, f"{name}/{branch}"
+            elif ref.startswith("refs/tags/"):
+                local = ref
+                shown = ref[len("refs/tags/") :], ref[len("refs/tags/") :]
+            else:
+                continue
+            old = self.refs.read_ref(local)
+            if old == sha:
+                continue
+            if old is not None and local.startswith("refs/tags/"):
+                # tags don't move, a tag that differs is kept as it is
+                updates.append(
+                    f" ! [rejected]        {shown[0]} -> {shown[1]} (would clobber existing tag)"
+                )
+                continue
+            self.refs.update_ref(local, sha, f"fetch {name}: storing head")
+            if old is None:
+                kind = "tag" if local.startswith("refs/tags/") else "branch"
+                updates.append(f" * [new {kind}]      {shown[0]} -> {shown[1]}")
+            else:
+                updates.append(f"   {old[:7]}..{sha[:7]}  {shown[0]} -> {shown[1]}")
+        if updates:
+            print(f"From {remote.url(name)}")
+            for line in updates:
+                print(line)
+
+    def fetch_url(
+        self, url: str, filter: str | None = None
+    ) -> Tuple[Dict[str, str], int, int]:
+        """
+        Asks a pygit server for its refs and the objects of those this side lacks.
+
+        :return: (ref -> sha of the server, number of objects received, pack size in bytes).
+        """
+        store = ObjectStore(self.pygit / "objects")
+        with protocol.Connection(url) as conn:
+            remote_refs = conn.ls_refs()
+            wants = sorted({sha for sha in remote_refs.values() if not store.has(sha)})
+            if not wants:
+                return remote_refs, 0, 0
+            haves = sorted({sha for _, sha in self.refs.iter_refs()})
+            pack_path, size = conn.fetch(wants, haves, store.pack_dir, filter)
+        if pack_path is None:
+            return remote_refs, 0, 0
+        try:
+            _, count = index_pack(pack_path)
+        except BaseException:
+            pack_path.unlink(missing_ok=True)
+            raise
+        store.presence_path.unlink(missing_ok=True)
+        return remote_refs, count, size
+
+
+class Push:
+    """
+    Sends a branch to a remote, like git push <remote> <branch>.
+
+    Only a fast-forward is accepted, and the branch that is checked out in a
+    remote with a working tree isn't updated, like git's receive.denyCurrentBranch.
+    """
+
+    def __init__(self, pygit: Path) -> None:
+        self.pygit = pygit
+        self.refs = Refs(pygit)
+
+    def push(self, name: str = "origin", branch: str | None = None):
+        branch = branch or self.refs.current_branch()
+        if branch is None:
+            raise ValueError(
+                "You are not currently on a branch, name the branch to push"
+            )
+        ref = f"refs/heads/{branch}"
+        sha = self.refs.read_ref(ref)
+        if sha is None:
+            raise ValueError(f"src refspec {branch} does not match any")
+
+        remote = Remote(self.pygit)
+        if protocol.is_url(remote.url(name)):
+            raise ValueError(
+                f"Unable to push to {remote.url(name)}, pygit serve only serves fetches"
+            )
+        remote_path = remote.path(name)
+        remote_refs = Refs(remote_path)
+        old = remote_refs.read_ref(ref)
+        print(f"To {remote.url(name)}")
+        if old == sha:
+            print("Everything up-to-date")
+            return
+        if old is not None and not (
+            ObjectStore(self.pygit / "objects").has(old)
+            and History(self.pygit).is_ancestor(old, sha)
+        ):
+            print(f" ! [rejected]        {branch} -> {branch} (non-fast-forward)")
+            raise ValueError(
+                "Updates were rejected because the remote contains work that you do not have, fetch it first"
+            )
+        if remote_path.name == ".pygit" and remote_refs.read_head() == ref:
+            print(
+                f" ! [remote rejected] {branch} -> {branch} (branch is currently checked out)"
+            )
+            raise ValueError(f"refusing to update checked out branch: {ref}")
+
+        count, size = PackTransfer(self.pygit, remote_path).send([sha])
+        if count:
+            print(f"Sent {count} objects, {size} bytes")
+        remote_refs.update_ref(ref, sha, "push", old=old or ZERO_SHA)
+        self.refs.update_ref(f"refs/remotes/{name}/{branch}", sha, "update by push")
+        if old is None:
+            print(f" * [new branch]      {branch} -> {branch}")
+        else:
+            print(f"   {old[:7]}..{sha[:7]}  {branch} -> {branch}")
@@ -0,0 +1,437 @@
+# line diff of two blobs: Myers in linear space, histogram, and unified hunks
+from typing import Dict, Iterator, List, Tuple
+
+ALGORITHMS = ("myers", "histogram")
+# above this many bytes on both sides together the content isn't compared line by line
+DIFF_MAX_BYTES = 64 << 20
+# minimum of the edit cost after which Myers settles for a good split instead of the best one
+MIN_COST = 256
+# histogram diff falls back to Myers when every common line occurs more often than this
+MAX_CHAIN = 64
+# steps all searches of one diff may take, past it the ranges left are changed as a whole
+MAX_WORK = 1_000_000
+# more steps for every line diffed, splitting a large file down to its changes takes more work
+WORK_PER_LINE = 32
+# longest function heading shown after a hunk range, in bytes
+HEADING_MAX = 80
+
+# a changed region: lines a[a_lo:a_hi] are replaced by b[b_lo:b_hi]
+Block = Tuple[int, int, int, int]
+
+
+def intern_lines(a: List[bytes], b: List[bytes]) -> Tuple[List[int], List[int]]:
+    """
+    Replaces every line by a small int, equal lines get the same one.
+
+    The algorithms then compare ints instead of byte strings of any length.
+    """
+    ids: Dict[bytes, int] = {}
+    a_ids = [ids.setdefault(line, len(ids)) for line in a]
+    b_ids = [ids.setdefault(line, len(ids)) for line in b]
+    return a_ids, b_ids
+
+
+def work_budget(lines: int) -> List[int]:
+    # one-element list with the steps left, shared by all searches of a diff
+    return [MAX_WORK + WORK_PER_LINE * lines]
+
+
+def trim(
+    a: List[int], b: List[int], a_lo: int, a_hi: int, b_lo: int, b_hi: int
+) -> Block:
+    # the common prefix and suffix are never part of a change
+    while a_lo < a_hi and b_lo < b_hi and a[a_lo] == b[b_lo]:
+        a_lo += 1
+        b_lo += 1
+    while a_lo < a_hi and b_lo < b_hi and a[a_hi - 1] == b[b_hi - 1]:
+        a_hi -= 1
+        b_hi -= 1
+    return a_lo, a_hi, b_lo, b_hi
+
+
+def middle_snake(
+    a: List[int],
+    b: List[int],
+    a_lo: int,
+    a_hi: int,
+    b_lo: int,
+    b_hi: int,
+    max_cost: int,
+    budget: List[int],
+) -> Tuple[int, int, int, int]:
+    """
+    Finds the middle snake of Myers' linear space refinement.
+
+    The forward and the backward search run until they overlap, the diagonal they
+    meet on splits the problem in two halves. Past max_cost the search gives up on
+    the shortest script and splits at the furthest forward point instead, so the
+    cost of a pathological input stays bounded.
+
+    :param budget: One-element list with the steps left, decremented by the search.
+    :return: (x, y, u, v), the snake from (x, y) to (u, v), relative to a_lo and b_lo.
+    """
+    n = a_hi - a_lo
+    m = b_hi - b_lo
+    delta = n - m
+    odd = delta & 1
+    # forward is indexed by diagonal, backward by diagonal - delta, both stay within the cost
+    limit = min((n + m + 1) // 2, max_cost) + 1
+    offset = limit + 1
+    forward = [0] * (2 * offset + 1)
+    backward = [0] * (2 * offset + 1)
+    forward[offset + 1] = 0
+    backward[offset - 1] = n
+
+    for d in range(limit):
+        budget[0] -= 2 * d + 2
+        for k in range(-d, d + 1, 2):
+            if k == -d or (
+                k != d and forward[offset + k - 1] < forward[offset + k + 1]
+            ):
+                x = forward[offset + k + 1]
+            else:
+                x = forward[offset + k - 1] + 1
+            y = x - k
+            start_x, start_y = x, y
+            while x < n and y < m and a[a_lo + x] == b[b_lo + y]:
+                x += 1
+                y += 1
+            forward[offset + k] = x
+            if odd and delta - (d - 1) <= k <= delta + (d - 1):
+                if x >= backward[offset + k - delta]:
+                    return start_x, start_y, x, y
+
+        for k in range(-d, d + 1, 2):
+            if k == d or (
+                k != -d and backward[offset + k - 1] < backward[offset + k + 1]
+            ):
+                x = backward[offset + k - 1]
+            else:
+                x = backward[offset + k + 1] - 1
+            y = x - k - delta
+            end_x, end_y = x, y
+            while x > 0 and y > 0 and a[a_lo + x - 1] == b[b_lo + y - 1]:
+                x -= 1
+                y -= 1
+            backward[offset + k] = x
+            if not odd and -d <= k + delta <= d:
+                if x <= forward[offset + k + delta]:
+                    return x, y, end_x, end_y
+
+        if d >= max_cost or budget[0] <= 0:
+            # good enough: split where the forward search got furthest
+            best = max(
+                range(-d, d + 1, 2),
+                key=lambda k: 2 * forward[offset + k] - k,
+            )
+            x = min(forward[offset + best], n)
+            y = min(max(x - best, 0), m)
+            return x, y, x, y
+
+    # not reached, the searches always overlap by then
+    return n, m, n, m
+
+
+def myers(
+    a: List[int],
+    b: List[int],
+    a_lo: int,
+    a_hi: int,
+    b_lo: int,
+    b_hi: int,
+    max_cost: int | None = None,
+    budget: List[int] | None = None,
+) -> List[Block]:
+    """
+    :param budget: One-element list with the steps left, shared by all searches of a diff.
+    :return: The changed blocks between a[a_lo:a_hi] and b[b_lo:b_hi], unsorted.
+    """
+    if budget is None:
+        budget = work_budget(a_hi - a_lo + b_hi - b_lo)
+    if max_cost is None:
+        max_cost = max(MIN_COST, int((a_hi - a_lo + b_hi - b_lo) ** 0.5))
+    blocks: List[Block] = []
+    # an explicit stack, the split depth can get close to the number of changes
+    stack = [(a_lo, a_hi, b_lo, b_hi)]
+    while stack:
+        a_lo, a_hi, b_lo, b_hi = trim(a, b, *stack.pop())
+        if a_lo == a_hi or b_lo == b_hi:
+            if a_lo != a_hi or b_lo != b_hi:
+                blocks.append((a_lo, a_hi, b_lo, b_hi))
+            continue
+        if budget[0] <= 0:
+            blocks.append((a_lo, a_hi, b_lo, b_hi))
+            continue
+        x, y, u, v = middle_snake(a, b, a_lo, a_hi, b_lo, b_hi, max_cost, budget)
+        if (x == u == 0 and y == v == 0) or (
+            x == u == a_hi - a_lo and y == v == b_hi - b_lo
+        ):
+            # no split point inside the range, all of it is one change
+            blocks.append((a_lo, a_hi, b_lo, b_hi))
+            continue
+        stack.append((a_lo + u, a_hi, b_lo + v, b_hi))
+        stack.append((a_lo, a_lo + x, b_lo, b_lo + y))
+    return blocks
+
+
+def histogram(
+    a: List[int],
+    b: List[int],
+    a_lo: int,
+    a_hi: int,
+    b_lo: int,
+    b_hi: int,
+    budget: List[int] | None = None,
+) -> List[Block]:
+    """
+    Histogram diff, git's refinement of patience diff.
+
+    The lines of a that occur least often are the anchors: the longest common run
+    around the rarest line shared by both sides is kept, and both sides of it are
+    diffed the same way. Ranges without a usable anchor are handed to Myers, and so
+    are the ranges left once the budget runs out, Myers on a budget of its own still
+    finds scattered changes where another split would cost too much.
+
+    :return: The changed blocks between a[a_lo:a_hi] and b[b_lo:b_hi], unsorted.
+    """
+    if budget is None:
+        budget = work_budget(a_hi - a_lo + b_hi - b_lo)
+    fallback: List[int] | None = None
+    blocks: List[Block] = []
+    stack = [(a_lo, a_hi, b_lo, b_hi)]
+    while stack:
+        a_lo, a_hi, b_lo, b_hi = trim(a, b, *stack.pop())
+        if a_lo == a_hi or b_lo == b_hi:
+            if a_lo != a_hi or b_lo != b_hi:
+                blocks.append((a_lo, a_hi, b_lo, b_hi))
+            continue
+        if budget[0] <= 0:
+            if fallback is None:
+                fallback = work_budget(len(a) + len(b))
+            blocks.extend(myers(a, b, a_lo, a_hi, b_lo, b_hi, budget=fallback))
+            continue
+        budget[0] -= a_hi - a_lo + b_hi - b_lo
+
+        occurrences: Dict[int, List[int]] = {}
+        for i in range(a_lo, a_hi):
+            occurrences.setdefault(a[i], []).append(i)
+
+        best = None
+        best_count = MAX_CHAIN + 1
+        j = b_lo
+        while j < b_hi:
+            positions = occurrences.get(b[j])
+            if positions is None or len(positions) > best_count:
+                j += 1
+                continue
+            next_j = j + 1
+            for i in positions:
+                # extend the match around (i, j) in both directions
+                start_i, start_j = i, j
+                while (
+                    start_i > a_lo
+                    and start_j > b_lo
+                    and a[start_i - 1] == b[start_j - 1]
+                ):
+                    start_i -= 1
+                    start_j -= 1
+                end_i, end_j = i + 1, j + 1
+                count = len(positions)
+                while end_i < a_hi and end_j < b_hi and a[end_i] == b[end_j]:
+                    count = min(count, len(occurrences[a[end_i]]))
+                    end_i += 1
+                    end_j += 1
+                length = end_i - start_i
+                budget[0] -= length
+                if (
+                    best is None
+                    or count < best_count
+                    or (count == best_count and length > best[2] - best[0])
+                ):
+                    best = (start_i, start_j, end_i, end_j)
+                    best_count = count
+                next_j = max(next_j, end_j)
+            j = next_j
+
+        if best is None:
+            blocks.extend(myers(a, b, a_lo, a_hi, b_lo, b_hi, budget=budget))
+            continue
+        start_i, start_j, end_i, end_j = best
+        stack.append((end_i, a_hi, end_j, b_hi))
+        stack.append((a_lo, start_i, b_lo, start_j))
+    return blocks
+
+
+def diff_lines(a: List[bytes], b: List[bytes], algorithm: str = "myers") -> List[Block]:
+    """
+    :param a: Old lines.
+    :param b: New lines.
+    :param algorithm: "myers" or "histogram".
+    :return: The changed blocks, sorted, adjacent ones merged.
+    """
+    a_ids, b_ids = intern_lines(a, b)
+    # a line that only one side has is changed for sure, only the others are compared
+    in_a = set(a_ids)
+    in_b = set(b_ids)
+    a_keep = [i for i, line in enumerate(a_ids) if line in in_b]
+    b_keep = [j for j, line in enumerate(b_ids) if line in in_a]
+    a_kept = [a_ids[i] for i in a_keep]
+    b_kept = [b_ids[j] for j in b_keep]
+
+    if algorithm == "histogram":
+        blocks = histogram(a_kept, b_kept, 0, len(a_kept), 0, len(b_kept))
+    elif algorithm == "myers":
+        blocks = myers(a_kept, b_kept, 0, len(a_kept), 0, len(b_kept))
+    else:
+        raise ValueError(f"Unknown diff algorithm {algorithm!r}")
+
+    # the kept lines outside of the blocks are the matches, the changes are the gaps between them
+    merged: List[Block] = []
+    i = j = 0
+    last_a = last_b = 0
+    for a_lo, a_hi, b_lo, b_hi in sorted(blocks) + [(len(a_kept), 0, len(b_kept), 0)]:
+        while i < a_lo:
+            a_pos, b_pos = a_keep[i], b_keep[j]
+            if a_pos > last_a or b_pos > last_b:
+                merged.append((last_a, a_pos, last_b, b_pos))
+            last_a, last_b = a_pos + 1, b_pos + 1
+            i += 1
+            j += 1
+        i, j = a_hi, b_hi
+    if last_a < len(a) or last_b < len(b):
+        merged.append((last_a, len(a), last_b, len(b)))
+    return slide_down(a_ids, b_ids, merged)
+
+
+def slide_down(a: List[int], b: List[int], blocks: List[Block]) -> List[Block]:
+    """
+    Moves every pure insertion or deletion as far down as equal lines allow.
+
+    Where the same lines repeat, several positions make an equally short diff, git
+    shows the last one and so does this.
+    """
+    slid: List[Block] = []
+    for i, (a_lo, a_hi, b_lo, b_hi) in enumerate(blocks):
+        next_a, next_b = (
+            (blocks[i + 1][0], blocks[i + 1][2])
+            if i + 1 < len(blocks)
+            else (len(a), len(b))
+        )
+        if b_lo == b_hi:
+            while a_hi < next_a and a[a_lo] == a[a_hi]:
+                a_lo, a_hi, b_lo, b_hi = a_lo + 1, a_hi + 1, b_lo + 1, b_hi + 1
+        elif a_lo == a_hi:
+            while b_hi < next_b and b[b_lo] == b[b_hi]:
+                a_lo, a_hi, b_lo, b_hi = a_lo + 1, a_hi + 1, b_lo + 1, b_hi + 1
+        if slid and slid[-1][1] == a_lo and slid[-1][3] == b_lo:
+            # slid into the one before, they are a single change now
+            slid[-1] = (slid[-1][0], a_hi, slid[-1][2], b_hi)
+        elif i + 1 < len(blocks) and (a_hi, b_hi) == (next_a, next_b):
+            blocks[i + 1] = (a_lo, blocks[i + 1][1], b_lo, blocks[i + 1][3])
+        else:
+            slid.append((a_lo, a_hi, b_lo, b_hi))
+    return slid
+
+
+def diff_bytes(
+    before: bytes,
+    after: bytes,
+    algorithm: str = "myers",
+    max_bytes: int = DIFF_MAX_BYTES,
+) -> Tuple[List[bytes], List[bytes], List[Block]]:
+    """
+    Splits two contents into lines and diffs them.
+
+    Past max_bytes the contents aren't compared at all, the whole old content is one
+    change into the whole new one.
+
+    :return: (old lines, new lines, changed blocks).
+    """
+    a = split_lines(before)
+    b = split_lines(after)
+    if len(before) + len(after) > max_bytes:
+        return a, b, [(0, len(a), 0, len(b))] if a != b else []
+    return a, b, diff_lines(a, b, algorithm)
+
+
+def split_lines(content: bytes) -> List[bytes]:
+    # only "\n" ends a line, like in git, a lone "\r" stays part of it
+    lines = content.split(b"\n")
+    last = lines.pop()
+    lines = [line + b"\n" for line in lines]
+    if last:
+        lines.append(last)
+    return lines
+
+
+def count_changes(blocks: List[Block]) -> Tuple[int, int]:
+    """
+    :return: (inserted, deleted) lines.
+    """
+    inserted = sum(b_hi - b_lo for _, _, b_lo, b_hi in blocks)
+    deleted = sum(a_hi - a_lo for a_lo, a_hi, _, _ in blocks)
+    return inserted, deleted
+
+
+def unified_hunks(
+    a: List[bytes], b: List[bytes], blocks: List[Block], context: int = 3
+) -> Iterator[bytes]:
+    """
+    Formats the changes as the hunks of a unified diff, one output line at a time.
+
+    Blocks closer than twice the context share a hunk, like git and diff -u do.
+    """
+    heading = b""
+    scanned = 0
+    i = 0
+    while i < len(blocks):
+        # the blocks of this hunk
+        j = i
+        while j + 1 < len(blocks) and blocks[j + 1][0] - blocks[j][1] <= 2 * context:
+            j += 1
+        a_start = max(blocks[i][0] - context, 0)
+        b_start = max(blocks[i][2] - context, 0)
+        a_end = min(blocks[j][1] + context, len(a))
+        b_end = min(blocks[j][3] + context, len(b))
+        # the hunks come in order, so the lines before one are only scanned once
+        for line in a[scanned:a_start]:
+            if is_heading(line):
+                heading = line[:HEADING_MAX].rstrip()
+        scanned = max(scanned, a_start)
+        yield (
+            f"@@ -{hunk_range(a_start, a_end - a_start)} "
+            f"+{hunk_range(b_start, b_end - b_start)} @@"
+        ).encode("utf-8") + (b" " + heading if heading else b"") + b"\n"
+
+        position = a_start
+        for a_lo, a_hi, b_lo, b_hi in blocks[i : j + 1]:
+            for line in a[position:a_lo]:
+                yield from with_newline(b" ", line)
+            for line in a[a_lo:a_hi]:
+                yield from with_newline(b"-", line)
+            for line in b[b_lo:b_hi]:
+                yield from with_newline(b"+", line)
+            position = a_hi
+        for line in a[position:a_end]:
+            yield from with_newline(b" ", line)
+        i = j + 1
+
+
+def hunk_range(start: int, length: int) -> str:
+    # lines count from 1, an empty range names the line before it
+    if length == 1:
+        return str(start + 1)
+    return f"{start + 1 if length else start},{length}"
+
+
+def is_heading(line: bytes) -> bool:
+    # git's default function line: one that starts with a letter, "_" or "$"
+    return line[:1].isalpha() or line[:1] in (b"_", b"$")
+
+
+def with_newline(prefix: bytes, line: bytes) -> Iterator[bytes]:
+    if line.endswith(b"\n"):
+        yield prefix + line
+    else:
+        yield prefix + line + b"\n"
+        yield b"\\ No newline at end of file\n"
@@ -1,5 +1,10 @@
 import argparse
+import sys
 
+import tracing
+from lib import PRUNE_EXPIRE
+from linediff import ALGORITHMS
+from protocol import DEFAULT_PORT
 from pygit import pygit
 
 
@@ -8,6 +13,23 @@ def main():
     git = pygit()
 
     parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--trace",
+        metavar="FILE",
+        help="record spans, timers and counters of the run into FILE, '2' for stderr,"
+        f" like ${tracing.TRACE_ENV}",
+    )
+    parser.add_argument(
+        "--trace-format",
+        choices=tracing.FORMATS,
+        help="jsonl lines appended to the file or a chrome trace,"
+        " chrome by default for a .json file",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="FILE",
+        help=f"dump cProfile stats of the run into FILE, like ${tracing.PROFILE_ENV}",
+    )
     subParser = parser.add_subparsers(dest="command")
 
     subParser.add_parser("init", help="Initialize the pygit")
@@ -16,20 +38,251 @@ def main():
     addParser.add_argument(
         "files", nargs="+", help="give the files names or '.' for all files"
     )
+    addParser.add_argument(
+        "-j", "--jobs", type=int, help="number of files hashed in parallel"
+    )
 
     commitParser = subParser.add_parser("commit", help="commit the current stage")
     commitParser.add_argument(
         "-m", nargs=1, type=str, help="Give the message for commit", required=True
     )
 
+    logParser = subParser.add_parser("log", help="show the commit history")
+    logParser.add_argument(
+        "rev", nargs="?", default="HEAD", help="commit to start from"
+    )
+    logParser.add_argument("-n", type=int, help="show only the first n commits")
+    logParser.add_argument(
+        "--oneline", action="store_true", help="short sha and title of every commit"
+    )
+
+    diffParser = subParser.add_parser(
+        "diff", help="show the changes between commits, the index and the working tree"
+    )
+    diffParser.add_argument(
+        "revs",
+        nargs="*",
+        help="none: index to working tree, one: commit to working tree, two: commit to commit",
+    )
+    diffParser.add_argument(
+        "--cached",
+        "--staged",
+        action="store_true",
+        help="compare a commit, HEAD by default, with the index",
+    )
+    diffFormat = diffParser.add_mutually_exclusive_group()
+    diffFormat.add_argument(
+        "--name-status", action="store_true", help="status and path of every change"
+    )
+    diffFormat.add_argument(
+        "--stat", action="store_true", help="changed lines per file"
+    )
+    diffParser.add_argument(
+        "--diff-algorithm",
+        choices=ALGORITHMS,
+        default="myers",
+        help="how the lines of a changed file are matched",
+    )
+    diffParser.add_argument(
+        "--histogram",
+        dest="diff_algorithm",
+        action="store_const",
+        const="histogram",
+        help="same as --diff-algorithm=histogram",
+    )
+    diffParser.add_argument(
+        "-U", "--unified", type=int, default=3, help="lines of context around a change"
+    )
+    diffParser.add_argument(
+        "-j", "--jobs", type=int, help="number of directories scanned in parallel"
+    )
+
+    mergeBaseParser = subParser.add_parser(
+        "merge-base", help="best common ancestor of two commits"
+    )
+    mergeBaseParser.add_argument("one")
+    mergeBaseParser.add_argument("two")
+    mergeBaseParser.add_argument(
+        "--is-ancestor",
+        action="store_true",
+        help="exit with 0 if the first commit is an ancestor of the second",
+    )
+
+    graphParser = subParser.add_parser(
+        "commit-graph", help="write the commit-graph file for fast history walks"
+    )
+    graphParser.add_argument("action", choices=["write"])
+
+    checkoutParser = subParser.add_parser(
+        "checkout", help="switch the working tree and the index to a branch or commit"
+    )
+    checkoutParser.add_argument("rev", help="branch to switch to, or a commit")
+    checkoutParser.add_argument(
+        "-j", "--jobs", type=int, help="number of files written in parallel"
+    )
+
+    statusParser = subParser.add_parser(
+        "status", help="show the staged, unstaged and untracked changes"
+    )
+    statusParser.add_argument(
+        "-s", "--short", action="store_true", help="one line per changed path"
+    )
+    statusParser.add_argument(
+        "-j", "--jobs", type=int, help="number of directories scanned in parallel"
+    )
+
+    fsmonitorParser = subParser.add_parser(
+        "fsmonitor",
+        help="background daemon that tells add and status which paths changed",
+    )
+    fsmonitorParser.add_argument("action", choices=["start", "stop", "status"])
+
+    remoteParser = subParser.add_parser(
+        "remote", help="list, add or remove remote repositories"
+    )
+    remoteParser.add_argument("action", nargs="?", choices=["add", "remove"])
+    remoteParser.add_argument("name", nargs="?")
+    remoteParser.add_argument(
+        "url",
+        nargs="?",
+        help="path of the remote repository, or pygit://host:port or unix:/path of a pygit serve",
+    )
+    remoteParser.add_argument(
+        "-v", "--verbose", action="store_true", help="show the url of every remote"
+    )
+
+    fetchParser = subParser.add_parser(
+        "fetch", help="download the branches and tags of a remote"
+    )
+    fetchParser.add_argument("remote", nargs="?", default="origin")
+    fetchParser.add_argument(
+        "--filter",
+        help="blob:none or blob:limit=<n>[kmg], blobs left on the remote and fetched when needed",
+    )
+
+    pushParser = subParser.add_parser("push", help="update a branch of a remote")
+    pushParser.add_argument("remote", nargs="?", default="origin")
+    pushParser.add_argument(
+        "branch", nargs="?", help="branch to push, the current one by default"
+    )
+
+    serveParser = subParser.add_parser(
+        "serve", help="serve the refs and objects of this repository to fetches"
+    )
+    serveParser.add_argument("--host", default="localhost", help="address to listen on")
+    serveParser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    serveParser.add_argument(
+        "--socket", help="listen on a Unix socket at this path instead of TCP"
+    )
+    serveParser.add_argument(
+        "-j", "--jobs", type=int, help="number of packs built in parallel"
+    )
+
+    gcParser = subParser.add_parser(
+        "gc", help="pack the loose objects into a single pack"
+    )
+    gcParser.add_argument(
+        "--window",
+        type=int,
+        help="number of objects tried as a delta base, 0 disables deltas",
+    )
+    gcParser.add_argument("--depth", type=int, help="longest allowed delta chain")
+    gcParser.add_argument(
+        "--prune",
+        nargs="?",
+        const=PRUNE_EXPIRE,
+        metavar="DATE",
+        help="delete the unreachable loose objects older than DATE"
+        f" ({PRUNE_EXPIRE} by default, 'now' for all of them)",
+    )
+    gcParser.add_argument(
+        "-j", "--jobs", type=int, help="number of object directories swept in parallel"
+    )
+
+    catParser = subParser.add_parser("cat-file", help="print objects from the database")
+    catParser.add_argument("object", nargs="?", help="sha-1 of the object")
+    catOption = catParser.add_mutually_exclusive_group()
+    catOption.add_argument(
+        "-t", dest="option", action="store_const", const="-t", help="print the type"
+    )
+    catOption.add_argument(
+        "-s", dest="option", action="store_const", const="-s", help="print the size"
+    )
+    catOption.add_argument(
+        "-p", dest="option", action="store_const", const="-p", help="print the content"
+    )
+    catOption.add_argument(
+        "--batch",
+        action="store_true",
+        help="read object names from stdin, print header and content",
+    )
+    catOption.add_argument(
+        "--batch-check",
+        action="store_true",
+        help="read object names from stdin, print the header",
+    )
+
     args = parser.parse_args()
+    if args.trace or args.profile:
+        tracing.start(args.trace, args.trace_format, args.profile)
+    else:
+        tracing.start_from_env()
 
     if args.command == "init":
         git.init()
     elif args.command == "add":
-        git.add(files=args.files)
+        git.add(files=args.files, jobs=args.jobs)
     elif args.command == "commit":
         git.commit(message=args.m[0])
+    elif args.command == "log":
+        git.log(rev=args.rev, count=args.n, oneline=args.oneline)
+    elif args.command == "diff":
+        if len(args.revs) > 2 or (args.cached and len(args.revs) > 1):
+            parser.error("diff takes at most two commits, or one with --cached")
+        git.diff(
+            args.revs,
+            cached=args.cached,
+            name_status=args.name_status,
+            stat=args.stat,
+            algorithm=args.diff_algorithm,
+            context=args.unified,
+            jobs=args.jobs,
+        )
+    elif args.command == "merge-base":
+        sys.exit(git.merge_base(args.one, args.two, is_ancestor=args.is_ancestor))
+    elif args.command == "commit-graph":
+        git.commit_graph()
+    elif args.command == "checkout":
+        git.checkout(args.rev, jobs=args.jobs)
+    elif args.command == "status":
+        git.status(short=args.short, jobs=args.jobs)
+    elif args.command == "fsmonitor":
+        git.fsmonitor(action=args.action)
+    elif args.command == "cat-file":
+        git.cat_file(
+            obj=args.object,
+            option=args.option or "-p",
+            batch=args.batch,
+            batch_check=args.batch_check,
+        )
+    elif args.command == "remote":
+        if args.action == "add" and (args.name is None or args.url is None):
+            parser.error("remote add takes a name and a url")
+        if args.action == "remove" and args.name is None:
+            parser.error("remote remove takes a name")
+        git.remote(
+            action=args.action, name=args.name, url=args.url, verbose=args.verbose
+        )
+    elif args.command == "fetch":
+        git.fetch(remote=args.remote, filter=args.filter)
+    elif args.command == "push":
+        sys.exit(git.push(remote=args.remote, branch=args.branch))
+    elif args.command == "serve":
+        git.serve(
+            host=args.host, port=args.port, socket_path=args.socket, jobs=args.jobs
+        )
+    elif args.command == "gc":
+        git.gc(window=args.window, depth=args.depth, prune=args.prune, jobs=args.jobs)
 
 
 # print("Hello from python!")
@@ -0,0 +1,785 @@
+# packfiles: many objects in a single .pack, found through a .idx with a fan-out table
+import binascii
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import zlib
+from collections import OrderedDict, deque
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Tuple
+
+# object type numbers used in the pack entry headers
+OBJ_TYPES = {1: "commit", 2: "tree", 3: "blob", 4: "tag"}
+OBJ_TYPE_NUMBERS = {name: number for number, name in OBJ_TYPES.items()}
+# delta entries, against a base at a relative offset in the same pack or a base named by its sha
+OFS_DELTA = 6
+REF_DELTA = 7
+
+PACK_SIGNATURE = b"PACK"
+PACK_VERSION = 2
+IDX_SIGNATURE = b"\377tOc"
+IDX_VERSION = 2
+# compressed data is fed to zlib from the mmap in slices of this size
+PACK_READ_CHUNK = 1 << 16
+# inflated objects kept per pack, so delta chains don't rebuild their bases every time
+BASE_CACHE_BYTES = 32 << 20
+
+# number of recent objects tried as a delta base, and the longest allowed delta chain
+DELTA_WINDOW = 10
+DELTA_DEPTH = 50
+# the base is indexed in blocks of this many bytes, shorter matches are inserted literally
+DELTA_BLOCK = 16
+# objects smaller than this aren't worth a delta
+DELTA_MIN_SIZE = 64
+# copy instructions hold at most 3 size bytes
+DELTA_MAX_COPY = 0xFFFFFF
+
+
+def encode_entry_header(type_number: int, size: int) -> bytes:
+    # type in bits 4-6 of the first byte, the size in 4 bits and then 7 bits per byte, msb set while more follow
+    out = bytearray()
+    byte = (type_number << 4) | (size & 0x0F)
+    size >>= 4
+    while size:
+        out.append(byte | 0x80)
+        byte = size & 0x7F
+        size >>= 7
+    out.append(byte)
+    return bytes(out)
+
+
+def encode_varint(value: int) -> bytes:
+    # little-endian groups of 7 bits, msb set while more follow, as used in delta headers
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def decode_varint(data: bytes, pos: int) -> Tuple[int, int]:
+    value = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            return value, pos
+
+
+def encode_ofs_delta_offset(offset: int) -> bytes:
+    # big-endian groups of 7 bits where every continuation adds one, git's OFS_DELTA encoding
+    out = bytearray([offset & 0x7F])
+    offset >>= 7
+    while offset:
+        offset -= 1
+        out.insert(0, 0x80 | (offset & 0x7F))
+        offset >>= 7
+    return bytes(out)
+
+
+def name_hash(name: str) -> int:
+    # git's pack name hash, the last characters weigh the most so files with the same suffix sort together
+    hash = 0
+    for c in name:
+        if c.isspace():
+            continue
+        hash = ((hash >> 2) + (ord(c) << 24)) & 0xFFFFFFFF
+    return hash
+
+
+def match_length(a: bytes, a_start: int, b: bytes, b_start: int) -> int:
+    """
+    :return: Number of equal bytes in a and b from the given starts on.
+    """
+    limit = min(len(a) - a_start, len(b) - b_start)
+    length = 0
+    step = 256
+    while length < limit:
+        n = min(step, limit - length)
+        if (
+            a[a_start + length : a_start + length + n]
+            == b[b_start + length : b_start + length + n]
+        ):
+            length += n
+            step *= 2
+            continue
+        # the mismatch is inside this slice, find it byte by byte
+        while a[a_start + length] == b[b_start + length]:
+            length += 1
+        break
+    return length
+
+
+def emit_insert(out: bytearray, literal: bytes):
+    for start in range(0, len(literal), 127):
+        chunk = literal[start : start + 127]
+        out.append(len(chunk))
+        out += chunk
+
+
+def emit_copy(out: bytearray, offset: int, size: int):
+    while size:
+        n = min(size, DELTA_MAX_COPY)
+        op = 0x80
+        args = bytearray()
+        for i in range(4):
+            byte = (offset >> (8 * i)) & 0xFF
+            if byte:
+                op |= 1 << i
+                args.append(byte)
+        for i in range(3):
+            byte = (n >> (8 * i)) & 0xFF
+            if byte:
+                op |= 0x10 << i
+                args.append(byte)
+        out.append(op)
+        out += args
+        offset += n
+        size -= n
+
+
+def create_delta(
+    base: bytes, target: bytes, max_size: int | None = None
+) -> bytes | None:
+    """
+    Encodes target as copy/insert instructions against base, in git's delta format.
+
+    The base is indexed by its aligned 16-byte blocks, every position of the target is
+    looked up in that index and a hit is extended forwards, and backwards over the
+    bytes not emitted yet. Everything between matches becomes an insert.
+
+    :param max_size: Give up as soon as the delta gets bigger than this.
+    :return: The delta, or None if it would exceed max_size.
+    """
+    out = bytearray(encode_varint(len(base)) + encode_varint(len(target)))
+    blocks: Dict[bytes, int] = {}
+    for offset in range(0, len(base) - DELTA_BLOCK + 1, DELTA_BLOCK):
+        blocks.setdefault(base[offset : offset + DELTA_BLOCK], offset)
+
+    # target[pending:i] are literal bytes that still have to be emitted
+    pending = 0
+    i = 0
+    end = len(target) - DELTA_BLOCK
+    while i <= end:
+        base_offset = blocks.get(target[i : i + DELTA_BLOCK])
+        if base_offset is None:
+            i += 1
+            if max_size is not None and len(out) + i - pending > max_size:
+                return None
+            continue
+
+        length = DELTA_BLOCK + match_length(
+            base, base_offset + DELTA_BLOCK, target, i + DELTA_BLOCK
+        )
+        while (
+            i > pending and base_offset > 0 and base[base_offset - 1] == target[i - 1]
+        ):
+            i -= 1
+            base_offset -= 1
+            length += 1
+
+        emit_insert(out, target[pending:i])
+        emit_copy(out, base_offset, length)
+        i += length
+        pending = i
+        if max_size is not None and len(out) > max_size:
+            return None
+
+    emit_insert(out, target[pending:])
+    if max_size is not None and len(out) > max_size:
+        return None
+    return bytes(out)
+
+
+def apply_delta(base: bytes, delta: bytes) -> bytes:
+    base_size, pos = decode_varint(delta, 0)
+    if base_size != len(base):
+        raise ValueError("Delta doesn't apply, the base size doesn't match")
+    target_size, pos = decode_varint(delta, pos)
+
+    out = bytearray()
+    while pos < len(delta):
+        op = delta[pos]
+        pos += 1
+        if op & 0x80:
+            offset = 0
+            size = 0
+            for i in range(4):
+                if op & (1 << i):
+                    offset |= delta[pos] << (8 * i)
+                    pos += 1
+            for i in range(3):
+                if op & (0x10 << i):
+                    size |= delta[pos] << (8 * i)
+                    pos += 1
+            if size == 0:
+                size = 0x10000
+            out += base[offset : offset + size]
+        elif op:
+            out += delta[pos : pos + op]
+            pos += op
+        else:
+            raise ValueError("Delta has the reserved opcode 0")
+
+    if len(out) != target_size:
+        raise ValueError("Delta doesn't apply, the result size doesn't match")
+    return bytes(out)
+
+
+def read_entry_header(data, offset: int) -> Tuple[int, int, int]:
+    """
+    :return: (type number, inflated size, offset of the data) of the pack entry at offset.
+    """
+    byte = data[offset]
+    type_number = (byte >> 4) & 0x07
+    size = byte & 0x0F
+    shift = 4
+    offset += 1
+    while byte & 0x80:
+        byte = data[offset]
+        size |= (byte & 0x7F) << shift
+        shift += 7
+        offset += 1
+    return type_number, size, offset
+
+
+def read_ofs_delta_base(data, offset: int, data_offset: int) -> Tuple[int, int]:
+    """
+    :return: (offset of the base entry, offset of the delta data) of an OFS_DELTA entry.
+    """
+    byte = data[data_offset]
+    relative = byte & 0x7F
+    data_offset += 1
+    while byte & 0x80:
+        byte = data[data_offset]
+        relative = ((relative + 1) << 7) | (byte & 0x7F)
+        data_offset += 1
+    return offset - relative, data_offset
+
+
+class PackIndex:
+    """
+    Read-only view of a version 2 .idx file.
+
+    After the header come a 256-entry fan-out table (the number of objects whose
+    first byte is <= i), the sorted 20-byte SHAs, their CRC32s, their 4-byte pack
+    offsets, the 8-byte offsets for packs over 2 GiB and the pack and idx checksums.
+    A lookup narrows to one fan-out bucket and binary searches inside it.
+    """
+
+    def __init__(self, path: Path) -> None:
+        with open(path, "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        signature, version = struct.unpack_from(">4sI", self.data, 0)
+        if signature != IDX_SIGNATURE or version != IDX_VERSION:
+            self.close()
+            raise ValueError(f"{path} is not a version 2 pack index")
+
+        self.fanout = struct.unpack_from(">256I", self.data, 8)
+        self.count = self.fanout[255]
+        self.names_start = 8 + 256 * 4
+        self.crc_start = self.names_start + 20 * self.count
+        self.offsets_start = self.crc_start + 4 * self.count
+        self.large_offsets_start = self.offsets_start + 4 * self.count
+        self.pack_checksum = self.data[-40:-20]
+
+    def __len__(self) -> int:
+        return self.count
+
+    def name_at(self, i: int) -> bytes:
+        start = self.names_start + 20 * i
+        return self.data[start : start + 20]
+
+    def offset_at(self, i: int) -> int:
+        offset = struct.unpack_from(">I", self.data, self.offsets_start + 4 * i)[0]
+        if offset & 0x80000000:
+            large = self.large_offsets_start + 8 * (offset & 0x7FFFFFFF)
+            offset = struct.unpack_from(">Q", self.data, large)[0]
+        return offset
+
+    def find(self, name: bytes) -> int | None:
+        """
+        :param name: Binary SHA-1 of the object.
+        :return: Offset of the object in the pack, or None.
+        """
+        lo = self.fanout[name[0] - 1] if name[0] else 0
+        hi = self.fanout[name[0]]
+        while lo < hi:
+            mid = (lo + hi) // 2
+            current = self.name_at(mid)
+            if current < name:
+                lo = mid + 1
+            elif current > name:
+                hi = mid
+            else:
+                return self.offset_at(mid)
+        return None
+
+    def __iter__(self) -> Iterator[bytes]:
+        for i in range(self.count):
+            yield self.name_at(i)
+
+    def close(self):
+        self.data.close()
+
+
+class Pack:
+    """
+    A .pack file with its .idx, both mapped into memory.
+
+    Delta entries are rebuilt from their base, and inflated objects go through a
+    byte-bounded LRU cache, so objects sharing a delta chain reuse its bases.
+    """
+
+    def __init__(self, idx_path: Path) -> None:
+        self.idx_path = idx_path
+        # offset -> (type, content), least recently used first
+        self.base_cache: OrderedDict[int, Tuple[str, bytes]] = OrderedDict()
+        self.base_cache_bytes = 0
+        self.lock = threading.Lock()
+        self.pack_path = idx_path.with_suffix(".pack")
+        self.index = PackIndex(idx_path)
+        with open(self.pack_path, "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        signature, version, count = struct.unpack_from(">4sII", self.data, 0)
+        if signature != PACK_SIGNATURE or version != PACK_VERSION:
+            self.close()
+            raise ValueError(f"{self.pack_path} is not a version 2 pack")
+        if count != len(self.index) or self.data[-20:] != self.index.pack_checksum:
+            self.close()
+            raise ValueError(f"{self.pack_path} doesn't match its index")
+
+    def __contains__(self, hash: str) -> bool:
+        return self.index.find(bytes.fromhex(hash)) is not None
+
+    def names(self) -> Iterator[str]:
+        for name in self.index:
+            yield name.hex()
+
+    def read(self, hash: str) -> Tuple[str, bytes] | None:
+        """
+        :return: (type, content) of the object, or None if it isn't in this pack.
+        """
+        offset = self.index.find(bytes.fromhex(hash))
+        if offset is None:
+            return None
+        return self.read_at(offset)
+
+    def read_entry_header(self, offset: int) -> Tuple[int, int, int]:
+        return read_entry_header(self.data, offset)
+
+    def inflate(self, offset: int, size: int) -> bytes:
+        decompressor = zlib.decompressobj()
+        out: List[bytes] = []
+        while not decompressor.eof:
+            chunk = self.data[offset : offset + PACK_READ_CHUNK]
+            if not chunk:
+                raise ValueError(f"{self.pack_path} is truncated")
+            out.append(decompressor.decompress(chunk))
+            offset += len(chunk)
+        content = b"".join(out)
+        if len(content) != size:
+            raise ValueError(f"{self.pack_path} has a corrupt entry")
+        return content
+
+    def read_delta_base(
+        self, type_number: int, offset: int, data_offset: int
+    ) -> Tuple[int, int]:
+        """
+        :return: (offset of the base entry, offset of the delta data) of a delta entry.
+        """
+        if type_number == OFS_DELTA:
+            return read_ofs_delta_base(self.data, offset, data_offset)
+
+        base_offset = self.index.find(self.data[data_offset : data_offset + 20])
+        if base_offset is None:
+            raise ValueError(
+                f"Delta base of the entry at {offset} isn't in {self.pack_path}"
+            )
+        return base_offset, data_offset + 20
+
+    def read_at(self, offset: int) -> Tuple[str, bytes]:
+        with self.lock:
+            cached = self.base_cache.get(offset)
+            if cached is not None:
+                self.base_cache.move_to_end(offset)
+                return cached
+
+        type_number, size, data_offset = self.read_entry_header(offset)
+        if type_number in (OFS_DELTA, REF_DELTA):
+            base_offset, data_offset = self.read_delta_base(
+                type_number, offset, data_offset
+            )
+            obj_type, base = self.read_at(base_offset)
+            obj = (obj_type, apply_delta(base, self.inflate(data_offset, size)))
+        elif type_number in OBJ_TYPES:
+            obj = (OBJ_TYPES[type_number], self.inflate(data_offset, size))
+        else:
+            raise ValueError(f"Unknown object type {type_number} in {self.pack_path}")
+
+        if len(obj[1]) <= BASE_CACHE_BYTES // 4:
+            with self.lock:
+                if offset not in self.base_cache:
+                    self.base_cache[offset] = obj
+                    self.base_cache_bytes += len(obj[1])
+                while self.base_cache_bytes > BASE_CACHE_BYTES:
+                    _, (_, evicted) = self.base_cache.popitem(last=False)
+                    self.base_cache_bytes -= len(evicted)
+        return obj
+
+    def read_header(self, hash: str) -> Tuple[str, int] | None:
+        """
+        :return: (type, size) of the object without inflating all of it, or None if it isn't in this pack.
+        """
+        offset = self.index.find(bytes.fromhex(hash))
+        if offset is None:
+            return None
+        return self.read_header_at(offset)
+
+    def read_header_at(self, offset: int) -> Tuple[str, int]:
+        type_number, size, data_offset = self.read_entry_header(offset)
+        if type_number not in (OFS_DELTA, REF_DELTA):
+            return OBJ_TYPES[type_number], size
+
+        base_offset, data_offset = self.read_delta_base(
+            type_number, offset, data_offset
+        )
+        obj_type, _ = self.read_header_at(base_offset)
+        # the delta starts with the base size and the target size, a few inflated bytes are enough
+        start = zlib.decompressobj().decompress(
+            self.data[data_offset : data_offset + 256], 32
+        )
+        _, pos = decode_varint(start, 0)
+        target_size, _ = decode_varint(start, pos)
+        return obj_type, target_size
+
+    def close(self):
+        self.data.close()
+        self.index.close()
+
+
+def write_pack(
+    pack_dir: Path,
+    objects: List[Tuple[str, str, int]],
+    load: Callable[[str], Tuple[str, bytes]],
+    names: Dict[str, str] | None = None,
+    window: int = DELTA_WINDOW,
+    depth: int = DELTA_DEPTH,
+) -> Path:
+    """
+    Writes a pack and its index, storing objects as deltas where it pays off.
+
+    Objects are sorted by type, name hash and decreasing size, so similar objects end
+    up next to each other. Each one is tried as a delta against the previous `window`
+    objects of the same type, and the smallest delta is kept if it is at most half of
+    the object. Chains are cut at `depth` deltas.
+
+    :param pack_dir: objects/pack directory.
+    :param objects: (hex sha, type, size) of every object, without duplicates.
+    :param load: Reads the (type, content) of an object by its hex sha.
+    :param names: Optional path of each object, it only steers the delta search.
+    :param window: Number of candidate bases, 0 disables deltas.
+    :param depth: Longest allowed delta chain.
+    :return: Path of the written .idx file.
+    """
+    pack_dir.mkdir(parents=True, exist_ok=True)
+    names = names or {}
+    ordered = sorted(
+        objects,
+        key=lambda obj: (
+            OBJ_TYPE_NUMBERS[obj[1]],
+            name_hash(names.get(obj[0], "")),
+            -obj[2],
+            obj[0],
+        ),
+    )
+    sha = hashlib.sha1()
+    # (binary sha, crc32, offset) of every entry, for the index
+    entries: List[Tuple[bytes, int, int]] = []
+    # (type, content, chain depth, offset) of the latest objects, the candidate bases
+    recent: deque = deque(maxlen=window) if window > 0 else deque(maxlen=1)
+
+    fd, tmp_pack = tempfile.mkstemp(dir=pack_dir, prefix="tmp_pack_")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            header = struct.pack(">4sII", PACK_SIGNATURE, PACK_VERSION, len(ordered))
+            out.write(header)
+            sha.update(header)
+            offset = len(header)
+
+            for hash, obj_type, _ in ordered:
+                _, content = load(hash)
+
+                best: Tuple[bytes, int, int] | None = None
+                if window > 0 and len(content) >= DELTA_MIN_SIZE:
+                    for base_type, base, base_depth, base_offset in reversed(recent):
+                        if base_type != obj_type or base_depth >= depth:
+                            continue
+                        # a base much smaller than the object can't give a small delta
+                        if len(base) < len(content) // 32:
+                            continue
+                        max_size = len(best[0]) - 1 if best else len(content) // 2
+                        delta = create_delta(base, content, max_size)
+                        if delta is not None:
+                            best = (delta, base_depth + 1, base_offset)
+
+                if best is not None:
+                    delta, chain_depth, base_offset = best
+                    entry = (
+                        encode_entry_header(OFS_DELTA, len(delta))
+                        + encode_ofs_delta_offset(offset - base_offset)
+                        + zlib.compress(delta)
+                    )
+                else:
+                    chain_depth = 0
+                    entry = encode_entry_header(
+                        OBJ_TYPE_NUMBERS[obj_type], len(content)
+                    ) + zlib.compress(content)
+
+                out.write(entry)
+                sha.update(entry)
+                entries.append((bytes.fromhex(hash), binascii.crc32(entry), offset))
+                if window > 0:
+                    recent.append((obj_type, content, chain_depth, offset))
+                offset += len(entry)
+
+            checksum = sha.digest()
+            out.write(checksum)
+            out.flush()
+            os.fsync(out.fileno())
+
+        name = f"pack-{checksum.hex()}"
+        os.replace(tmp_pack, pack_dir / f"{name}.pack")
+    except BaseException:
+        Path(tmp_pack).unlink(missing_ok=True)
+        raise
+
+    # the .idx goes in last, packs are only picked up through their .idx
+    idx_path = pack_dir / f"{name}.idx"
+    write_pack_index(idx_path, entries, checksum)
+    return idx_path
+
+
+class PackWriter:
+    """
+    Streams objects into a new pack as they come, without deltas, like git's bulk checkin.
+
+    The number of objects is only known at the end, so the header is written last
+    and the checksum is computed over the finished file. Only the (sha, crc, offset)
+    of each entry stays in memory.
+    """
+
+    def __init__(self, pack_dir: Path) -> None:
+        pack_dir.mkdir(parents=True, exist_ok=True)
+        self.pack_dir = pack_dir
+        fd, self.tmp_path = tempfile.mkstemp(dir=pack_dir, prefix="tmp_pack_")
+        self.out = os.fdopen(fd, "w+b")
+        # room for the header, filled in by finish
+        self.out.write(bytes(12))
+        self.offset = 12
+        self.entries: List[Tuple[bytes, int, int]] = []
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def add(self, hash: str, obj_type: str, content: bytes):
+        entry = encode_entry_header(
+            OBJ_TYPE_NUMBERS[obj_type], len(content)
+        ) + zlib.compress(content)
+        self.out.write(entry)
+        self.entries.append((bytes.fromhex(hash), binascii.crc32(entry), self.offset))
+        self.offset += len(entry)
+
+    def finish(self) -> Path:
+        """
+        :return: Path of the written .idx file.
+        """
+        try:
+            self.out.seek(0)
+            self.out.write(
+                struct.pack(">4sII", PACK_SIGNATURE, PACK_VERSION, len(self.entries))
+            )
+            self.out.seek(0)
+            sha = hashlib.sha1()
+            while chunk := self.out.read(PACK_READ_CHUNK):
+                sha.update(chunk)
+            checksum = sha.digest()
+            self.out.write(checksum)
+            self.out.flush()
+            os.fsync(self.out.fileno())
+            self.out.close()
+            name = f"pack-{checksum.hex()}"
+            os.replace(self.tmp_path, self.pack_dir / f"{name}.pack")
+        except BaseException:
+            self.abort()
+            raise
+        idx_path = self.pack_dir / f"{name}.idx"
+        write_pack_index(idx_path, self.entries, checksum)
+        return idx_path
+
+    def abort(self):
+        self.out.close()
+        Path(self.tmp_path).unlink(missing_ok=True)
+
+
+def write_pack_index(
+    idx_path: Path, entries: List[Tuple[bytes, int, int]], pack_checksum: bytes
+):
+    entries = sorted(entries)
+    out = bytearray(struct.pack(">4sI", IDX_SIGNATURE, IDX_VERSION))
+
+    fanout = [0] * 256
+    for name, _, _ in entries:
+        fanout[name[0]] += 1
+    total = 0
+    for i in range(256):
+        total += fanout[i]
+        fanout[i] = total
+    out += struct.pack(">256I", *fanout)
+
+    for name, _, _ in entries:
+        out += name
+    for _, crc, _ in entries:
+        out += struct.pack(">I", crc)
+
+    large_offsets: List[int] = []
+    for _, _, offset in entries:
+        if offset < 0x80000000:
+            out += struct.pack(">I", offset)
+        else:
+            out += struct.pack(">I", 0x80000000 | len(large_offsets))
+            large_offsets.append(offset)
+    for offset in large_offsets:
+        out += struct.pack(">Q", offset)
+
+    out += pack_checksum
+    out += hashlib.sha1(out).digest()
+
+    tmp_idx = idx_path.with_name(f"tmp_{idx_path.name}")
+    with open(tmp_idx, "wb") as f:
+        f.write(out)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_idx, idx_path)
+
+
+def index_pack(pack_path: Path) -> Tuple[Path, int]:
+    """
+    Writes the .idx of a pack that came without one, like git index-pack.
+
+    Every object is inflated, rebuilt from its delta base and hashed, so the names in
+    the index are computed from the content, not taken from whoever sent the pack.
+    The pack is renamed to pack-<checksum>.pack first, and the .idx goes in last.
+
+    :return: (path of the written .idx file, number of objects).
+    """
+    with open(pack_path, "rb") as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        signature, version, count = struct.unpack_from(">4sII", data, 0)
+        if signature != PACK_SIGNATURE or version != PACK_VERSION:
+            raise ValueError(f"{pack_path} is not a version 2 pack")
+        with memoryview(data) as view:
+            checksum = hashlib.sha1(view[:-20]).digest()
+        if checksum != data[-20:]:
+            raise ValueError(f"{pack_path} is corrupt, checksum mismatch")
+
+        # offset -> (type number, size, offset of the data, offset of the delta base)
+        meta: Dict[int, Tuple[int, int, int, int | None]] = {}
+        by_name: Dict[bytes, int] = {}
+        cache: OrderedDict[int, Tuple[str, bytes]] = OrderedDict()
+        cached_bytes = 0
+
+        def inflate(data_offset: int, size: int) -> Tuple[bytes, int]:
+            # the content and where its compressed data ends
+            decompressor = zlib.decompressobj()
+            out: List[bytes] = []
+            pos = data_offset
+            while not decompressor.eof:
+                chunk = data[pos : pos + PACK_READ_CHUNK]
+                if not chunk:
+                    raise ValueError(f"{pack_path} is truncated")
+                out.append(decompressor.decompress(chunk))
+                pos += len(chunk)
+            content = b"".join(out)
+            if len(content) != size:
+                raise ValueError(f"{pack_path} has a corrupt entry")
+            return content, pos - len(decompressor.unused_data)
+
+        def resolve(offset: int, content: bytes) -> Tuple[str, bytes]:
+            # the object of an entry from its inflated data, kept around as a delta base
+            nonlocal cached_bytes
+            type_number, _, _, base_offset = meta[offset]
+            if base_offset is None:
+                obj = (OBJ_TYPES[type_number], content)
+            else:
+                obj_type, base = object_at(base_offset)
+                obj = (obj_type, apply_delta(base, content))
+            cache[offset] = obj
+            cached_bytes += len(obj[1])
+            while cached_bytes > BASE_CACHE_BYTES and len(cache) > 1:
+                _, (_, evicted) = cache.popitem(last=False)
+                cached_bytes -= len(evicted)
+            return obj
+
+        def object_at(offset: int) -> Tuple[str, bytes]:
+            obj = cache.get(offset)
+            if obj is not None:
+                cache.move_to_end(offset)
+                return obj
+            _, size, data_offset, _ = meta[offset]
+            return resolve(offset, inflate(data_offset, size)[0])
+
+        entries: List[Tuple[bytes, int, int]] = []
+        offset = 12
+        for _ in range(count):
+            type_number, size, data_offset = read_entry_header(data, offset)
+            base_offset = None
+            if type_number == OFS_DELTA:
+                base_offset, data_offset = read_ofs_delta_base(
+                    data, offset, data_offset
+                )
+            elif type_number == REF_DELTA:
+                base_offset = by_name.get(data[data_offset : data_offset + 20])
+                if base_offset is None:
+                    # a thin pack, with bases outside of it, isn't supported
+                    raise ValueError(
+                        f"Delta base of the entry at {offset} isn't in {pack_path}"
+                    )
+                data_offset += 20
+            elif type_number not in OBJ_TYPES:
+                raise ValueError(f"Unknown object type {type_number} in {pack_path}")
+            if base_offset is not None and base_offset not in meta:
+                raise ValueError(f"{pack_path} has a delta before its base")
+            meta[offset] = (type_number, size, data_offset, base_offset)
+
+            content, end = inflate(data_offset, size)
+            obj_type, content = resolve(offset, content)
+            name = hashlib.sha1(
+                f"{obj_type} {len(content)}\0".encode("utf-8") + content
+            ).digest()
+            by_name[name] = offset
+            entries.append((name, binascii.crc32(data[offset:end]), offset))
+            offset = end
+        if offset != len(data) - 20:
+            raise ValueError(f"{pack_path} has data after its last entry")
+    finally:
+        data.close()
+
+    final_path = pack_path.with_name(f"pack-{checksum.hex()}.pack")
+    os.replace(pack_path, final_path)
+    idx_path = final_path.with_suffix(".idx")
+    write_pack_index(idx_path, entries, checksum)
+    return idx_path, count
@@ -0,0 +1,135 @@
+# client side of pygit's smart protocol, spoken by 'pygit serve' over TCP or a Unix socket
+import json
+import os
+import socket
+import tempfile
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+# git's daemon port, pygit's server is a stand-in for it
+DEFAULT_PORT = 9418
+URL_PREFIXES = ("pygit://", "unix:")
+# seconds without any byte from the server before a client gives up
+CLIENT_TIMEOUT = 300.0
+# pack bytes are copied to disk in slices of this size
+STREAM_CHUNK = 1 << 18
+
+
+def is_url(url: str) -> bool:
+    return url.startswith(URL_PREFIXES)
+
+
+def parse_url(url: str) -> Tuple[socket.AddressFamily, str | Tuple[str, int]]:
+    """
+    :param url: "pygit://host[:port]" or "unix:/path/of/socket".
+    :return: (socket family, address to connect to).
+    """
+    if url.startswith("unix:"):
+        return socket.AF_UNIX, url[len("unix:") :]
+    address = url[len("pygit://") :].rstrip("/")
+    host, _, port = address.rpartition(":")
+    if not host or not port.isdigit() or host.count(":") and not host.endswith("]"):
+        host, port = address, str(DEFAULT_PORT)
+    host = host.strip("[]")
+    return socket.AF_INET6 if ":" in host else socket.AF_INET, (host, int(port))
+
+
+class Connection:
+    """
+    One connection to a pygit server, requests go one after the other.
+
+    A request is one JSON line, and so is the answer. A fetch answer announces the
+    size of the pack, whose raw bytes follow it on the connection.
+    """
+
+    def __init__(self, url: str) -> None:
+        family, address = parse_url(url)
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        self.sock.settimeout(CLIENT_TIMEOUT)
+        try:
+            self.sock.connect(address)
+        except OSError as e:
+            self.sock.close()
+            raise ValueError(f"Unable to connect to {url}: {e}")
+        self.file = self.sock.makefile("rb")
+
+    def __enter__(self) -> "Connection":
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+    def request(self, command: str, **args) -> dict:
+        self.sock.sendall(
+            json.dumps({"command": command, **args}).encode("utf-8") + b"\n"
+        )
+        line = self.file.readline()
+        if not line:
+            raise ValueError("The server closed the connection")
+        answer = json.loads(line)
+        if "error" in answer:
+            raise ValueError(f"The server answered: {answer['error']}")
+        return answer
+
+    def ls_refs(self) -> Dict[str, str]:
+        """
+        :return: ref -> sha of every ref the server advertises.
+        """
+        return self.request("ls-refs")["refs"]
+
+    def fetch(
+        self,
+        wants: List[str],
+        haves: List[str],
+        pack_dir: Path,
+        filter: str | None = None,
+    ) -> Tuple[Path | None, int]:
+        """
+        Asks for the objects of the wants that the haves don't have, and saves their pack.
+
+        :param filter: "blob:none" or "blob:limit=<n>", blobs the server leaves out.
+        :return: (path of the received pack, without an index yet, pack size in bytes),
+            no path if the server had nothing to send.
+        """
+        args = {"wants": wants, "haves": haves}
+        if filter is not None:
+            args["filter"] = filter
+        return self.receive_pack(self.request("fetch", **args), pack_dir)
+
+    def fetch_objects(self, objects: List[str], pack_dir: Path) -> Tuple[Path, int]:
+        """
+        Asks for objects by hash, those a partial clone finds missing.
+
+        :return: (path of the received pack, without an index yet, pack size in bytes).
+        """
+        pack_path, size = self.receive_pack(
+            self.request("fetch-objects", objects=objects), pack_dir
+        )
+        if pack_path is None:
+            raise ValueError("The server sent no objects")
+        return pack_path, size
+
+    def receive_pack(self, answer: dict, pack_dir: Path) -> Tuple[Path | None, int]:
+        # the pack follows the answer that announced its size
+        size = answer["size"]
+        if not size:
+            return None, 0
+        pack_dir.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=pack_dir, prefix="tmp_pack_")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                left = size
+                while left:
+                    chunk = self.file.read(min(left, STREAM_CHUNK))
+                    if not chunk:
+                        raise ValueError("The server closed the connection mid-pack")
+                    out.write(chunk)
+                    left -= len(chunk)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        return Path(tmp_path), size
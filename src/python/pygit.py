@@ -1,9 +1,29 @@
 # implementation of git
-import json
 import os
 import pathlib
+import signal
+import sys
 
-from lib import Add, Commit
+import fsmonitor
+from lib import (
+    Add,
+    CatFile,
+    Checkout,
+    Commit,
+    Diff,
+    Fetch,
+    Gc,
+    History,
+    Index,
+    Log,
+    Push,
+    Remote,
+    Status,
+    parse_expiry,
+)
+from protocol import DEFAULT_PORT
+from refs import DEFAULT_BRANCH, Refs
+from serve import PackServer
 
 
 class pygit:
@@ -12,10 +32,10 @@ class pygit:
         self.path = pathlib.Path(".")
         self.pygit = self.path / ".pygit"
         self.pygit_init_tree = {
-            "dirs": ["objects", "hooks", "info", "refs"],
-            "files": ["config", "index.json"],
+            "dirs": ["objects", "hooks", "info", "refs", "refs/heads", "refs/tags"],
+            "files": ["config", "index", "HEAD"],
         }
-        self.index_file = self.pygit / "index.json"
+        self.index_file = self.pygit / "index"
         self.obj_dir = self.pygit / "objects"
 
     def init(self):
@@ -29,24 +49,33 @@ class pygit:
                 os.mkdir(self.pygit / dir)
 
             for file in self.pygit_init_tree["files"]:
-                if file == "index.json":
-                    with open(self.pygit / file, "w") as f:
-                        json.dump({}, f)
+                if file == "index":
+                    # an empty binary index, just the header and the checksum
+                    Index(
+                        index_path=self.index_file, obj_dir=self.obj_dir
+                    ).write_index()
+                elif file == "HEAD":
+                    # the first commit creates the branch HEAD points to
+                    with open(self.pygit / file, "x") as f:
+                        f.write(f"ref: refs/heads/{DEFAULT_BRANCH}\n")
                 else:
                     open(self.pygit / file, "x")
 
         else:
             print("pygit already exists")
 
-    def add(self, files):
+    def add(self, files, jobs=None):
 
         if not os.path.exists(self.pygit):
             print("Initialize a pygit dir first")
             return
 
-        add = Add(files=files, pygit=self.pygit)
+        add = Add(files=files, pygit=self.pygit, jobs=jobs)
 
-        add.stage_files(files=files)
+        try:
+            add.stage_files(files=files)
+        except ValueError as e:
+            print(e)
 
         pass
 
@@ -54,3 +83,191 @@ class pygit:
         commit = Commit(pygit=self.pygit)
         commit.commit(message=message)
         pass
+
+    def log(self, rev="HEAD", count=None, oneline=False):
+        if not os.path.exists(self.pygit):
+            print("Initialize a pygit dir first")
+            return
+
+        Log(pygit=self.pygit).show(rev=rev, count=count, oneline=oneline)
+
+    def diff(
+        self,
+        revs,
+        cached=False,
+        name_status=False,
+        stat=False,
+        algorithm="myers",
+        context=3,
+        jobs=None,
+    ):
+        if not os.path.exists(self.pygit):
+            print("Initialize a pygit dir first")
+            return
+
+        try:
+            Diff(
+                pygit=self.pygit, jobs=jobs, algorithm=algorithm, context=context
+            ).show(revs, cached=cached, name_status=name_status, stat=stat)
+        except ValueError as e:
+            print(e)
+
+    def merge_base(self, one, two, is_ancestor=False):
+        if not os.path.exists(self.pygit):
+            print("Initialize a pygit dir first")
+            return 1
+
+        refs = Refs(self.pygit)
+        shas = [refs.resolve(one), refs.resolve(two)]
+        for name, sha in zip((one, two), shas):
+            if sha is None:
+                print(f"Not a valid commit: {name}")
+                return 1
+        history = History(self.pygit)
+        if is_ancestor:
+            return 0 if history.is_ancestor(*shas) else 1
+        bases = history.merge_bases(*shas)
+        for sha in bases:
+            print(sha)
+        return 0 if bases else 1
+
+    def commit_graph(self):
+        if not os.path.exists(self.pygit):
+            print("Initialize a pygit dir first")
+            return
+
+        Gc(pygit=self.pygit).write_commit_graph()
+
+    def checkout(self, rev, jobs=None):
+        if not os.path.exists(self.pygit):
+            print("Initialize a pygit dir first")
+            return
+
+        try:
+            Checkout(pygit=self.pygit, jobs=jobs).checkout(rev)
+        except (ValueError, FileExistsError) as e:
+            print(e)
+
+    def status(self, short=False, jobs=None):
+        if not os.path.exists(self.pygit):
+            print("Initialize a pygit dir first")
+            return
+
+        Status(pygit=self.pygit, jobs=jobs).show(short=short)
+
+    def fsmonitor(self, action):
+        if not os.path.exists(self.pygit):
+            print("Initialize a pygit dir first")
+            return
+
+        if action == "start":
+            status = fsmonitor.start(self.pygit)
+            if status is None:
+                print("fsmonitor daemon didn't start")
+            else:
+                print(
+                    f"fsmonitor daemon running, pid {status['pid']}, watching {status['watches']} directories"
+                )
+        elif action == "stop":
+            if fsmonitor.stop(self.pygit):
+                print("fsmonitor daemon stopped")
+            else:
+                print("fsmonitor daemon is not running")
+        else:
+            status = fsmonitor.request(self.pygit, "status")
+            if status is None:
+                print("fsmonitor daemon is not running")
+            else:
+                print(
+                    f"fsmonitor daemon running, pid {status['pid']}, watching {status['watches']} directories, token {status['token']}"
+                )
+
+    def remote(self, action=None, name=None, url=None, verbose=False):
+        if not os.path.exists(self.pygit):
+            print("Initialize a pygit dir first")
+            return
+
+        remote = Remote(self.pygit)
+        try:
+            if action == "add":
+                remote.add(name, url)
+            elif action == "remove":
+                remote.remove(name)
+            else:
+                for name in remote.names():
+                    if verbose:
+                        print(f"{name}\t{remote.url(name)}")
+                    else:
+                        print(name)
+        except (ValueError, FileExistsError) as e:
+            print(e)
+
+    def fetch(self, remote="origin", filter=None):
+        if not os.path.exists(self.pygit):
+            print("Initialize a pygit dir first")
+            return
+
+        try:
+            Fetch(pygit=self.pygit).fetch(remote, filter=filter)
+        except (ValueError, FileExistsError) as e:
+            print(e)
+
+    def push(self, remote="origin", branch=None):
+        if not os.path.exists(self.pygit):
+            print("Initialize a pygit dir first")
+            return 1
+
+        try:
+            Push(pygit=self.pygit).push(remote, branch)
+        except (ValueError, FileExistsError) as e:
+            print(e)
+            return 1
+        return 0
+
+    def serve(self, host="localhost", port=DEFAULT_PORT, socket_path=None, jobs=None):
+        if not os.path.exists(self.pygit):
+            print("Initialize a pygit dir first")
+            return
+
+        # SIGTERM stops the server like Ctrl-C does, its pack cache is cleaned up
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        try:
+            PackServer(self.pygit, jobs=jobs).serve(host, port, socket_path)
+        except OSError as e:
+            print(e)
+        except KeyboardInterrupt:
+            pass
+
+    def gc(self, window=None, depth=None, prune=None, jobs=None):
+        if not os.path.exists(self.pygit):
+            print("Initialize a pygit dir first")
+            return
+
+        options = {"window": window, "depth": depth}
+        gc = Gc(pygit=self.pygit, jobs=jobs)
+        if prune is not None:
+            try:
+                options["reachable"] = gc.prune(parse_expiry(prune))
+            except ValueError as e:
+                print(e)
+                return
+        gc.repack(
+            **{name: value for name, value in options.items() if value is not None}
+        )
+        gc.write_commit_graph()
+
+    def cat_file(self, obj=None, option="-p", batch=False, batch_check=False):
+        if not os.path.exists(self.pygit):
+            print("Initialize a pygit dir first")
+            return
+
+        cat_file = CatFile(pygit=self.pygit)
+        if batch or batch_check:
+            cat_file.batch(sys.stdin.buffer, sys.stdout.buffer, contents=batch)
+        elif obj is None:
+            print("Give an object or --batch")
+        else:
+            try:
+                cat_file.show(obj, option)
+            except ValueError as e:
+                print(e)
@@ -0,0 +1,224 @@
+# branches, HEAD and their reflogs, stored like git does under .pygit
+import getpass
+import os
+import socket
+import time
+from pathlib import Path
+from typing import Iterator, List, Tuple
+
+DEFAULT_BRANCH = "main"
+ZERO_SHA = "0" * 40
+
+
+def identity(role: str = "COMMITTER") -> str:
+    """
+    :param role: "AUTHOR" or "COMMITTER", picks git's GIT_<role>_NAME/EMAIL variables.
+    :return: "Name <email> <unix time> <utc offset>", as it goes into commits and reflogs.
+    """
+    user = getpass.getuser()
+    name = os.environ.get(f"GIT_{role}_NAME") or user
+    email = os.environ.get(f"GIT_{role}_EMAIL") or f"{user}@{socket.gethostname()}"
+    now = int(time.time())
+    offset = time.localtime(now).tm_gmtoff // 60
+    sign = "-" if offset < 0 else "+"
+    return f"{name} <{email}> {now} {sign}{abs(offset) // 60:02d}{abs(offset) % 60:02d}"
+
+
+class Refs:
+    """
+    Reads and updates HEAD and the refs under refs/.
+
+    HEAD is either "ref: refs/heads/<branch>" or a commit sha, a ref is a file holding
+    a commit sha. Every update goes through a "<ref>.lock" file, checks the old value
+    and is renamed into place, and is appended to the ref's reflog under logs/.
+    """
+
+    def __init__(self, pygit: Path) -> None:
+        self.pygit = pygit
+        self.head_path = pygit / "HEAD"
+        self.logs_dir = pygit / "logs"
+
+    def read_head(self) -> str:
+        """
+        :return: The ref HEAD points to, "refs/heads/main" when there is no HEAD yet, or a sha if it is detached.
+        """
+        try:
+            with open(self.head_path) as f:
+                value = f.read().strip()
+        except FileNotFoundError:
+            return f"refs/heads/{DEFAULT_BRANCH}"
+        if value.startswith("ref: "):
+            return value[5:]
+        return value
+
+    def current_branch(self) -> str | None:
+        head = self.read_head()
+        if head.startswith("refs/heads/"):
+            return head[len("refs/heads/") :]
+        return None
+
+    def read_ref(self, ref: str) -> str | None:
+        try:
+            with open(self.pygit / ref) as f:
+                return f.read().strip() or None
+        except (FileNotFoundError, IsADirectoryError):
+            return None
+
+    def resolve(self, name: str) -> str | None:
+        """
+        :param name: "HEAD", a full ref, a branch, tag or remote-tracking branch name
+            like "origin/main", a remote name for its HEAD, or a full sha.
+        :return: The commit sha it names, None if it doesn't exist.
+        """
+        if name == "HEAD":
+            head = self.read_head()
+            return self.read_ref(head) if head.startswith("refs/") else head
+        if name.startswith("refs/"):
+            return self.read_ref(name)
+        for ref in (
+            f"refs/heads/{name}",
+            f"refs/tags/{name}",
+            f"refs/remotes/{name}",
+            f"refs/remotes/{name}/HEAD",
+        ):
+            sha = self.read_ref(ref)
+            # a remote's HEAD can be symbolic, like git's "ref: refs/remotes/origin/main"
+            if sha is not None and sha.startswith("ref: "):
+                sha = self.read_ref(sha[len("ref: ") :])
+            if sha is not None:
+                return sha
+        if len(name) == 40 and all(c in "0123456789abcdef" for c in name):
+            return name
+        return None
+
+    def iter_refs(self) -> Iterator[Tuple[str, str]]:
+        """
+        :return: (ref, sha) of every ref under refs/, sorted by name.
+        """
+        refs_dir = self.pygit / "refs"
+        found: List[Tuple[str, str]] = []
+        for root, _, files in os.walk(refs_dir):
+            for file in files:
+                if file.endswith(".lock"):
+                    continue
+                ref = Path(root, file).relative_to(self.pygit).as_posix()
+                sha = self.read_ref(ref)
+                if sha is not None:
+                    found.append((ref, sha))
+        return iter(sorted(found))
+
+    def update_ref(
+        self, ref: str, new: str, message: str, old: str | None = None
+    ) -> None:
+        """
+        Points a ref, or HEAD itself, to a new sha.
+
+        :param old: Expected current value, the update fails if the ref moved in between.
+            ZERO_SHA expects the ref not to exist, None skips the check.
+        """
+        path = self.pygit / ref
+        path.parent.mkdir(parents=True, exist_ok=True)
+        lock_path = path.with_name(path.name + ".lock")
+        try:
+            fd = os.open(lock_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        except FileExistsError:
+            raise FileExistsError(
+                f"Unable to create '{lock_path}': another pygit process seems to be running"
+            )
+        try:
+            current = self.read_ref(ref)
+            if old is not None and (current or ZERO_SHA) != old:
+                raise ValueError(
+                    f"{ref} is at {current or ZERO_SHA}, expected {old}, it was updated meanwhile"
+                )
+            with os.fdopen(fd, "w") as f:
+                f.write(new + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(lock_path, path)
+        except BaseException:
+            lock_path.unlink(missing_ok=True)
+            raise
+        self.append_reflog(ref, current or ZERO_SHA, new, message)
+
+    def update_head(self, new: str, message: str, old: str | None = None) -> None:
+        """
+        Moves HEAD to a new commit, through its branch unless it is detached.
+
+        Both the branch and HEAD get a reflog entry.
+        """
+        head = self.read_head()
+        if head.startswith("refs/"):
+            previous = self.read_ref(head) or ZERO_SHA
+            self.update_ref(head, new, message, old=old)
+            self.append_reflog("HEAD", previous, new, message)
+        else:
+            self.update_ref("HEAD", new, message, old=old)
+
+    def set_head(self, ref: str, message: str | None = None) -> None:
+        """
+        Points HEAD to a branch, or detaches it at a commit.
+
+        :param ref: "refs/heads/<branch>", or a commit sha for a detached HEAD.
+        :param message: Reflog message, HEAD's reflog is only written with one.
+        """
+        previous = self.resolve("HEAD") or ZERO_SHA
+        lock_path = self.head_path.with_name("HEAD.lock")
+        try:
+            f = open(lock_path, "x")
+        except FileExistsError:
+            raise FileExistsError(
+                f"Unable to create '{lock_path}': another pygit process seems to be running"
+            )
+        with f:
+            f.write(f"ref: {ref}\n" if ref.startswith("refs/") else f"{ref}\n")
+        os.replace(lock_path, self.head_path)
+        if message is not None:
+            self.append_reflog(
+                "HEAD", previous, self.resolve("HEAD") or ZERO_SHA, message
+            )
+
+    def append_reflog(self, ref: str, old: str, new: str, message: str) -> None:
+        path = self.logs_dir / ref
+        path.parent.mkdir(parents=True, exist_ok=True)
+        line = (
+            f"{old} {new} {identity()}\t{message.splitlines()[0] if message else ''}\n"
+        )
+        # a single append of a whole line, concurrent writers don't interleave within it
+        with open(path, "a") as f:
+            f.write(line)
+
+    def read_reflog(self, ref: str) -> List[Tuple[str, str, str]]:
+        """
+        :return: (old sha, new sha, "identity\\tmessage") of every reflog entry, oldest first.
+        """
+        try:
+            with open(self.logs_dir / ref) as f:
+                lines = f.read().splitlines()
+        except FileNotFoundError:
+            return []
+        entries = []
+        for line in lines:
+            parts = line.split(" ", 2)
+            if len(parts) == 3:
+                entries.append((parts[0], parts[1], parts[2]))
+        return entries
+
+    def tracking_refs(self, branch: str) -> List[str]:
+        """
+        :return: refs/remotes/<remote>/<branch> of every remote that has the branch.
+        """
+        remotes_dir = self.pygit / "refs" / "remotes"
+        if not remotes_dir.is_dir():
+            return []
+        return [
+            f"refs/remotes/{remote}/{branch}"
+            for remote in sorted(os.listdir(remotes_dir))
+            if self.read_ref(f"refs/remotes/{remote}/{branch}") is not None
+        ]
+
+    def iter_reflogs(self) -> Iterator[str]:
+        # every ref that has a reflog, HEAD included
+        for root, _, files in os.walk(self.logs_dir):
+            for file in files:
+                yield Path(root, file).relative_to(self.logs_dir).as_posix()
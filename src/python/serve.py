@@ -0,0 +1,284 @@
+# 'pygit serve', hands the refs and objects of a repository to fetching clients
+import asyncio
+import json
+import re
+import shutil
+import tempfile
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import BinaryIO, Dict, List, Tuple
+
+from lib import PackTransfer, parse_filter
+from protocol import DEFAULT_PORT, STREAM_CHUNK
+from refs import Refs
+
+# bytes of recently built packs kept on disk, for the next request asking the same
+PACK_CACHE_BYTES = 256 << 20
+# longest request line, the haves of a repository with many refs fit easily
+MAX_REQUEST_BYTES = 16 << 20
+SHA = re.compile(r"[0-9a-f]{40}")
+
+# everything a pack depends on: ("fetch", sorted wants, sorted common commits, blob
+# limit or None) for a fetch, ("objects", sorted shas) for the objects of a partial clone
+PackKey = Tuple
+# (path of the pack, None if nothing is missing, number of objects, size in bytes)
+PackEntry = Tuple[Path | None, int, int]
+
+
+class PackServer:
+    """
+    Serves the refs and objects of a repository over TCP or a Unix socket.
+
+    A client asks for the refs, then for the objects of the commits it wants, naming
+    the commits it has. The pack is built on a worker thread, the event loop only
+    routes requests, and is streamed back in chunks that each wait for the client to
+    keep up, so a slow client doesn't hold more than a chunk in memory.
+
+    Requests coming down to the same wants and common commits get the same pack:
+    the build in progress is awaited by every request that asks for it meanwhile,
+    and built packs stay in a least recently used cache until it outgrows cache_bytes.
+    """
+
+    def __init__(
+        self,
+        pygit: Path,
+        jobs: int | None = None,
+        cache_bytes: int = PACK_CACHE_BYTES,
+    ) -> None:
+        self.pygit = pygit
+        self.refs = Refs(pygit)
+        self.executor = ThreadPoolExecutor(jobs)
+        self.cache_bytes = cache_bytes
+        self.cache_dir: Path | None = None
+        self.cache: OrderedDict[PackKey, PackEntry] = OrderedDict()
+        self.cached_bytes = 0
+        # key -> the build of its pack, while it runs
+        self.pending: Dict[PackKey, asyncio.Future] = {}
+        self.stats = {"fetches": 0, "packs_built": 0, "cache_hits": 0, "coalesced": 0}
+
+    def serve(
+        self,
+        host: str = "localhost",
+        port: int = DEFAULT_PORT,
+        socket_path: str | None = None,
+    ):
+        asyncio.run(self.run(host, port, socket_path))
+
+    async def run(self, host: str, port: int, socket_path: str | None):
+        self.cache_dir = Path(tempfile.mkdtemp(prefix="pygit-serve-"))
+        try:
+            if socket_path is not None:
+                server = await asyncio.start_unix_server(
+                    self.handle, socket_path, limit=MAX_REQUEST_BYTES
+                )
+                url = f"unix:{socket_path}"
+            else:
+                server = await asyncio.start_server(
+                    self.handle, host, port, limit=MAX_REQUEST_BYTES
+                )
+                address = server.sockets[0].getsockname()
+                shown = f"[{address[0]}]" if ":" in address[0] else address[0]
+                url = f"pygit://{shown}:{address[1]}"
+            async with server:
+                print(f"Serving {self.pygit.resolve().parent} on {url}", flush=True)
+                await server.serve_forever()
+        finally:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            shutil.rmtree(self.cache_dir, ignore_errors=True)
+            if socket_path is not None:
+                Path(socket_path).unlink(missing_ok=True)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # one client, its requests are answered in order until it hangs up
+        try:
+            try:
+                while line := await reader.readline():
+                    try:
+                        await self.answer(writer, json.loads(line))
+                    except ConnectionError:
+                        raise
+                    except (ValueError, OSError, zlib.error) as e:
+                        # a bad request, or a pack that couldn't be built from this repository
+                        await self.send(writer, {"error": str(e)})
+            except ValueError:
+                # a line over the limit, the rest of the stream can't be trusted
+                await self.send(writer, {"error": "request too long"})
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def answer(self, writer: asyncio.StreamWriter, request: dict):
+        if not isinstance(request, dict):
+            raise ValueError("a request is a JSON object")
+        command = request.get("command")
+        if command == "ls-refs":
+            await self.send(writer, await self.ls_refs())
+        elif command == "fetch":
+            await self.send_pack(
+                writer,
+                request.get("wants"),
+                request.get("haves", []),
+                request.get("filter"),
+            )
+        elif command == "fetch-objects":
+            await self.send_objects(writer, request.get("objects"))
+        elif command == "stats":
+            await self.send(writer, {**self.stats, "cached": len(self.cache)})
+        else:
+            raise ValueError(f"unknown command {command!r}")
+
+    async def send(self, writer: asyncio.StreamWriter, answer: dict):
+        writer.write(json.dumps(answer).encode("utf-8") + b"\n")
+        await writer.drain()
+
+    async def ls_refs(self) -> dict:
+        loop = asyncio.get_running_loop()
+        refs = await loop.run_in_executor(
+            self.executor, lambda: dict(self.refs.iter_refs())
+        )
+        return {"refs": refs, "head": self.refs.read_head()}
+
+    async def send_pack(
+        self,
+        writer: asyncio.StreamWriter,
+        wants: List[str],
+        haves: List[str],
+        filter: str | None = None,
+    ):
+        """
+        Answers a fetch with the common commits, the number of objects and the pack
+        size, then streams the pack itself.
+        """
+        self.stats["fetches"] += 1
+        check_shas(wants, "wants")
+        check_shas(haves, "haves")
+        if not wants:
+            raise ValueError("nothing wanted")
+        if filter is not None and not isinstance(filter, str):
+            raise ValueError("a filter is a filter-spec string")
+        blob_limit = parse_filter(filter) if filter is not None else None
+        loop = asyncio.get_running_loop()
+        wants, common = await loop.run_in_executor(
+            self.executor, self.negotiate, wants, haves
+        )
+        await self.stream(writer, ("fetch", wants, common, blob_limit), common)
+
+    async def send_objects(self, writer: asyncio.StreamWriter, objects: List[str]):
+        # any object can be asked for, a partial clone only knows the hashes it misses
+        self.stats["fetches"] += 1
+        check_shas(objects, "objects")
+        if not objects:
+            raise ValueError("nothing wanted")
+        await self.stream(writer, ("objects", tuple(sorted(set(objects)))), ())
+
+    async def stream(
+        self, writer: asyncio.StreamWriter, key: PackKey, common: Tuple[str, ...]
+    ):
+        f, count, size = await self.open_pack(key)
+        await self.send(
+            writer, {"common": list(common), "objects": count, "size": size}
+        )
+        if f is None:
+            return
+        with f:
+            while chunk := f.read(STREAM_CHUNK):
+                writer.write(chunk)
+                # backpressure, waits while the client is behind
+                await writer.drain()
+
+    def negotiate(
+        self, wants: List[str], haves: List[str]
+    ) -> Tuple[Tuple[str, ...], Tuple[str, ...]]:
+        """
+        :return: (the sorted wants, the sorted haves this side has too).
+        """
+        # only commits the refs point to can be asked for, like git's uploadpack
+        advertised = {sha for _, sha in self.refs.iter_refs()}
+        for sha in wants:
+            if sha not in advertised:
+                raise ValueError(f"not our ref {sha}")
+        common = PackTransfer(self.pygit).common(haves)
+        return tuple(sorted(set(wants))), tuple(common)
+
+    async def open_pack(self, key: PackKey) -> Tuple[BinaryIO | None, int, int]:
+        """
+        :return: (the pack for the key opened for reading, None if it is empty,
+            number of objects, size in bytes), from the cache or a build.
+        """
+        while True:
+            entry = self.cache.get(key)
+            if entry is not None:
+                self.cache.move_to_end(key)
+                self.stats["cache_hits"] += 1
+            else:
+                build = self.pending.get(key)
+                if build is None:
+                    build = self.pending[key] = asyncio.ensure_future(self.build(key))
+                else:
+                    self.stats["coalesced"] += 1
+                # a client going away doesn't cancel a build the others wait for
+                entry = await asyncio.shield(build)
+            path, count, size = entry
+            if path is None:
+                return None, 0, 0
+            try:
+                # opened in the same step of the loop, its file can't be evicted before
+                return open(path, "rb"), count, size
+            except FileNotFoundError:
+                # evicted before this request got to it, built again
+                continue
+
+    async def build(self, key: PackKey) -> PackEntry:
+        loop = asyncio.get_running_loop()
+        try:
+            entry = await loop.run_in_executor(self.executor, self.write_pack, key)
+        finally:
+            del self.pending[key]
+        self.stats["packs_built"] += 1
+        if entry[0] is not None:
+            self.remember(key, entry)
+        return entry
+
+    def write_pack(self, key: PackKey) -> PackEntry:
+        # a directory per pack, two keys can end up with the same pack name
+        pack_dir = Path(tempfile.mkdtemp(dir=self.cache_dir))
+        transfer = PackTransfer(self.pygit)
+        try:
+            if key[0] == "objects":
+                idx_path = transfer.write_objects(pack_dir, list(key[1]))
+                count = len(key[1])
+            else:
+                _, wants, common, blob_limit = key
+                idx_path, count = transfer.write(pack_dir, wants, common, blob_limit)
+        except BaseException:
+            shutil.rmtree(pack_dir, ignore_errors=True)
+            raise
+        if idx_path is None:
+            pack_dir.rmdir()
+            return None, 0, 0
+        pack_path = idx_path.with_suffix(".pack")
+        return pack_path, count, pack_path.stat().st_size
+
+    def remember(self, key: PackKey, entry: PackEntry):
+        self.cache[key] = entry
+        self.cached_bytes += entry[2]
+        # the newest pack stays, even alone over the limit, its requests are still to read it
+        while self.cached_bytes > self.cache_bytes and len(self.cache) > 1:
+            _, (path, _, size) = self.cache.popitem(last=False)
+            self.cached_bytes -= size
+            # readers that have it open keep reading it
+            shutil.rmtree(path.parent, ignore_errors=True)
+
+
+def check_shas(shas: List[str], name: str):
+    if not isinstance(shas, list) or not all(
+        isinstance(sha, str) and SHA.fullmatch(sha) for sha in shas
+    ):
+        raise ValueError(f"{name} must be a list of full shas")
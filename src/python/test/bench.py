@@ -0,0 +1,425 @@
+# benchmark of the pygit commands on a synthetic working tree, results saved as JSON
+# run from src/python: python -m test.bench --files 100000 --out before.json
+# compare two runs:     python -m test.bench --compare before.json after.json
+
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import statistics
+import string
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from pack import PackIndex
+
+MAIN = Path(__file__).resolve().parent.parent / "main.py"
+# generated content is sliced out of blocks this big
+BLOCK_SIZE = 1 << 20
+# metrics shown by --compare, in that order
+METRICS = ("wall_s", "user_s", "sys_s", "max_rss_kb", "syscalls", "objects_written")
+
+
+class SyntheticTree:
+    """
+    A working tree generated from a seed, the same parameters give the same bytes.
+
+    Files spread evenly over a directory tree of the given depth, sizes follow a
+    log-normal distribution around the median, and a share of them is binary.
+    """
+
+    def __init__(self, root: Path, args: argparse.Namespace) -> None:
+        self.root = root
+        self.args = args
+        self.rng = random.Random(args.seed)
+        words = [
+            "".join(self.rng.choices(string.ascii_lowercase, k=self.rng.randint(2, 9)))
+            for _ in range(2000)
+        ]
+        text = []
+        size = 0
+        while size < BLOCK_SIZE:
+            line = " ".join(self.rng.choices(words, k=self.rng.randint(3, 12)))
+            text.append(line)
+            size += len(line) + 1
+        self.text_block = ("\n".join(text) + "\n").encode("utf-8")
+        self.binary_block = self.rng.randbytes(BLOCK_SIZE)
+        dirs = max(1, math.ceil(args.files / args.per_dir))
+        self.width = max(2, math.ceil(dirs ** (1 / args.depth))) if args.depth else 1
+        # path -> is binary, every file of the tree
+        self.files: Dict[str, bool] = {}
+        self.next_id = 0
+
+    def path_of(self, i: int) -> str:
+        directory = i // self.args.per_dir
+        parts = []
+        for _ in range(self.args.depth):
+            directory, rest = divmod(directory, self.width)
+            parts.append(f"d{rest}")
+        return "/".join(parts + [f"f{i}"])
+
+    def content(self, path: str, binary: bool) -> bytes:
+        size = int(self.rng.lognormvariate(math.log(self.args.size_median), 1.0))
+        size = min(size, self.args.size_max)
+        block = self.binary_block if binary else self.text_block
+        start = self.rng.randrange(len(block))
+        if start + size <= len(block):
+            body = block[start : start + size]
+        else:
+            body = (block[start:] + block * (size // len(block) + 1))[:size]
+        # the path up front, no two files are the same blob
+        head = (b"\0" if binary else b"") + path.encode("utf-8") + b"\n"
+        return head + body
+
+    def write(self, path: str, binary: bool):
+        full = self.root / path
+        full.parent.mkdir(parents=True, exist_ok=True)
+        with open(full, "wb") as f:
+            f.write(self.content(path, binary))
+        self.files[path] = binary
+
+    def add_files(self, count: int):
+        for _ in range(count):
+            binary = self.rng.random() < self.args.binary_ratio
+            path = self.path_of(self.next_id) + (".bin" if binary else ".txt")
+            self.next_id += 1
+            self.write(path, binary)
+
+    def generate(self):
+        self.add_files(self.args.files)
+
+    def mutate(self) -> Tuple[int, int, int]:
+        """
+        Modifies change_rate of the files, and adds and deletes a tenth of that.
+
+        :return: (modified, added, deleted) counts.
+        """
+        paths = sorted(self.files)
+        changed = max(1, int(len(paths) * self.args.change_rate))
+        churn = changed // 10
+        picked = self.rng.sample(paths, min(len(paths), changed + churn))
+        for path in picked[:changed]:
+            self.write(path, self.files[path])
+        for path in picked[changed:]:
+            (self.root / path).unlink()
+            del self.files[path]
+        self.add_files(churn)
+        return changed, churn, len(picked) - changed
+
+
+def count_objects(pygit: Path) -> int:
+    obj_dir = pygit / "objects"
+    count = 0
+    if not obj_dir.exists():
+        return 0
+    for prefix in os.listdir(obj_dir):
+        if len(prefix) == 2:
+            count += len(os.listdir(obj_dir / prefix))
+    for idx in (obj_dir / "pack").glob("pack-*.idx"):
+        index = PackIndex(idx)
+        count += index.count
+        index.close()
+    return count
+
+
+def run_phase(repo: Path, argv: List[str], trace: Path | None = None) -> dict:
+    """
+    Runs one pygit command in its own process.
+
+    :param trace: Where strace -c writes its summary, None to run without strace.
+    :return: Wall and cpu time, peak RSS and syscall counts of the process, read and
+        write ones from /proc/<pid>/io, all of them with strace.
+    """
+    prefix = ["strace", "-f", "-c", "-o", str(trace)] if trace is not None else []
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [*prefix, sys.executable, str(MAIN), *argv],
+        cwd=repo,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+    )
+    # waited for without reaping it, its /proc entry is still there to be read
+    os.waitid(os.P_PID, proc.pid, os.WEXITED | os.WNOWAIT)
+    wall = time.perf_counter() - start
+    io = {}
+    try:
+        with open(f"/proc/{proc.pid}/io") as f:
+            io = dict(line.split(": ") for line in f.read().splitlines())
+    except OSError:
+        pass
+    _, status, usage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    stderr = proc.stderr.read().decode("utf-8", "replace")
+    proc.stderr.close()
+    if trace is not None:
+        # the counts of strace itself, not of the traced command, are of no use
+        return {"syscalls": strace_calls(trace), "exit_code": proc.returncode}
+    return {
+        "wall_s": round(wall, 4),
+        "user_s": round(usage.ru_utime, 4),
+        "sys_s": round(usage.ru_stime, 4),
+        "max_rss_kb": usage.ru_maxrss,
+        "read_syscalls": int(io["syscr"]) if "syscr" in io else None,
+        "write_syscalls": int(io["syscw"]) if "syscw" in io else None,
+        "exit_code": proc.returncode,
+        "stderr": stderr[-2000:],
+    }
+
+
+def head_sha(repo: Path) -> str:
+    head = (repo / ".pygit" / "HEAD").read_text().strip()
+    if head.startswith("ref: "):
+        return (repo / ".pygit" / head[5:]).read_text().strip()
+    return head
+
+
+def run_suite(repo: Path, args: argparse.Namespace, trace: Path | None = None) -> dict:
+    """
+    Generates the tree in repo and times every phase on it.
+
+    :return: The tree description and the metrics of every phase.
+    """
+    tree = SyntheticTree(repo, args)
+    start = time.perf_counter()
+    tree.generate()
+    generated = time.perf_counter() - start
+    pygit = repo / ".pygit"
+    phases = []
+
+    def phase(name: str, argv: List[str]):
+        before = count_objects(pygit)
+        result = run_phase(repo, argv, trace)
+        result["objects_written"] = count_objects(pygit) - before
+        phases.append({"name": name, "argv": argv, **result})
+        if result["exit_code"] != 0:
+            print(f"{name}: exit {result['exit_code']}", file=sys.stderr)
+            print(result.get("stderr", ""), file=sys.stderr)
+        elif trace is None:
+            print(f"  {name:<20} {result['wall_s']:>9.3f}s", file=sys.stderr)
+
+    jobs = ["-j", str(args.jobs)] if args.jobs else []
+    phase("init", ["init"])
+    phase("add", ["add", ".", *jobs])
+    phase("commit", ["commit", "-m", "initial"])
+    first = head_sha(repo)
+    phase("status-clean", ["status", *jobs])
+    modified, added, deleted = tree.mutate()
+    phase("status-dirty", ["status", *jobs])
+    phase("add-incremental", ["add", ".", *jobs])
+    phase("commit-incremental", ["commit", "-m", "changes"])
+    second = head_sha(repo)
+    phase("diff-stat", ["diff", "--stat", first, second])
+    phase("checkout-back", ["checkout", first, *jobs])
+    phase("checkout-forward", ["checkout", "main", *jobs])
+    return {
+        "generate_s": round(generated, 3),
+        "tree": {
+            "files": len(tree.files),
+            "bytes": sum((repo / path).stat().st_size for path in tree.files),
+            "modified": modified,
+            "added": added,
+            "deleted": deleted,
+        },
+        "phases": phases,
+    }
+
+
+def strace_calls(path: Path) -> int | None:
+    # the "total" line of strace -c: % time, seconds, usecs/call, calls, errors, "total"
+    try:
+        f = open(path)
+    except FileNotFoundError:
+        return None
+    with f:
+        for line in f:
+            fields = line.split()
+            if fields and fields[-1] == "total":
+                return int(fields[3])
+    return None
+
+
+def revision() -> str | None:
+    try:
+        sha = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=MAIN.parent,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            cwd=MAIN.parent,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return sha + ("-dirty" if dirty else "")
+
+
+def benchmark(args: argparse.Namespace) -> dict:
+    runs = []
+    workdir = Path(args.workdir) if args.workdir else None
+    for i in range(args.repeat):
+        repo = Path(tempfile.mkdtemp(prefix="pygit-bench-", dir=workdir))
+        print(f"run {i + 1}/{args.repeat} in {repo}", file=sys.stderr)
+        try:
+            runs.append(run_suite(repo, args))
+        finally:
+            if not args.keep:
+                shutil.rmtree(repo, ignore_errors=True)
+
+    # median of every metric over the runs, the runs are kept as they are too
+    phases = []
+    for i, first in enumerate(runs[0]["phases"]):
+        merged = {"name": first["name"], "argv": first["argv"]}
+        for metric in (
+            "wall_s",
+            "user_s",
+            "sys_s",
+            "max_rss_kb",
+            "objects_written",
+            "read_syscalls",
+            "write_syscalls",
+        ):
+            values = [run["phases"][i].get(metric) for run in runs]
+            values = [value for value in values if value is not None]
+            merged[metric] = round(statistics.median(values), 4) if values else None
+        merged["exit_code"] = max(run["phases"][i]["exit_code"] for run in runs)
+        phases.append(merged)
+
+    source = "read+write"
+    if args.strace:
+        if shutil.which("strace") is None:
+            print(
+                "strace isn't installed, only read and write syscalls are counted",
+                file=sys.stderr,
+            )
+        else:
+            # a run of its own, tracing slows every syscall down and would skew the times
+            repo = Path(tempfile.mkdtemp(prefix="pygit-bench-", dir=workdir))
+            trace = repo.with_suffix(".strace")
+            print(f"strace run in {repo}", file=sys.stderr)
+            try:
+                traced = run_suite(repo, args, trace)
+            finally:
+                shutil.rmtree(repo, ignore_errors=True)
+                trace.unlink(missing_ok=True)
+            for merged, phase in zip(phases, traced["phases"]):
+                merged["syscalls"] = phase["syscalls"]
+            source = "strace"
+    if source == "read+write":
+        for merged in phases:
+            counts = (merged["read_syscalls"], merged["write_syscalls"])
+            merged["syscalls"] = None if None in counts else sum(counts)
+
+    return {
+        "revision": revision(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        # which syscalls "syscalls" counts, all of them only with --strace
+        "syscalls_source": source,
+        "params": {
+            name: getattr(args, name)
+            for name in (
+                "files",
+                "depth",
+                "per_dir",
+                "size_median",
+                "size_max",
+                "binary_ratio",
+                "change_rate",
+                "seed",
+                "jobs",
+                "repeat",
+            )
+        },
+        "tree": runs[0]["tree"],
+        "phases": phases,
+        "runs": runs,
+    }
+
+
+def compare(old_path: str, new_path: str):
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    # the number of runs doesn't change what is measured
+    if {**old["params"], "repeat": None} != {**new["params"], "repeat": None}:
+        print("warning: the runs used different parameters", file=sys.stderr)
+    if old.get("syscalls_source") != new.get("syscalls_source"):
+        print("warning: the syscalls were counted differently", file=sys.stderr)
+    print(f"{old.get('revision')} -> {new.get('revision')}")
+    old_phases = {phase["name"]: phase for phase in old["phases"]}
+    print(f"{'phase':<20} {'metric':<16} {'old':>12} {'new':>12} {'change':>8}")
+    for phase in new["phases"]:
+        before = old_phases.get(phase["name"])
+        if before is None:
+            continue
+        for metric in METRICS:
+            a, b = before.get(metric), phase.get(metric)
+            if a is None or b is None:
+                continue
+            change = f"{(b - a) / a * 100:+.1f}%" if a else ""
+            print(f"{phase['name']:<20} {metric:<16} {a:>12g} {b:>12g} {change:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=10_000)
+    parser.add_argument("--depth", type=int, default=3, help="directory levels")
+    parser.add_argument(
+        "--per-dir", type=int, default=32, help="files in every leaf directory"
+    )
+    parser.add_argument(
+        "--size-median", type=int, default=4096, help="median file size, in bytes"
+    )
+    parser.add_argument("--size-max", type=int, default=4 << 20)
+    parser.add_argument("--binary-ratio", type=float, default=0.05)
+    parser.add_argument(
+        "--change-rate",
+        type=float,
+        default=0.01,
+        help="share of the files modified before the incremental phases",
+    )
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument(
+        "-j", "--jobs", type=int, help="passed to add, status and checkout"
+    )
+    parser.add_argument("--repeat", type=int, default=1, help="runs, medians are kept")
+    parser.add_argument(
+        "--strace", action="store_true", help="count every syscall in an extra run"
+    )
+    parser.add_argument("--workdir", help="directory the trees are generated in")
+    parser.add_argument("--keep", action="store_true", help="keep the generated trees")
+    parser.add_argument("--out", help="JSON results file, printed if not given")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"))
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    results = benchmark(args)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+# benchmark for Commit.build_tree on a synthetic index with a lot of paths
+# run from src/python: python -m test.bench_tree --paths 1000000
+
+import argparse
+import hashlib
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from lib import Commit
+from pygit import pygit
+
+
+def synthetic_entries(paths: int, fanout: int):
+    # three levels of directories with `fanout` children each, the files spread over the leaves
+    entries = []
+    for i in range(paths):
+        top, rest = divmod(i, fanout * fanout * fanout)
+        mid, rest = divmod(rest, fanout * fanout)
+        leaf = rest // fanout
+        sha = hashlib.sha1(str(i).encode("utf-8")).hexdigest()
+        entries.append((f"d{top}/d{mid}/d{leaf}/file{i}.txt", sha, "100644"))
+    entries.sort()
+    return entries
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--paths", type=int, default=1_000_000)
+    parser.add_argument("--fanout", type=int, default=20)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    entries = synthetic_entries(args.paths, args.fanout)
+    print(f"generated {len(entries)} paths in {time.perf_counter() - start:.2f}s")
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as repo:
+        os.chdir(repo)
+        try:
+            git = pygit()
+            git.init()
+            commit = Commit(pygit=Path(".pygit"))
+            commit.list_of_tuples = entries
+
+            start = time.perf_counter()
+            root = commit.create_tree_from_index()
+            print(f"cold build: {time.perf_counter() - start:.2f}s, root tree {root}")
+
+            # one changed file, only its three directories and the root are rebuilt
+            path, _, mode = entries[len(entries) // 2]
+            entries[len(entries) // 2] = (path, "0" * 40, mode)
+            commit.index.invalidate_tree(path)
+            start = time.perf_counter()
+            root = commit.create_tree_from_index()
+            print(f"one change: {time.perf_counter() - start:.2f}s, root tree {root}")
+        finally:
+            os.chdir(cwd)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+# shared setup of the unit tests, a fresh repository in a temp directory
+# run from src/python: python -m unittest discover -s test -t .
+
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+from pygit import pygit
+
+
+class RepoTestCase(unittest.TestCase):
+    """
+    Runs every test in an initialized repository of its own, as the working directory.
+    """
+
+    def setUp(self):
+        self.old_cwd = os.getcwd()
+        self.root = Path(tempfile.mkdtemp(prefix="pygit-test-"))
+        os.chdir(self.root)
+        self.git = pygit()
+        self.pygit = self.git.pygit
+        self.run_git("init")
+
+    def tearDown(self):
+        os.chdir(self.old_cwd)
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def run_git(self, command: str, *args, **kwargs) -> str:
+        # a pygit command as main.py runs it, with what it prints
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            getattr(self.git, command)(*args, **kwargs)
+        return out.getvalue()
+
+    def write(self, path: str, content: str | bytes):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(content.encode("utf-8") if isinstance(content, str) else content)
+
+    def commit(self, message: str = "commit") -> str:
+        self.run_git("add", ["."], jobs=1)
+        self.run_git("commit", message)
+        with open(self.pygit / "refs" / "heads" / "main") as f:
+            return f.read().strip()
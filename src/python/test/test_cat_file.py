@@ -0,0 +1,36 @@
+import unittest
+
+from lib import ObjectDatabase
+from test.helpers import RepoTestCase
+
+
+class CatFileTest(RepoTestCase):
+    def test_tree_prints_every_entry(self):
+        self.write("a.txt", "a\n")
+        self.write("bin.dat", b"\0\1\2")
+        self.write("d/e.txt", "e\n")
+        commit = self.commit()
+        tree = ObjectDatabase(self.pygit / "objects").read_commit(commit)["tree"]
+
+        lines = self.run_git("cat_file", tree, "-p").splitlines()
+
+        self.assertEqual(len(lines), 3)
+        self.assertRegex(lines[0], r"^100644 blob [0-9a-f]{40}\ta\.txt$")
+        self.assertRegex(lines[1], r"^100644 blob [0-9a-f]{40}\tbin\.dat$")
+        self.assertRegex(lines[2], r"^040000 tree [0-9a-f]{40}\td$")
+
+    def test_type_through_refs(self):
+        self.write("a.txt", "a\n")
+        self.commit()
+        self.assertEqual(self.run_git("cat_file", "HEAD", "-t"), "commit\n")
+        self.assertEqual(self.run_git("cat_file", "main", "-t"), "commit\n")
+
+    def test_unknown_name(self):
+        self.assertEqual(
+            self.run_git("cat_file", "abc", "-p"),
+            "fatal: Not a valid object name abc\n",
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+import contextlib
+import io
+import os
+import time
+import unittest
+
+from lib import Gc, ObjectStore, parse_expiry
+from refs import Refs
+from test.helpers import RepoTestCase
+
+SIGNATURE = "a <a@example.com> 0 +0000"
+
+
+class GcTest(RepoTestCase):
+    def setUp(self):
+        super().setUp()
+        self.store = ObjectStore(self.pygit / "objects")
+
+    def write_commit(self, tree: str) -> str:
+        content = f"tree {tree}\nauthor {SIGNATURE}\ncommitter {SIGNATURE}\n\nmsg\n"
+        return self.store.write_object("commit", content.encode("utf-8"))
+
+    def prune(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            Gc(self.pygit, jobs=2).prune(parse_expiry("now"))
+
+    def test_history_survives_prune(self):
+        self.write("a.txt", "a\n")
+        self.write("d/b.txt", "b\n")
+        self.commit("one")
+        # the blob of a deleted file is still reachable from the first commit
+        os.remove("a.txt")
+        self.commit("two")
+        orphan = self.store.write_object("blob", b"nothing points here\n")
+        reachable = Gc(self.pygit).reachable()
+        self.assertNotIn(orphan, reachable)
+
+        self.prune()
+
+        store = ObjectStore(self.pygit / "objects")
+        self.assertFalse(store.has(orphan))
+        for sha in reachable:
+            self.assertTrue(store.has(sha), sha)
+
+    def test_recent_objects_are_kept(self):
+        orphan = self.store.write_object("blob", b"just written\n")
+        with contextlib.redirect_stdout(io.StringIO()):
+            Gc(self.pygit).prune(time.time() - 3600)
+        self.assertTrue(ObjectStore(self.pygit / "objects").has(orphan))
+
+    def test_zero_padded_tree_mode(self):
+        blob = self.store.write_object("blob", b"inside\n")
+        subtree = self.store.write_object("tree", b"100644 f\0" + bytes.fromhex(blob))
+        # some writers pad the mode of a subtree to six digits
+        root = self.store.write_object("tree", b"040000 d\0" + bytes.fromhex(subtree))
+        commit = self.write_commit(root)
+        Refs(self.pygit).update_ref("refs/heads/padded", commit, "test")
+
+        reachable = Gc(self.pygit).reachable()
+
+        self.assertLessEqual({commit, root, subtree, blob}, reachable)
+
+    def test_annotated_tag_keeps_its_commit(self):
+        blob = self.store.write_object("blob", b"tagged\n")
+        tree = self.store.write_object("tree", b"100644 f\0" + bytes.fromhex(blob))
+        commit = self.write_commit(tree)
+        tag = self.store.write_object(
+            "tag",
+            f"object {commit}\ntype commit\ntag v1\ntagger {SIGNATURE}\n\nv1\n".encode(
+                "utf-8"
+            ),
+        )
+        Refs(self.pygit).update_ref("refs/tags/v1", tag, "test")
+
+        self.assertLessEqual({tag, commit, tree, blob}, Gc(self.pygit).reachable())
+
+
+if __name__ == "__main__":
+    unittest.main()
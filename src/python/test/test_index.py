@@ -0,0 +1,143 @@
+import hashlib
+import tempfile
+import unittest
+from pathlib import Path
+
+from lib import Index, IndexFile
+
+FIELDS = ("hash", "mode", "size", "mtime_ns", "ctime_ns", "ino")
+
+
+def make_entry(i: int, mode: str = "100644") -> dict:
+    return {
+        "hash": hashlib.sha1(str(i).encode("utf-8")).hexdigest(),
+        "mode": mode,
+        "size": 100 + i,
+        "mtime_ns": 1_700_000_000_123_456_789 + i,
+        "ctime_ns": 1_700_000_000_987_654_321 + i,
+        "ino": 4000 + i,
+    }
+
+
+class IndexFileTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmp.name) / "index"
+        # names of every length around the 8 byte padding, in subdirectories and not
+        self.entries = sorted(
+            (f"{'d/' * (i % 3)}{'n' * (i % 11 + 1)}{i}.txt", make_entry(i))
+            for i in range(40)
+        )
+        self.entries.append(("zz/link", make_entry(40, "120000")))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def load(self, data: bytes) -> IndexFile:
+        self.path.write_bytes(data)
+        index = IndexFile(self.path)
+        self.addCleanup(index.close)
+        return index
+
+    def assertEntries(self, index: IndexFile, expected: list):
+        read = list(index)
+        self.assertEqual([path for path, _ in read], [path for path, _ in expected])
+        for (path, entry), (_, want) in zip(read, expected):
+            self.assertEqual({key: entry[key] for key in FIELDS}, want, path)
+
+    def test_round_trip(self):
+        index = self.load(
+            IndexFile.serialize(self.entries, {b"TREE": b"payload", b"FSMN": b"42"})
+        )
+
+        self.assertEqual(len(index), len(self.entries))
+        self.assertEntries(index, self.entries)
+        self.assertEqual(index.extensions[b"TREE"], b"payload")
+        self.assertEqual(index.extensions[b"FSMN"], b"42")
+        for path, entry in self.entries:
+            self.assertEqual(index.lookup(path)["hash"], entry["hash"])
+        self.assertIsNone(index.lookup("d/missing.txt"))
+
+    def test_splice_matches_a_full_write(self):
+        index = self.load(IndexFile.serialize(self.entries))
+        staged = sorted(
+            [
+                (self.entries[0][0], None),
+                (self.entries[7][0], make_entry(100)),
+                ("d/added.txt", make_entry(101)),
+                (self.entries[-1][0], None),
+                ("zzz.txt", make_entry(102)),
+            ]
+        )
+        merged = dict(self.entries)
+        for path, entry in staged:
+            if entry is None:
+                del merged[path]
+            else:
+                merged[path] = entry
+        expected = sorted(merged.items())
+
+        spliced = index.splice(staged)
+
+        self.assertEqual(bytes(spliced), bytes(IndexFile.serialize(expected)))
+        self.assertEntries(self.load(spliced), expected)
+
+    def test_corrupt_index_is_rejected(self):
+        data = IndexFile.serialize(self.entries)
+        data[20] ^= 1
+        self.path.write_bytes(data)
+        with self.assertRaises(ValueError):
+            IndexFile(self.path)
+
+
+class IndexTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+        (self.root / "objects").mkdir()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def open_index(self) -> Index:
+        index = Index(index_path=self.root / "index", obj_dir=self.root / "objects")
+        self.addCleanup(lambda: index.base and index.base.close())
+        return index
+
+    def test_extensions_survive_a_reload(self):
+        index = self.open_index()
+        # the cache-tree only hands out trees that are in the object store
+        root, d, e = (
+            index.store.write_object("tree", f"100644 {name}\0".encode() + bytes(20))
+            for name in ("root", "d", "e")
+        )
+        with index.transaction():
+            for i, path in enumerate(["a.txt", "d/b.txt", "d/e/c.txt"]):
+                index.set_entry(path, make_entry(i))
+            index.update_cache_tree("", 3, root)
+            index.update_cache_tree("d", 2, d)
+            index.update_cache_tree("d/e", 1, e)
+            index.set_fsmonitor_token("token 7")
+
+        reloaded = self.open_index()
+        self.assertEqual(
+            [path for path, _ in reloaded.iter_entries()],
+            ["a.txt", "d/b.txt", "d/e/c.txt"],
+        )
+        self.assertEqual(reloaded.cached_tree(""), (3, root))
+        self.assertEqual(reloaded.cached_tree("d"), (2, d))
+        self.assertEqual(reloaded.cached_tree("d/e"), (1, e))
+        self.assertEqual(reloaded.fsmonitor_token, "token 7")
+
+        # a staged change invalidates the trees above it, and only those
+        with reloaded.transaction():
+            reloaded.set_entry("d/b.txt", make_entry(9))
+        again = self.open_index()
+        self.assertIsNone(again.cached_tree(""))
+        self.assertIsNone(again.cached_tree("d"))
+        self.assertEqual(again.cached_tree("d/e"), (1, e))
+        self.assertEqual(again.get_entry("d/b.txt")["hash"], make_entry(9)["hash"])
+
+
+if __name__ == "__main__":
+    unittest.main()
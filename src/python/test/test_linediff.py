@@ -0,0 +1,34 @@
+import random
+import unittest
+
+from linediff import count_changes, diff_bytes, diff_lines
+
+
+class LineDiffTest(unittest.TestCase):
+    def test_small_change(self):
+        a = b"one\ntwo\nthree\n"
+        b = b"one\n2\nthree\nfour\n"
+        for algorithm in ("myers", "histogram"):
+            _, _, blocks = diff_bytes(a, b, algorithm)
+            self.assertEqual(blocks, [(1, 2, 1, 2), (3, 3, 3, 4)], algorithm)
+
+    def test_large_file_with_scattered_edits(self):
+        # the replacements are copies of other lines, so no line is set aside as only on one side
+        rng = random.Random(7)
+        a = [f"line {i}\n".encode() for i in range(60_000)]
+        b = list(a)
+        edited = rng.sample(range(len(a)), 600)
+        for i in edited:
+            b[i] = a[rng.randrange(len(a))]
+        changed = sum(a[i] != b[i] for i in edited)
+
+        for algorithm in ("myers", "histogram"):
+            inserted, deleted = count_changes(diff_lines(a, b, algorithm))
+            # a replaced line can line up with a neighbour, never more than that changes
+            self.assertLessEqual(inserted, changed, algorithm)
+            self.assertLessEqual(deleted, changed, algorithm)
+            self.assertGreater(inserted, changed // 2, algorithm)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from lib import BULK_PACK_MIN, ObjectStore
+
+
+class BulkTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.obj_dir = Path(self.tmp.name) / "objects"
+        self.obj_dir.mkdir()
+        self.store = ObjectStore(self.obj_dir)
+
+    def tearDown(self):
+        self.store.close_packs()
+        self.tmp.cleanup()
+
+    def blobs(self, count: int) -> list:
+        return [f"blob {i}\n".encode("utf-8") for i in range(count)]
+
+    def test_many_objects_go_into_one_pack(self):
+        with self.store.bulk():
+            hashes = [self.store.write_object("blob", blob) for blob in self.blobs(300)]
+            self.assertTrue(all(self.store.has(hash) for hash in hashes))
+
+        self.assertEqual(len(list(self.obj_dir.glob("pack/pack-*.idx"))), 1)
+        self.assertEqual(list(self.store.iter_loose()), [])
+        reopened = ObjectStore(self.obj_dir)
+        for hash, blob in zip(hashes, self.blobs(300)):
+            self.assertEqual(reopened.read(hash), ("blob", blob))
+        reopened.close_packs()
+
+    def test_few_objects_stay_loose(self):
+        with self.store.bulk():
+            hashes = [
+                self.store.write_object("blob", blob)
+                for blob in self.blobs(BULK_PACK_MIN - 1)
+            ]
+
+        self.assertFalse((self.obj_dir / "pack").exists())
+        self.assertEqual(sorted(self.store.iter_loose()), sorted(hashes))
+
+    def test_read_inside_bulk(self):
+        with self.store.bulk():
+            hashes = [self.store.write_object("blob", blob) for blob in self.blobs(300)]
+            self.assertEqual(self.store.read(hashes[0]), ("blob", b"blob 0\n"))
+            self.assertEqual(self.store.read_header(hashes[-1]), ("blob", 9))
+            more = self.store.write_object("blob", b"after the read\n")
+        self.assertEqual(self.store.read(more), ("blob", b"after the read\n"))
+
+    def test_failed_bulk_leaves_nothing(self):
+        with self.assertRaises(RuntimeError), self.store.bulk():
+            for blob in self.blobs(300):
+                self.store.write_object("blob", blob)
+            raise RuntimeError("stop")
+
+        self.assertEqual(list((self.obj_dir / "pack").iterdir()), [])
+        self.assertEqual(list(self.store.iter_loose()), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,130 @@
+import hashlib
+import random
+import tempfile
+import unittest
+from pathlib import Path
+
+from pack import (
+    OFS_DELTA,
+    Pack,
+    PackWriter,
+    apply_delta,
+    create_delta,
+    index_pack,
+    read_entry_header,
+    write_pack,
+)
+
+
+def object_name(obj_type: str, content: bytes) -> str:
+    return hashlib.sha1(f"{obj_type} {len(content)}\0".encode() + content).hexdigest()
+
+
+class PackTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.pack_dir = Path(self.tmp.name) / "pack"
+        rng = random.Random(3)
+        base = bytes(rng.randrange(256) for _ in range(4000))
+        # versions of one file, so most of them become deltas, and a few other objects
+        contents = [("blob", base)]
+        for i in range(12):
+            edited = bytearray(contents[-1][1])
+            pos = rng.randrange(len(edited) - 16)
+            edited[pos : pos + 16] = f"edit {i:11}".encode()
+            contents.append(("blob", bytes(edited)))
+        contents += [
+            ("blob", b""),
+            ("tree", b"100644 a\0" + bytes(20)),
+            ("commit", b"tree " + b"0" * 40 + b"\n\nmsg\n"),
+        ]
+        self.objects = {object_name(t, c): (t, c) for t, c in contents}
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def open_pack(self, idx_path: Path) -> Pack:
+        pack = Pack(idx_path)
+        self.addCleanup(pack.close)
+        return pack
+
+    def assertReadsBack(self, pack: Pack):
+        self.assertEqual(sorted(pack.names()), sorted(self.objects))
+        for hash, (obj_type, content) in self.objects.items():
+            self.assertIn(hash, pack)
+            self.assertEqual(pack.read(hash), (obj_type, content))
+            self.assertEqual(pack.read_header(hash), (obj_type, len(content)))
+        self.assertNotIn("0" * 40, pack)
+        self.assertIsNone(pack.read("0" * 40))
+
+    def write(self, **kwargs) -> Path:
+        return write_pack(
+            self.pack_dir,
+            [(hash, t, len(c)) for hash, (t, c) in self.objects.items()],
+            load=self.objects.__getitem__,
+            **kwargs,
+        )
+
+    def test_round_trip_with_deltas(self):
+        pack = self.open_pack(self.write())
+
+        self.assertReadsBack(pack)
+        types = [
+            read_entry_header(pack.data, pack.index.offset_at(i))[0]
+            for i in range(len(self.objects))
+        ]
+        self.assertGreater(types.count(OFS_DELTA), 5)
+
+    def test_depth_limits_the_chains(self):
+        pack = self.open_pack(self.write(depth=1))
+        self.assertReadsBack(pack)
+
+    def test_index_pack_rebuilds_the_idx(self):
+        idx_path = self.write()
+        written = idx_path.read_bytes()
+        idx_path.unlink()
+
+        rebuilt, count = index_pack(idx_path.with_suffix(".pack"))
+
+        self.assertEqual(rebuilt, idx_path)
+        self.assertEqual(count, len(self.objects))
+        self.assertEqual(rebuilt.read_bytes(), written)
+        self.assertReadsBack(self.open_pack(rebuilt))
+
+    def test_pack_writer(self):
+        writer = PackWriter(self.pack_dir)
+        for hash, (obj_type, content) in self.objects.items():
+            writer.add(hash, obj_type, content)
+        idx_path = writer.finish()
+
+        self.assertReadsBack(self.open_pack(idx_path))
+        self.assertEqual(
+            sorted(p.name for p in self.pack_dir.iterdir()),
+            sorted([idx_path.name, idx_path.with_suffix(".pack").name]),
+        )
+        written = idx_path.read_bytes()
+        idx_path.unlink()
+        self.assertEqual(
+            index_pack(idx_path.with_suffix(".pack"))[0].read_bytes(), written
+        )
+
+    def test_corrupt_pack_is_rejected(self):
+        idx_path = self.write(window=0)
+        pack_path = idx_path.with_suffix(".pack")
+        data = bytearray(pack_path.read_bytes())
+        data[40] ^= 1
+        pack_path.write_bytes(data)
+        with self.assertRaises(ValueError):
+            index_pack(pack_path)
+
+    def test_delta(self):
+        base = b"".join(f"line {i}\n".encode() for i in range(200))
+        target = base[:500] + b"inserted\n" + base[700:] + b"tail\n"
+        delta = create_delta(base, target)
+        self.assertLess(len(delta), len(target) // 4)
+        self.assertEqual(apply_delta(base, delta), target)
+        self.assertIsNone(create_delta(base, target, max_size=4))
+
+
+if __name__ == "__main__":
+    unittest.main()
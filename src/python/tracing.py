@@ -0,0 +1,288 @@
+# PYGIT_TRACE: spans, timers and counters of a pygit run, written as JSON lines or a Chrome trace
+import atexit
+import contextlib
+import cProfile
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from typing import Callable, Dict, List
+
+TRACE_ENV = "PYGIT_TRACE"
+FORMAT_ENV = "PYGIT_TRACE_FORMAT"
+PROFILE_ENV = "PYGIT_TRACE_PROFILE"
+FORMATS = ("jsonl", "chrome")
+
+# the running tracer, None while tracing is off
+tracer: "Tracer | None" = None
+# functions marked with timed, wrapped once tracing starts
+registered: List[Callable] = []
+NULL_SPAN = contextlib.nullcontext()
+
+
+class Tracer:
+    """
+    Collects the spans, timers and counters of one process and writes them when it exits.
+
+    A span is one named region with its start and duration, nested spans of a thread
+    fall inside each other. A timer adds up a region that runs too often to keep
+    every run, like the hash of each file, into a count and a total time. Counters
+    only add up.
+
+    JSON lines are appended, so the runs of several commands can share a file. A
+    Chrome trace, for chrome://tracing or Perfetto, is one document per run.
+    """
+
+    def __init__(
+        self, path: str, format: str = "jsonl", profile: str | None = None
+    ) -> None:
+        if format not in FORMATS:
+            raise ValueError(f"Unknown trace format '{format}', use one of {FORMATS}")
+        self.path = path
+        self.format = format
+        self.pid = os.getpid()
+        self.started = time.time()
+        self.start_ns = time.perf_counter_ns()
+        # (name, start ns, end ns, thread, args)
+        self.spans: List[tuple] = []
+        # name -> [count, total ns]
+        self.timers: Dict[str, List[int]] = {}
+        self.counters: Dict[str, int] = {}
+        self.lock = threading.Lock()
+        self.profile_path = profile
+        self.profiler = None
+        if profile:
+            # cProfile only sees the thread that enabled it, the main one
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def add_span(self, name: str, start: int, end: int, args: dict):
+        # list.append is atomic, spans of worker threads need no lock
+        self.spans.append((name, start, end, threading.get_native_id(), args))
+
+    def add_time(self, name: str, elapsed: int):
+        with self.lock:
+            timer = self.timers.get(name)
+            if timer is None:
+                self.timers[name] = [1, elapsed]
+            else:
+                timer[0] += 1
+                timer[1] += elapsed
+
+    def count(self, name: str, n: int):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def write(self):
+        end = time.perf_counter_ns()
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.profile_path)
+        if not self.path:
+            return
+        # the whole process, every other span falls inside it
+        spans = [
+            (
+                "pygit " + " ".join(sys.argv[1:]),
+                self.start_ns,
+                end,
+                threading.main_thread().native_id,
+                {},
+            ),
+            *self.spans,
+        ]
+        if self.format == "chrome":
+            out = self.chrome(spans, end)
+        else:
+            out = self.json_lines(spans)
+        if self.path in ("1", "2"):
+            sys.stderr.write(out)
+            sys.stderr.flush()
+            return
+        with open(self.path, "w" if self.format == "chrome" else "a") as f:
+            f.write(out)
+
+    def json_lines(self, spans: List[tuple]) -> str:
+        lines = [
+            {
+                "type": "process",
+                "pid": self.pid,
+                "argv": sys.argv[1:],
+                "started": self.started,
+            }
+        ]
+        for name, start, end, thread, args in spans:
+            lines.append(
+                {
+                    "type": "span",
+                    "pid": self.pid,
+                    "name": name,
+                    "thread": thread,
+                    "start_ms": round((start - self.start_ns) / 1e6, 3),
+                    "duration_ms": round((end - start) / 1e6, 3),
+                    **({"args": args} if args else {}),
+                }
+            )
+        for name, (count, total) in sorted(self.timers.items()):
+            lines.append(
+                {
+                    "type": "timer",
+                    "pid": self.pid,
+                    "name": name,
+                    "count": count,
+                    "total_ms": round(total / 1e6, 3),
+                }
+            )
+        for name, value in sorted(self.counters.items()):
+            lines.append(
+                {"type": "counter", "pid": self.pid, "name": name, "value": value}
+            )
+        return "".join(json.dumps(line) + "\n" for line in lines)
+
+    def chrome(self, spans: List[tuple], end: int) -> str:
+        events = [
+            {
+                "name": name,
+                "cat": "pygit",
+                "ph": "X",
+                "ts": (start - self.start_ns) / 1e3,
+                "dur": (stop - start) / 1e3,
+                "pid": self.pid,
+                "tid": thread,
+                "args": args,
+            }
+            for name, start, stop, thread, args in spans
+        ]
+        if self.counters:
+            events.append(
+                {
+                    "name": "counters",
+                    "ph": "C",
+                    "ts": (end - self.start_ns) / 1e3,
+                    "pid": self.pid,
+                    "args": self.counters,
+                }
+            )
+        return json.dumps(
+            {
+                "traceEvents": events,
+                "displayTimeUnit": "ms",
+                "otherData": {
+                    "argv": sys.argv[1:],
+                    "timers": {
+                        name: {"count": count, "total_ms": round(total / 1e6, 3)}
+                        for name, (count, total) in sorted(self.timers.items())
+                    },
+                    "counters": self.counters,
+                },
+            }
+        )
+
+
+class Span:
+    __slots__ = ("name", "args", "start")
+
+    def __init__(self, name: str, args: dict) -> None:
+        self.name = name
+        self.args = args
+
+    def __enter__(self) -> "Span":
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *_):
+        tracer.add_span(self.name, self.start, time.perf_counter_ns(), self.args)
+
+
+def span(name: str, **args):
+    """
+    Times a region as a span, with args saved along, when tracing is on.
+    """
+    if tracer is None:
+        return NULL_SPAN
+    return Span(name, args)
+
+
+def count(name: str, n: int = 1):
+    if tracer is not None:
+        tracer.count(name, n)
+
+
+def enabled() -> bool:
+    return tracer is not None
+
+
+def timed(name: str) -> Callable:
+    """
+    Marks a function that runs too often for spans, its runs add up into a timer.
+
+    The function is left as it is while tracing is off, it is only replaced by a
+    timing wrapper when tracing starts, so it costs nothing otherwise.
+    """
+
+    def mark(func: Callable) -> Callable:
+        func.trace_name = name
+        if tracer is not None:
+            return wrap(func)
+        registered.append(func)
+        return func
+
+    return mark
+
+
+def wrap(func: Callable) -> Callable:
+    name = func.trace_name
+
+    @functools.wraps(func)
+    def timing(*args, **kwargs):
+        start = time.perf_counter_ns()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            tracer.add_time(name, time.perf_counter_ns() - start)
+
+    return timing
+
+
+def instrument(func: Callable):
+    # the class or module the function was defined in gets the wrapper in its place
+    owner = sys.modules[func.__module__]
+    *path, attr = func.__qualname__.split(".")
+    for part in path:
+        owner = getattr(owner, part)
+    if isinstance(owner.__dict__.get(attr), staticmethod):
+        setattr(owner, attr, staticmethod(wrap(func)))
+    else:
+        setattr(owner, attr, wrap(func))
+
+
+def start(path: str | None, format: str | None = None, profile: str | None = None):
+    """
+    Turns tracing on for the rest of the process.
+
+    :param path: Trace file, "1" or "2" for stderr, None for only a profile.
+    :param format: "jsonl" or "chrome", by default chrome for a .json file and jsonl otherwise.
+    :param profile: File the cProfile stats of the main thread are dumped to, for pstats.
+    """
+    global tracer
+    if tracer is not None:
+        return
+    if format is None:
+        format = "chrome" if path and path.endswith(".json") else "jsonl"
+    tracer = Tracer(path, format, profile)
+    for func in registered:
+        instrument(func)
+    registered.clear()
+    atexit.register(tracer.write)
+
+
+def start_from_env():
+    path = os.environ.get(TRACE_ENV)
+    profile = os.environ.get(PROFILE_ENV)
+    if path in (None, "", "0", "false") and not profile:
+        return
+    if path in ("true", "yes"):
+        path = "2"
+    start(path or None, os.environ.get(FORMAT_ENV) or None, profile)
@@ -0,0 +1,99 @@
+# parallel walk of the working tree
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator, Tuple
+
+from ignore import Ignore
+
+# marks the end of the walk in the result queue
+WALK_DONE = object()
+
+
+class Walker:
+    """
+    Streams the files of the working tree as (path, stat) pairs.
+
+    Directories are read with os.scandir, which tells files from directories without a
+    stat call, and every subdirectory is scanned as its own task on a thread pool. The
+    stat of each file is taken once, through its DirEntry, and handed on with the path
+    so nothing after the walk has to stat the file again. The files of a directory go
+    through a queue as one batch as soon as the directory is read, in no particular
+    order, a queue handoff per file would cost more than the stat itself.
+    """
+
+    def __init__(self, ignore: Ignore | None = None, jobs: int | None = None) -> None:
+        self.ignore = ignore or Ignore()
+        self.jobs = jobs or os.cpu_count() or 1
+
+    def walk(
+        self, paths: Iterable[str] = (".",)
+    ) -> Iterator[Tuple[str, os.stat_result]]:
+        """
+        :param paths: Files or directories to walk, relative to the repo root.
+        :return: (path, stat) of every file that isn't ignored, path relative to the root without "./".
+        """
+        results: queue.SimpleQueue = queue.SimpleQueue()
+        pending = [0]
+        lock = threading.Lock()
+
+        def done():
+            with lock:
+                pending[0] -= 1
+                if pending[0] == 0:
+                    results.put(WALK_DONE)
+
+        def scan(directory: str):
+            try:
+                prefix = "" if directory == "" else directory + "/"
+                found = []
+                with os.scandir(directory or ".") as entries:
+                    for entry in entries:
+                        path = prefix + entry.name
+                        if entry.is_dir(follow_symlinks=False):
+                            if not self.ignore.is_ignored(path, True):
+                                submit(path)
+                        # symlinks are kept as links, whatever they point to
+                        elif (
+                            entry.is_file(follow_symlinks=False) or entry.is_symlink()
+                        ) and not self.ignore.is_ignored(path):
+                            found.append((path, entry.stat(follow_symlinks=False)))
+                results.put(found)
+            except BaseException as e:
+                results.put(e)
+            finally:
+                done()
+
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+
+            def submit(directory: str):
+                with lock:
+                    pending[0] += 1
+                pool.submit(scan, directory)
+
+            # the explicit paths are one more pending task until all of them are queued
+            with lock:
+                pending[0] += 1
+            try:
+                for path in paths:
+                    path = os.path.normpath(path)
+                    path = "" if path == "." else path
+                    is_dir = os.path.isdir(path) and not os.path.islink(path)
+                    if path and self.ignore.is_ignored(path, is_dir):
+                        continue
+                    if path == "" or is_dir:
+                        submit(path)
+                    else:
+                        try:
+                            results.put([(path, os.lstat(path))])
+                        except FileNotFoundError:
+                            # gone from the working tree, add drops its index entry
+                            pass
+            finally:
+                done()
+
+            while (item := results.get()) is not WALK_DONE:
+                if isinstance(item, BaseException):
+                    raise item
+                yield from item